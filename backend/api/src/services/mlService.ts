@@ -10,6 +10,8 @@ import axios, { AxiosInstance } from "axios";
 // ML Service configuration
 const ML_SERVICE_URL = process.env.ML_SERVICE_URL || "http://192.168.1.12:8000";
 const ML_SERVICE_TIMEOUT = parseInt(process.env.ML_SERVICE_TIMEOUT || "120000"); // 120 seconds (2 minutes) default - heatmaps with many cells can take time
+// Fetch heatmaps as cached web-mercator tiles (see getHeatmapTiles)
+const ML_HEATMAP_USE_TILES = process.env.ML_HEATMAP_USE_TILES === "true";
 
 // Create axios instance for ML service
 const mlClient: AxiosInstance = axios.create({
@@ -83,6 +85,10 @@ export async function getHeatmap(
     const queryLocalHour =
       localHour !== undefined ? localHour : new Date().getHours();
 
+    if (ML_HEATMAP_USE_TILES && !includeClusters) {
+      return await getHeatmapTiles(lat, lng, radius, gridSize, queryLocalHour);
+    }
+
     const response = await mlClient.get("/ml/heatmap", {
       params: {
         lat,
@@ -120,6 +126,99 @@ export async function getHeatmap(
   }
 }
 
+// Last tile response per URL, revalidated with If-None-Match
+const tileCache = new Map<string, { etag: string; data: any }>();
+const TILE_CACHE_MAX = 500;
+
+function lngToTileX(lng: number, zoom: number): number {
+  return Math.floor(((lng + 180) / 360) * 2 ** zoom);
+}
+
+function latToTileY(lat: number, zoom: number): number {
+  const latRad = (Math.max(-85.0511, Math.min(85.0511, lat)) * Math.PI) / 180;
+  return Math.floor(
+    ((1 - Math.log(Math.tan(latRad) + 1 / Math.cos(latRad)) / Math.PI) / 2) * 2 ** zoom
+  );
+}
+
+function distanceMeters(lat1: number, lng1: number, lat2: number, lng2: number): number {
+  const toRad = (d: number) => (d * Math.PI) / 180;
+  const dLat = toRad(lat2 - lat1);
+  const dLng = toRad(lng2 - lng1);
+  const a =
+    Math.sin(dLat / 2) ** 2 +
+    Math.cos(toRad(lat1)) * Math.cos(toRad(lat2)) * Math.sin(dLng / 2) ** 2;
+  return 6371000 * 2 * Math.atan2(Math.sqrt(a), Math.sqrt(1 - a));
+}
+
+async function getHeatmapTile(z: number, x: number, y: number, localHour: number, gridSize: number) {
+  const url = `/ml/heatmap/tiles/${z}/${x}/${y}?local_hour=${localHour}&grid_size=${gridSize}`;
+  const cached = tileCache.get(url);
+  const response = await mlClient.get(url, {
+    headers: cached ? { "If-None-Match": cached.etag } : {},
+    validateStatus: (status) => status === 200 || status === 304,
+  });
+  if (response.status === 304 && cached) {
+    return cached.data;
+  }
+  if (tileCache.size >= TILE_CACHE_MAX) {
+    const oldest = tileCache.keys().next().value;
+    if (oldest !== undefined) tileCache.delete(oldest);
+  }
+  tileCache.set(url, { etag: response.headers["etag"], data: response.data });
+  return response.data;
+}
+
+/**
+ * Get heatmap data by fetching the covering web-mercator tiles in parallel
+ *
+ * Same response shape as getHeatmap (without clusters). Tiles are cached on
+ * the ML side and revalidated here with ETags, so panning only recomputes
+ * tiles that actually changed.
+ */
+export async function getHeatmapTiles(
+  lat: number,
+  lng: number,
+  radius: number = 1000,
+  gridSize: number = 100,
+  localHour?: number
+) {
+  const queryLocalHour = localHour !== undefined ? localHour : new Date().getHours();
+  // Zoom whose tiles are about as wide as the view radius (<= ~9 tiles per view)
+  const metersPerTileAtZ0 = 40075016 * Math.cos((lat * Math.PI) / 180);
+  const zoom = Math.max(0, Math.min(18, Math.floor(Math.log2(metersPerTileAtZ0 / Math.max(radius, 100)))));
+
+  const dLat = radius / 111320;
+  const dLng = radius / (111320 * Math.max(0.01, Math.cos((lat * Math.PI) / 180)));
+  const xMin = lngToTileX(lng - dLng, zoom);
+  const xMax = lngToTileX(lng + dLng, zoom);
+  const yMin = latToTileY(lat + dLat, zoom);
+  const yMax = latToTileY(lat - dLat, zoom);
+
+  const requests: Promise<any>[] = [];
+  for (let x = xMin; x <= xMax; x++) {
+    for (let y = yMin; y <= yMax; y++) {
+      requests.push(getHeatmapTile(zoom, x, y, queryLocalHour, gridSize));
+    }
+  }
+  const tiles = await Promise.all(requests);
+  const cells = tiles
+    .flatMap((tile) => tile.cells || [])
+    .filter((cell: any) => distanceMeters(lat, lng, cell.lat, cell.lng) <= radius);
+
+  return {
+    success: true,
+    heatmap: {
+      center: { lat, lng },
+      radius,
+      grid_size: gridSize,
+      cells,
+      clusters: [],
+    },
+    timestamp: new Date().toISOString(),
+  };
+}
+
 /**
  * Get risk score for a location from ML service
  */
@@ -143,6 +242,34 @@ export async function getRiskScore(lat: number, lng: number) {
   }
 }
 
+/**
+ * Get risk scores for many locations in one ML service call
+ * (one shared incident fetch + one vectorized scoring pass on the ML side)
+ */
+export async function getRiskScores(
+  points: Array<{ lat: number; lng: number; local_hour?: number }>
+) {
+  try {
+    const response = await mlClient.post("/ml/risk-score/batch", { points });
+    return response.data;
+  } catch (error: any) {
+    console.error("ML Service batch risk score request failed:", error.message);
+    // Return fallback safe scores if ML service is unavailable
+    return {
+      success: false,
+      count: points.length,
+      results: points.map((p) => ({
+        success: false,
+        location: { lat: p.lat, lng: p.lng },
+        risk_score: 0.0,
+        risk_level: "very_safe",
+        factors: {},
+      })),
+      error: "ML service unavailable",
+    };
+  }
+}
+
 /**
  * Analyze routes for safety
  */
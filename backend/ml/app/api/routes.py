@@ -2,7 +2,9 @@
 API Route Handlers
 """
 
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Header, HTTPException, Query, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from typing import Optional
 from datetime import datetime, timezone
 
@@ -11,6 +13,8 @@ from app.api.schemas import (
     ProcessIncidentResponse,
     HeatmapResponse,
     RiskScoreResponse,
+    BatchRiskScoreRequest,
+    BatchRiskScoreResponse,
     AnalyzeRoutesRequest,
     AnalyzeRoutesResponse,
     TrainModelRequest,
@@ -65,6 +69,8 @@ async def get_heatmap(
     ),
     include_time_factor: bool = Query(True, description="Include time-of-day risk factors"),
     include_clusters: bool = Query(False, description="Include unsafe-zone clusters (admin use)"),
+    mode: str = Query("cells", pattern="^(cells|kde)$", description="cells: incident-bearing cells; kde: every cell in the view (FFT convolution)"),
+    accept: Optional[str] = Header(None),
 ):
     """
     Get safety heatmap data for a geographic area
@@ -82,6 +88,18 @@ async def get_heatmap(
     - Grid cells with risk scores (0-5) calculated for local time
     - Identified unsafe zone clusters
     - Risk levels for visualization
+    
+    With "Accept: application/x-ndjson" the heatmap is streamed as one JSON
+    object per line at the requested grid size with no cell cap (see
+    app.ml.heatmap.stream_heatmap).
+    
+    With "Accept: application/x-heatmap-columns" (packed little-endian
+    columns) or "Accept: application/x-msgpack" the cells are returned in a
+    compact binary encoding without clusters (see app.ml.heatmap_encoding).
+    
+    With mode=kde every cell of the view is scored by FFT convolution of
+    the rasterized incident weights (see app.ml.heatmap_kde); the grid is
+    coarsened to stay within heatmap_kde_max_cells.
     """
     try:
         from app.ml.heatmap import generate_heatmap
@@ -116,8 +134,45 @@ async def get_heatmap(
         else:
             query_local_hour = datetime.now().hour
         
+        from app.ml import warmup
+        warmup.record_request(lat, lng, radius, grid_size)
+
+        # KDE responses are JSON only
+        if mode == "kde":
+            from app.ml.heatmap_kde import generate_kde_heatmap
+            logger.info(f"Generating KDE heatmap: center=({lat}, {lng}), radius={radius}m, grid_size={grid_size}m, local_hour={query_local_hour}")
+            heatmap_data = await run_in_threadpool(
+                generate_kde_heatmap, lat, lng, radius, grid_size, query_timestamp, query_local_hour,
+                include_clusters,
+            )
+            return HeatmapResponse(success=True, heatmap=heatmap_data, timestamp=query_timestamp)
+
+        from app.ml import heatmap_encoding
+        binary_media_type = heatmap_encoding.negotiate(accept)
+        if binary_media_type is not None:
+            from app.ml.heatmap import heatmap_columns
+            columns_data = await run_in_threadpool(
+                heatmap_columns, lat, lng, radius, grid_size, query_timestamp, query_local_hour
+            )
+            try:
+                body = heatmap_encoding.encode(columns_data, binary_media_type)
+            except ImportError:
+                raise HTTPException(status_code=406, detail=f"{binary_media_type} is not available on this server")
+            return Response(content=body, media_type=binary_media_type)
+
+        if accept and "application/x-ndjson" in accept:
+            from app.ml.heatmap import stream_heatmap
+            logger.info(f"Streaming heatmap: center=({lat}, {lng}), radius={radius}m, grid_size={grid_size}m, local_hour={query_local_hour}")
+            return StreamingResponse(
+                stream_heatmap(lat, lng, radius, grid_size, query_timestamp, query_local_hour, include_clusters),
+                media_type="application/x-ndjson",
+            )
+
         logger.info(f"Generating time-based heatmap: center=({lat}, {lng}), radius={radius}m, grid_size={grid_size}m, local_hour={query_local_hour} (LOCAL TIME)")
-        heatmap_data = generate_heatmap(
+        # CPU-bound: run off the event loop (large views also fan out to the
+        # scoring process pool, see app.ml.parallel_scoring)
+        heatmap_data = await run_in_threadpool(
+            generate_heatmap,
             lat,
             lng,
             radius,
@@ -136,6 +191,8 @@ async def get_heatmap(
             heatmap=heatmap_data,
             timestamp=query_timestamp,
         )
+    except HTTPException:
+        raise
     except Exception as e:
         import logging
         logger = logging.getLogger(__name__)
@@ -143,16 +200,140 @@ async def get_heatmap(
         raise HTTPException(status_code=500, detail=f"Failed to generate heatmap: {str(e)}")
 
 
+@router.get("/heatmap/hours", response_model=HeatmapResponse)
+async def get_heatmap_hours(
+    lat: float = Query(..., ge=-90, le=90, description="Latitude"),
+    lng: float = Query(..., ge=-180, le=180, description="Longitude"),
+    radius: int = Query(1000, ge=100, le=50000, description="Radius in meters (max 50km)"),
+    grid_size: int = Query(100, ge=50, le=1000, description="Grid cell size in meters"),
+    timestamp: Optional[str] = Query(None, description="ISO timestamp (recency reference)"),
+):
+    """
+    Get heatmap risk for all 24 LOCAL hours (time slider)
+    
+    One request instead of one /heatmap call per local_hour: distance and
+    recency terms are computed once and combined with the hour-similarity
+    matrix for every hour.
+    
+    Returns:
+    - Cells (same fields as /heatmap) with risk_scores and risk_levels
+      lists indexed by local hour 0-23 instead of a single risk_score
+    """
+    try:
+        from app.ml.heatmap import generate_heatmap_hours
+
+        query_timestamp = datetime.now(timezone.utc)
+        if timestamp:
+            try:
+                from dateutil import parser
+                query_timestamp = parser.isoparse(timestamp)
+            except Exception:
+                pass
+
+        return HeatmapResponse(
+            success=True,
+            heatmap=await run_in_threadpool(generate_heatmap_hours, lat, lng, radius, grid_size, query_timestamp),
+            timestamp=query_timestamp,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate hourly heatmap: {str(e)}")
+
+
+@router.get("/heatmap/delta")
+async def get_heatmap_delta(
+    since: str = Query(..., description="Version token of the client's current heatmap (heatmap.version)"),
+    lat: float = Query(..., ge=-90, le=90, description="Latitude"),
+    lng: float = Query(..., ge=-180, le=180, description="Longitude"),
+    radius: int = Query(1000, ge=100, le=50000, description="Radius in meters (max 50km)"),
+    grid_size: int = Query(100, ge=50, le=1000, description="Grid cell size in meters"),
+    local_hour: Optional[int] = Query(None, ge=0, le=23, description="LOCAL hour (0-23) for time-based risk calculation"),
+):
+    """
+    Get the heatmap cells changed since a data version
+    
+    Pass the version (and the same view parameters) of the last /heatmap
+    response. Returns only the cells touched by incident writes after that
+    version, keyed by cell id.
+    
+    Returns:
+    - version: new version to pass as `since` next time
+    - added / changed: cells (same shape as /heatmap cells, with id)
+    - removed: ids of cells no longer in the view
+    - full_refresh: true (with a reason) when the change log no longer covers
+      `since` or it was issued by another worker process; refetch /heatmap
+      instead
+    """
+    from app.ml import heatmap_delta
+
+    try:
+        query_local_hour = local_hour if local_hour is not None else datetime.now().hour
+        return {
+            "success": True,
+            "delta": await run_in_threadpool(
+                heatmap_delta.get_delta, since, lat, lng, radius, grid_size, query_local_hour
+            ),
+            "timestamp": datetime.now(timezone.utc),
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate heatmap delta: {str(e)}")
+
+
+@router.get("/heatmap/tiles/{z}/{x}/{y}")
+async def get_heatmap_tile(
+    z: int,
+    x: int,
+    y: int,
+    local_hour: Optional[int] = Query(None, ge=0, le=23, description="LOCAL hour (0-23) for time-based risk calculation"),
+    grid_size: Optional[int] = Query(None, ge=50, le=1000, description="Approximate cell size in meters"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Get heatmap cells for one web-mercator (XYZ) tile
+    
+    Cells whose incidents fall inside the tile, on a grid aligned to the
+    tile. Tiles are cached and only recomputed when an incident inside the
+    tile's 1km scoring buffer changes. Zooms below heatmap_tile_min_zoom
+    are rejected and cells per tile are capped at heatmap_tile_max_cells.
+    
+    Returns:
+    - Tile address and bounds, cells (same shape as /heatmap cells)
+    - ETag header; 304 Not Modified when If-None-Match matches
+    """
+    from app.config import settings
+    from app.ml import heatmap_tiles
+
+    if not (0 <= z <= heatmap_tiles.MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail=f"Invalid tile {z}/{x}/{y}")
+    if z < settings.heatmap_tile_min_zoom:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Zoom {z} is below {settings.heatmap_tile_min_zoom}; use /heatmap?mode=kde for large areas",
+        )
+    try:
+        query_local_hour = local_hour if local_hour is not None else datetime.now().hour
+        body, etag = await run_in_threadpool(heatmap_tiles.get_tile, z, x, y, query_local_hour, grid_size)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate heatmap tile: {str(e)}")
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @router.get("/risk-score", response_model=RiskScoreResponse)
 async def get_risk_score(
     lat: float = Query(..., ge=-90, le=90, description="Latitude"),
     lng: float = Query(..., ge=-180, le=180, description="Longitude"),
     local_hour: Optional[int] = Query(None, ge=0, le=23, description="LOCAL hour (0-23) for time-based risk"),
+    exact: bool = Query(False, description="Score from raw incidents instead of the precomputed risk raster"),
 ):
     """
     Get risk score for a specific location
     
     Supports time-based risk via local_hour: risk varies by hour of day.
+    By default answered from the precomputed risk raster (interpolated);
+    pass exact=true to score from raw incidents.
     
     Returns:
     - Risk score (0-5)
@@ -163,7 +344,7 @@ async def get_risk_score(
     try:
         from app.ml.risk_scoring import calculate_risk_score
         
-        risk_data = calculate_risk_score(lat, lng, local_hour=local_hour)
+        risk_data = calculate_risk_score(lat, lng, local_hour=local_hour, exact=exact)
         
         return RiskScoreResponse(
             success=True,
@@ -177,6 +358,41 @@ async def get_risk_score(
         raise HTTPException(status_code=500, detail=f"Failed to calculate risk score: {str(e)}")
 
 
+@router.post("/risk-score/batch", response_model=BatchRiskScoreResponse)
+async def get_risk_scores_batch(request: BatchRiskScoreRequest):
+    """
+    Get risk scores for many locations in one call
+    
+    All neighborhoods are fetched with a single incident query and scored in
+    one vectorized pass. Each point may carry its own local_hour.
+    
+    Returns:
+    - One result per input point (same shape as /risk-score), in request order
+    """
+    try:
+        from app.ml.risk_scoring import calculate_risk_scores
+        
+        risk_list = await run_in_threadpool(
+            calculate_risk_scores, [(p.lat, p.lng, p.local_hour) for p in request.points]
+        )
+        
+        results = [
+            RiskScoreResponse(
+                success=True,
+                location=Location(lat=p.lat, lng=p.lng),
+                risk_score=risk_data["risk_score"],
+                risk_level=risk_data["risk_level"],
+                nearest_cluster=risk_data.get("nearest_cluster"),
+                factors=risk_data.get("factors", {}),
+            )
+            for p, risk_data in zip(request.points, risk_list)
+        ]
+        
+        return BatchRiskScoreResponse(success=True, count=len(results), results=results)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to calculate risk scores: {str(e)}")
+
+
 @router.post("/routes/analyze", response_model=AnalyzeRoutesResponse)
 async def analyze_routes(request: AnalyzeRoutesRequest):
     """
@@ -314,6 +530,8 @@ async def ml_health():
     try:
         from app.db.storage import get_incident_count
         from app.ml.models import get_model_status
+        from app.ml.risk_raster import get_raster_status
+        from app.ml import aggregates, heatmap_delta, heatmap_pyramid, risk_cache
         
         model_status = get_model_status()
         incident_count = get_incident_count()
@@ -323,8 +541,48 @@ async def ml_health():
             "models_loaded": model_status["loaded"],
             "last_training": model_status.get("last_training"),
             "incident_count": incident_count,
+            "risk_raster": get_raster_status(),
+            "aggregates": aggregates.get_status(),
+            "risk_cache": risk_cache.get_stats(),
+            "heatmap_pyramid": heatmap_pyramid.get_status(),
+            "heatmap_delta": heatmap_delta.get_status(),
             "version": "1.0.0",
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Health check failed: {str(e)}")
 
+
+@router.get("/ready")
+async def ml_ready():
+    """
+    Readiness check for load balancers
+    
+    Returns:
+    - 200 once the startup warm-up of hot viewports has finished
+      (or warm-up is disabled), 503 while it is still running
+    - Warm-up progress (state, tasks_done / tasks_total, tiles, risk_cells, errors)
+    """
+    from app.ml import warmup
+
+    status = warmup.get_status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def ml_metrics():
+    """
+    Per-stage timing metrics in Prometheus text format
+    
+    Returns:
+    - ml_stage_duration_seconds histograms (heatmap, risk_scoring,
+      route_analyzer, clustering and storage stages)
+    - ml_stage_rows_total / ml_stage_cells_total counters
+    - ml_http_request_duration_seconds histograms per route
+    - ml_risk_cache gauges
+    """
+    from app.ml import risk_cache
+    from app.utils import metrics
+
+    for stat, value in risk_cache.get_stats().items():
+        metrics.set_gauge("ml_risk_cache", value, stat=stat)
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -52,6 +52,18 @@ class AnalyzeRoutesRequest(BaseModel):
     routes: List[RouteRequest]
 
 
+class RiskScorePoint(BaseModel):
+    """Single location in a batch risk-score request"""
+    lat: float = Field(..., ge=-90, le=90, description="Latitude")
+    lng: float = Field(..., ge=-180, le=180, description="Longitude")
+    local_hour: Optional[int] = Field(None, ge=0, le=23, description="LOCAL hour (0-23) for time-based risk")
+
+
+class BatchRiskScoreRequest(BaseModel):
+    """Request to score many locations at once"""
+    points: List[RiskScorePoint] = Field(..., min_length=1, max_length=1000)
+
+
 class TrainModelRequest(BaseModel):
     """Request to train models"""
     force: bool = False
@@ -105,6 +117,13 @@ class RiskScoreResponse(BaseModel):
     factors: dict
 
 
+class BatchRiskScoreResponse(BaseModel):
+    """Batch risk score response (results are in request order)"""
+    success: bool
+    count: int
+    results: List[RiskScoreResponse]
+
+
 class RouteSegment(BaseModel):
     """High-risk route segment"""
     start: Location
@@ -2,6 +2,8 @@
 Configuration management for ML Service
 """
 
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 
 
@@ -18,8 +20,23 @@ class Settings(BaseSettings):
     cache_ttl: int = 300  # seconds
 
     # Clustering Parameters (DBSCAN)
-    dbscan_eps: float = 0.001  # ~100 meters in degrees
+    dbscan_eps: float = 0.001  # ~111 meters in degrees (used when dbscan_eps_meters is unset)
+    dbscan_eps_meters: Optional[float] = None  # neighborhood radius in meters (haversine)
     dbscan_min_samples: int = 3
+    # Maintain clusters incrementally on incident ingest (otherwise every new
+    # incident drops them and the next request re-clusters the whole table)
+    dbscan_incremental: bool = True
+    # Persist clusters to unsafe_zones: loaded on startup instead of refitting,
+    # and cluster viewport queries are answered by PostGIS so workers share one fit
+    cluster_store_enabled: bool = True
+    # Processes that lose the unsafe_zones writer election reload its zones
+    # this often (and after incident changes) instead of fitting
+    cluster_reader_reload_seconds: int = 60
+    # Background cluster worker: re-scoring, persisting and refits off the request
+    # path; requests within the debounce window are coalesced into one run
+    cluster_worker_enabled: bool = True
+    cluster_recompute_debounce_seconds: float = 2.0
+    cluster_recompute_max_delay_seconds: float = 30.0
 
     # Risk Scoring Weights (optimized for better variation)
     weight_incident_density: float = 0.5  # Increased - density is most important
@@ -45,9 +62,97 @@ class Settings(BaseSettings):
     # Minimum time-of-day weight to avoid hard zeroing (keeps a small residual influence).
     time_of_day_min_weight: float = 0.05
 
+    # In-process incident snapshot (NumPy columns + KD-tree) serving radius/bbox
+    # queries from memory. Reloaded from the database when older than max age
+    # so writes made by other worker processes are picked up (0 = never).
+    incident_snapshot_enabled: bool = True
+    incident_snapshot_max_age_seconds: int = 300
+
+    # Precomputed risk raster (fixed metric grid x 24 local hours)
+    # Point queries (/ml/risk-score, route analysis, clusters) are answered by
+    # bilinear lookup when the point lies inside the raster bounds.
+    risk_raster_enabled: bool = True
+    # Raster bounds (default: Chennai metropolitan area)
+    risk_raster_lat_min: float = 12.80
+    risk_raster_lat_max: float = 13.35
+    risk_raster_lng_min: float = 80.05
+    risk_raster_lng_max: float = 80.35
+    risk_raster_cell_meters: float = 200.0
+    # Nodes per tile edge; ingests rebuild only the tiles within the scoring radius
+    risk_raster_tile_nodes: int = 16
+    # Full rebuild interval (keeps recency decay current)
+    risk_raster_refresh_seconds: int = 900
+
+    # Incremental decayed aggregates (grid cell x incident local hour)
+    # Approximate O(cells) scoring used for points outside the risk raster and
+    # for heatmap views at least aggregate_heatmap_min_radius meters wide.
+    aggregates_enabled: bool = True
+    aggregate_cell_meters: float = 100.0
+    aggregate_heatmap_min_radius: int = 20000
+    # Rebuilt in the background when older than this, so writes made by other
+    # worker processes are picked up (0 = never)
+    aggregates_max_age_seconds: int = 300
+
+    # Spatially quantized risk-score cache (LRU + TTL, entries live cache_ttl seconds)
+    # Current-time point queries are snapped to cells of risk_cache_cell_meters.
+    risk_cache_enabled: bool = True
+    risk_cache_max_entries: int = 20000
+    risk_cache_cell_meters: float = 25.0
+
+    # Per-stage timing histograms and row/cell counters served at /ml/metrics
+    metrics_enabled: bool = True
+
     # Heatmap Configuration
     default_grid_size: int = 100  # meters per cell
     default_radius: int = 1000  # meters
+    # Latitude at which global grid cells (app.utils.grid) are square
+    # (default: middle of the risk raster bounds)
+    grid_reference_lat: Optional[float] = None
+
+    # Multi-resolution heatmap pyramid (base cells rolled up 2x per level:
+    # 50m, 100m, 200m, ... ) maintained by a background worker
+    heatmap_pyramid_enabled: bool = True
+    heatmap_pyramid_base_cell_meters: float = 50.0
+    heatmap_pyramid_levels: int = 7  # 50m .. 3200m
+    heatmap_pyramid_refresh_seconds: int = 900
+
+    # On-demand heatmap cells shared across views (global grid cell x local
+    # hour x incident-store version, entries live cache_ttl seconds; 0 = off)
+    heatmap_cell_cache_max_entries: int = 50000
+
+    # Heatmap tiles (/ml/heatmap/tiles/{z}/{x}/{y}): rendered-tile cache
+    heatmap_tile_cache_max_entries: int = 2000
+    heatmap_tile_cache_ttl: int = 900  # seconds (keeps recency decay current)
+    # Low-zoom tiles cover whole regions: zooms below the minimum are rejected
+    # (use /ml/heatmap?mode=kde) and cells per tile are capped
+    heatmap_tile_min_zoom: int = 8
+    heatmap_tile_max_cells: int = 4096
+
+    # Process-pool scoring for large heatmaps (0 workers = one per CPU, 1 = off)
+    heatmap_parallel_workers: int = 0
+    heatmap_parallel_min_cells: int = 1500
+
+    # KDE heatmap mode (/ml/heatmap?mode=kde): FFT convolution on a metric raster
+    heatmap_kde_max_cells: int = 20000  # output cells per view
+    heatmap_kde_raster_meters: float = 50.0  # finest raster step
+    heatmap_kde_max_raster: int = 2048  # raster cells per side
+
+    # Heatmap delta change log (entries kept for /ml/heatmap/delta)
+    heatmap_delta_log_size: int = 5000
+
+    # Startup warm-up of hot viewports (GET /ml/ready answers 503 until done)
+    warmup_enabled: bool = True
+    # "lat,lng[,radius_m[,grid_size_m]]" separated by ";"
+    # (default: Chennai Central, Marina Beach, Koyambedu)
+    warmup_viewports: str = "13.0827,80.2707;13.0500,80.2824;13.0694,80.1948"
+    warmup_hours: str = ""  # comma-separated LOCAL hours (empty = current and next hour)
+    # Also warm the most requested /ml/heatmap views of previous runs
+    warmup_from_history: bool = True
+    warmup_history_path: str = "./models/warmup_history.json"
+    warmup_history_top: int = 10
+    warmup_tile_zoom: int = 15  # XYZ tiles rendered per viewport (0 = skip)
+    warmup_risk_radius: float = 300.0  # meters of risk-cache cells per viewport (0 = skip)
+    warmup_pyramid_wait_seconds: int = 300
 
     # Land / city boundary masking (GeoJSON polygon containment)
     # Enabled to filter out sea/water areas from heatmap
@@ -16,6 +16,17 @@ logger = logging.getLogger(__name__)
 _connection_pool: Optional[pool.ThreadedConnectionPool] = None
 
 
+def _connect_params() -> dict:
+    return dict(
+        host=settings.db_host,
+        port=settings.db_port,
+        database=settings.db_name,
+        user=settings.db_user,
+        password=settings.db_password,
+        sslmode='require' if settings.db_ssl else 'prefer'
+    )
+
+
 def init_connection_pool():
     """Initialize database connection pool"""
     global _connection_pool
@@ -24,16 +35,7 @@ def init_connection_pool():
         return
     
     try:
-        _connection_pool = pool.ThreadedConnectionPool(
-            minconn=1,
-            maxconn=10,
-            host=settings.db_host,
-            port=settings.db_port,
-            database=settings.db_name,
-            user=settings.db_user,
-            password=settings.db_password,
-            sslmode='require' if settings.db_ssl else 'prefer'
-        )
+        _connection_pool = pool.ThreadedConnectionPool(minconn=1, maxconn=10, **_connect_params())
         logger.info("Database connection pool initialized")
     except Exception as e:
         logger.error(f"Failed to initialize database connection pool: {e}")
@@ -50,6 +52,17 @@ def close_connection_pool():
         logger.info("Database connection pool closed")
 
 
+def open_dedicated_connection() -> psycopg2.extensions.connection:
+    """
+    New autocommit connection outside the pool (caller closes it)
+
+    For session state that must outlive a request, e.g. advisory locks.
+    """
+    conn = psycopg2.connect(**_connect_params())
+    conn.autocommit = True
+    return conn
+
+
 @contextmanager
 def get_db_connection() -> Generator[psycopg2.extensions.connection, None, None]:
     """
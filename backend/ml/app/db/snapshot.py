@@ -0,0 +1,398 @@
+"""
+In-process incident snapshot (read model)
+
+Holds every incident as NumPy columns plus a KD-tree over a local metric
+projection, so radius and bounding-box queries are answered from memory
+instead of a PostGIS round trip.
+
+- Loaded at startup (load_snapshot) and kept current by app.db.storage,
+  which applies every add / verification / clear write to it.
+- New incidents go to a small append buffer that is scanned linearly; the
+  buffer is merged into the indexed arrays once it grows past a threshold.
+- get_version() is a monotonically increasing counter bumped on every
+  change; caches key on it to detect staleness.
+- Other worker processes write to the same database, so a snapshot older
+  than incident_snapshot_max_age_seconds is reloaded in the background
+  (stale data keeps being served meanwhile; writes applied while the reload
+  queries the database are replayed onto the new snapshot). Rows the reload
+  adds, re-verifies or drops are announced through storage's change
+  notifications, so the data version and derived caches follow them.
+"""
+
+import logging
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from app.config import settings
+from app.ml import risk_kernel
+
+logger = logging.getLogger(__name__)
+
+# Merge the append buffer into the index when it exceeds this many rows
+# (or 5% of the indexed rows, whichever is larger)
+_MIN_MERGE_ROWS = 256
+
+_state: Optional[Dict] = None
+_version = 0
+_lock = threading.RLock()
+_reloading = False
+# Changes applied while a load is querying the database, one list per load
+# in progress (replayed onto the loaded state before it is swapped in)
+_recorders: List[List[Tuple[str, Dict]]] = []
+
+
+# ==================== Building ====================
+
+def _build_state(rows: List[Dict]) -> Dict:
+    """Columns + KD-tree for a list of incident rows (sorted newest first)"""
+    columns = risk_kernel.incidents_to_columns(rows)
+    if columns["lat"].shape[0] != len(rows):
+        # Drop rows incidents_to_columns could not decode so indices stay aligned
+        rows = [r for r in rows if _has_coordinates(r)]
+        columns = risk_kernel.incidents_to_columns(rows)
+
+    order = np.argsort(-np.nan_to_num(columns["ts"], nan=-np.inf), kind="stable")
+    rows = [rows[i] for i in order]
+    columns = risk_kernel.take_columns(columns, order)
+
+    lat0 = float(np.mean(columns["lat"])) if rows else 0.0
+    tree = None
+    if rows:
+        x, y = risk_kernel.project_equirectangular(columns["lat"], columns["lng"], lat0)
+        tree = cKDTree(np.column_stack((x, y)))
+
+    return {
+        "rows": rows,
+        "columns": columns,
+        "ids": {r["id"]: i for i, r in enumerate(rows)},
+        "lat0": lat0,
+        "tree": tree,
+        "pending": [],  # appended rows not yet in the index
+        "loaded_at": time.time(),
+    }
+
+
+def _has_coordinates(row: Dict) -> bool:
+    try:
+        float(row["latitude"])
+        float(row["longitude"])
+        return True
+    except Exception:
+        return False
+
+
+def load_snapshot() -> int:
+    """
+    (Re)load the snapshot from the database
+
+    Returns:
+        Number of incidents loaded
+    """
+    global _state, _version
+    from app.db.storage import _notify_change, _query_incidents
+
+    started = time.perf_counter()
+    changes: List[Tuple[str, Dict]] = []
+    with _lock:
+        _recorders.append(changes)
+    try:
+        state = _build_state(_query_incidents())
+    finally:
+        with _lock:
+            _recorders.remove(changes)
+    with _lock:
+        # Writes made during the query may or may not be in its result;
+        # replaying them is idempotent
+        for event, incident in changes:
+            state = _apply(state, event, incident) or state
+        # Writes made by other worker processes since the last load
+        external = _diff(_state, state) if _state is not None else []
+        _state = state
+        _version += 1
+    logger.info(
+        f"Incident snapshot loaded: {len(state['rows'])} incidents "
+        f"in {time.perf_counter() - started:.2f}s (version {_version})"
+    )
+    for event, incident in external:
+        _notify_change(event, incident)
+    return len(state["rows"])
+
+
+def _diff(old: Dict, new: Dict) -> List[Tuple[str, Dict]]:
+    """Changes turning old into new, as storage change events"""
+    old_rows = {r["id"]: r for r in old["rows"] + old["pending"]}
+    new_rows = new["rows"] + new["pending"]
+    if old_rows and not new_rows:
+        return [("cleared", {})]
+    changes: List[Tuple[str, Dict]] = []
+    new_ids = set()
+    for row in new_rows:
+        new_ids.add(row["id"])
+        before = old_rows.get(row["id"])
+        if before is None:
+            changes.append(("added", dict(row)))
+        elif (before.get("verified"), before.get("moderation_reason")) != (
+            row.get("verified"), row.get("moderation_reason")
+        ):
+            changes.append(("verification", dict(row)))
+    changes.extend(("removed", dict(r)) for i, r in old_rows.items() if i not in new_ids)
+    return changes
+
+
+def _reload_in_background() -> None:
+    global _reloading
+    try:
+        load_snapshot()
+    except Exception as e:
+        logger.error(f"Incident snapshot reload failed: {e}")
+    finally:
+        _reloading = False
+
+
+def _check_staleness(state: Dict) -> None:
+    global _reloading
+    max_age = int(getattr(settings, "incident_snapshot_max_age_seconds", 0))
+    if max_age <= 0 or _reloading or time.time() - state["loaded_at"] < max_age:
+        return
+    _reloading = True
+    threading.Thread(target=_reload_in_background, name="incident-snapshot-reload", daemon=True).start()
+
+
+def is_ready() -> bool:
+    """True once the snapshot is loaded and enabled"""
+    return _state is not None and bool(getattr(settings, "incident_snapshot_enabled", True))
+
+
+def get_version() -> int:
+    """Monotonic data version (bumped on every load and incident change)"""
+    return _version
+
+
+def get_count() -> int:
+    state = _state
+    if state is None:
+        return 0
+    return len(state["rows"]) + len(state["pending"])
+
+
+# ==================== Change application ====================
+
+def _merge_pending(state: Dict) -> Dict:
+    """Rebuild the index with the append buffer folded in"""
+    return _build_state(state["rows"] + state["pending"])
+
+
+def _apply(state: Dict, event: str, incident: Dict) -> Optional[Dict]:
+    """Apply one change to state; returns the resulting state, None if nothing changed"""
+    if event == "cleared":
+        return _build_state([])
+    if event == "removed":
+        # Only announced by a reload, whose state no longer has the row
+        return None
+    if event == "added":
+        if incident["id"] in state["ids"] or any(p["id"] == incident["id"] for p in state["pending"]):
+            return None
+        state["pending"].append(dict(incident))
+        threshold = max(_MIN_MERGE_ROWS, len(state["rows"]) // 20)
+        if len(state["pending"]) > threshold:
+            return _merge_pending(state)
+        return state
+    if event == "verification":
+        idx = state["ids"].get(incident["id"])
+        row = state["rows"][idx] if idx is not None else next(
+            (p for p in state["pending"] if p["id"] == incident["id"]), None
+        )
+        if row is None:
+            return None
+        row["verified"] = incident.get("verified")
+        row["moderation_reason"] = incident.get("moderation_reason")
+    return state
+
+
+def apply_change(event: str, incident: Dict) -> None:
+    """
+    Apply an incident write (same events as storage change listeners)
+
+    Args:
+        event: "added", "verification", "removed" or "cleared"
+        incident: Incident fields from the write
+    """
+    global _state, _version
+    with _lock:
+        for changes in _recorders:
+            changes.append((event, dict(incident)))
+        if _state is None:
+            return
+        state = _apply(_state, event, incident)
+        if state is None:
+            return
+        _state = state
+        _version += 1
+
+
+# ==================== Queries ====================
+
+def _pending_columns(state: Dict) -> Dict[str, np.ndarray]:
+    pending = state["pending"]
+    if not pending:
+        return risk_kernel.empty_columns()
+    cached = state.get("pending_columns")
+    if cached is not None and cached[0] == len(pending):
+        return cached[1]
+    columns = risk_kernel.incidents_to_columns(pending)
+    state["pending_columns"] = (len(pending), columns)
+    return columns
+
+
+def _radius_hits(state: Dict, lat: float, lng: float, radius_meters: float):
+    """(indexed_idx, pending_idx) within radius_meters (exact Haversine)"""
+    cols = state["columns"]
+    idx = np.empty(0, dtype=np.int64)
+    if state["tree"] is not None:
+        # Projection scale error is bounded by cos(lat0)/cos(lat); inflate the
+        # search radius to cover it, then filter exactly.
+        inflate = max(1.0, math.cos(math.radians(state["lat0"])) / max(0.01, math.cos(math.radians(abs(lat) + 1.0))))
+        x, y = risk_kernel.project_equirectangular(lat, lng, state["lat0"])
+        cand = np.asarray(state["tree"].query_ball_point([float(x), float(y)], r=radius_meters * inflate * 1.01 + 1.0), dtype=np.int64)
+        if cand.size:
+            d = risk_kernel.haversine_np(lat, lng, cols["lat"][cand], cols["lng"][cand])
+            idx = cand[d <= radius_meters]
+
+    pcols = _pending_columns(state)
+    pidx = np.empty(0, dtype=np.int64)
+    if pcols["lat"].size:
+        d = risk_kernel.haversine_np(lat, lng, pcols["lat"], pcols["lng"])
+        pidx = np.flatnonzero(d <= radius_meters)
+    return idx, pidx
+
+
+def _multi_radius_hits(state: Dict, lats: np.ndarray, lngs: np.ndarray, radius_meters: float):
+    """(indexed_idx, pending_idx) within radius_meters of ANY of the points"""
+    cols = state["columns"]
+    idx = np.empty(0, dtype=np.int64)
+    if state["tree"] is not None and lats.size:
+        pp, pi = risk_kernel.radius_pairs(lats, lngs, cols["lat"], cols["lng"], radius_meters)
+        if pi.size:
+            d = risk_kernel.haversine_np(lats[pp], lngs[pp], cols["lat"][pi], cols["lng"][pi])
+            idx = np.unique(pi[d <= radius_meters])
+
+    pcols = _pending_columns(state)
+    pidx = np.empty(0, dtype=np.int64)
+    if pcols["lat"].size and lats.size:
+        d = risk_kernel.haversine_np(lats[:, None], lngs[:, None], pcols["lat"][None, :], pcols["lng"][None, :])
+        pidx = np.flatnonzero((d <= radius_meters).any(axis=0))
+    return idx, pidx
+
+
+def _bbox_hits(state: Dict, lat_min, lat_max, lng_min, lng_max, start_ts, end_ts):
+    def _mask(cols: Dict[str, np.ndarray]) -> np.ndarray:
+        m = np.ones(cols["lat"].shape[0], dtype=bool)
+        if lat_min is not None:
+            m &= cols["lat"] >= lat_min
+        if lat_max is not None:
+            m &= cols["lat"] <= lat_max
+        if lng_min is not None:
+            m &= cols["lng"] >= lng_min
+        if lng_max is not None:
+            m &= cols["lng"] <= lng_max
+        if start_ts is not None:
+            m &= cols["ts"] >= start_ts
+        if end_ts is not None:
+            m &= cols["ts"] <= end_ts
+        return m
+
+    return np.flatnonzero(_mask(state["columns"])), np.flatnonzero(_mask(_pending_columns(state)))
+
+
+def _sort_key(row: Dict) -> float:
+    ts = risk_kernel.timestamp_to_epoch(row.get("timestamp"))
+    return -math.inf if math.isnan(ts) else ts
+
+
+def _gather_rows(state: Dict, idx: np.ndarray, pidx: np.ndarray) -> List[Dict]:
+    """Row copies for the hits, newest first (matches ORDER BY timestamp DESC)"""
+    rows = [dict(state["rows"][i]) for i in np.sort(idx)]
+    if pidx.size:
+        pcols = _pending_columns(state)
+        order = pidx[np.argsort(-np.nan_to_num(pcols["ts"][pidx], nan=-np.inf), kind="stable")]
+        extra = [dict(state["pending"][i]) for i in order]
+        # Indexed rows are already sorted; merge the (small) pending set in
+        rows = sorted(rows + extra, key=_sort_key, reverse=True)
+    return rows
+
+
+def _gather_columns(state: Dict, idx: np.ndarray, pidx: np.ndarray) -> Dict[str, np.ndarray]:
+    cols = risk_kernel.take_columns(state["columns"], idx)
+    if pidx.size:
+        pcols = risk_kernel.take_columns(_pending_columns(state), pidx)
+        cols = {k: np.concatenate([cols[k], pcols[k]]) for k in risk_kernel.COLUMNS}
+    return cols
+
+
+def query_radius_rows(lat: float, lng: float, radius_meters: float) -> List[Dict]:
+    """Incident dicts within radius_meters of (lat, lng), newest first"""
+    with _lock:
+        state = _state
+        _check_staleness(state)
+        return _gather_rows(state, *_radius_hits(state, lat, lng, radius_meters))
+
+
+def query_radius_columns(lat: float, lng: float, radius_meters: float) -> Dict[str, np.ndarray]:
+    """Incident columns within radius_meters of (lat, lng)"""
+    with _lock:
+        state = _state
+        _check_staleness(state)
+        return _gather_columns(state, *_radius_hits(state, lat, lng, radius_meters))
+
+
+def query_columns_near_points(lats, lngs, radius_meters: float) -> Dict[str, np.ndarray]:
+    """Incident columns within radius_meters of any of the points"""
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    with _lock:
+        state = _state
+        _check_staleness(state)
+        return _gather_columns(state, *_multi_radius_hits(state, lats, lngs, radius_meters))
+
+
+def query_rows_near_points(lats, lngs, radius_meters: float) -> List[Dict]:
+    """Incident dicts within radius_meters of any of the points, newest first"""
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    with _lock:
+        state = _state
+        _check_staleness(state)
+        return _gather_rows(state, *_multi_radius_hits(state, lats, lngs, radius_meters))
+
+
+def query_rows(
+    lat_min: Optional[float] = None,
+    lat_max: Optional[float] = None,
+    lng_min: Optional[float] = None,
+    lng_max: Optional[float] = None,
+    start_ts: Optional[float] = None,
+    end_ts: Optional[float] = None,
+) -> List[Dict]:
+    """Incident dicts inside optional bounds / time range, newest first"""
+    with _lock:
+        state = _state
+        _check_staleness(state)
+        return _gather_rows(state, *_bbox_hits(state, lat_min, lat_max, lng_min, lng_max, start_ts, end_ts))
+
+
+def query_columns(
+    lat_min: Optional[float] = None,
+    lat_max: Optional[float] = None,
+    lng_min: Optional[float] = None,
+    lng_max: Optional[float] = None,
+) -> Dict[str, np.ndarray]:
+    """Incident columns inside optional bounds"""
+    with _lock:
+        state = _state
+        _check_staleness(state)
+        return _gather_columns(state, *_bbox_hits(state, lat_min, lat_max, lng_min, lng_max, None, None))
@@ -2,17 +2,119 @@
 Database storage layer - replaces in-memory storage
 """
 
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Tuple
 from datetime import datetime, timezone, timedelta
-from app.db.connection import get_db_connection
+from app.db.connection import get_db_connection, open_dedicated_connection
+from app.db import snapshot
+from app.utils import metrics
 from app.api.schemas import IncidentRequest
+import numpy as np
 import psycopg2
 import psycopg2.extras
 import logging
+import threading
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
 
+# Callbacks notified after incident writes: fn(event, incident)
+# event is "added" or "verification" (incident has at least id/latitude/longitude),
+# "removed" (a row deleted by another worker process, seen on a snapshot
+# reload; same fields) or "cleared" (incident is an empty dict).
+_change_listeners: List[Callable[[str, Dict], None]] = []
 
+# Monotonic incident-store version, bumped once per write notification.
+# Starts at the process start time (ms) so versions handed out by an earlier
+# process are always older. Notifications are serialized, so listeners
+# calling get_data_version() see the version of the write they are handling.
+_data_version = int(time.time() * 1000)
+_notify_lock = threading.RLock()
+# Versions are only comparable within one process: tokens handed to clients
+# carry this process's epoch (see get_version_token)
+_epoch = uuid.uuid4().hex[:12]
+
+
+def register_change_listener(listener: Callable[[str, Dict], None]) -> None:
+    """Register a callback for incident writes (used to keep derived caches current)"""
+    if listener not in _change_listeners:
+        _change_listeners.append(listener)
+
+
+def get_data_version() -> int:
+    """
+    Current incident-store version
+
+    Waits for an in-flight write notification, so every listener for
+    versions <= the returned value has run.
+    """
+    with _notify_lock:
+        return _data_version
+
+
+def get_version_token(version: Optional[int] = None) -> str:
+    """
+    Client-facing token for a data version of this process ("epoch.version")
+
+    Args:
+        version: Data version (default: the current one)
+    """
+    return f"{_epoch}.{get_data_version() if version is None else int(version)}"
+
+
+def parse_version_token(token: str) -> Optional[int]:
+    """
+    Data version of a token from get_version_token
+
+    Returns:
+        The version, or None when the token was issued by another process
+        (or is malformed)
+    """
+    epoch, _, version = str(token).partition(".")
+    if epoch != _epoch:
+        return None
+    try:
+        return int(version)
+    except ValueError:
+        return None
+
+
+def _notify_change(event: str, incident: Dict) -> None:
+    global _data_version
+    with _notify_lock:
+        _data_version += 1
+        # The in-process snapshot is updated first so listeners read current data
+        try:
+            snapshot.apply_change(event, incident)
+        except Exception as e:
+            logger.error(f"Incident snapshot update failed ({event}): {e}")
+        for listener in list(_change_listeners):
+            try:
+                listener(event, incident)
+            except Exception as e:
+                # Derived caches must never break the write path
+                logger.error(f"Incident change listener failed ({event}): {e}")
+
+
+def _row_to_incident(row: Dict) -> Dict:
+    """Convert a RealDictCursor incidents row into an incident dictionary"""
+    return {
+        "id": row["id"],
+        "latitude": float(row["latitude"]),
+        "longitude": float(row["longitude"]),
+        "timestamp": row["timestamp"],
+        "timezone_offset_minutes": row.get("timezone_offset_minutes"),
+        "incident_local_hour": row.get("incident_local_hour"),
+        "type": row["type"],
+        "severity": row["severity"],
+        "category": row["category"],
+        "verified": row["verified"],
+        "moderation_reason": row.get("moderation_reason"),
+        "user_id": row["user_id"],
+    }
+
+
+@metrics.instrumented("storage.add_incident", count_rows=False)
 def add_incident(incident: IncidentRequest) -> str:
     """
     Add incident to database
@@ -69,12 +171,30 @@ def add_incident(incident: IncidentRequest) -> str:
                     ),
                 )
         logger.info(f"Incident {incident.id} added to database")
+        _notify_change(
+            "added",
+            {
+                "id": incident.id,
+                "latitude": float(incident.latitude),
+                "longitude": float(incident.longitude),
+                "timestamp": incident.timestamp,
+                "timezone_offset_minutes": tz_offset,
+                "incident_local_hour": incident_local_hour,
+                "type": incident.type,
+                "severity": incident.severity,
+                "category": incident.category,
+                "verified": incident.verified,
+                "moderation_reason": None,
+                "user_id": incident.user_id,
+            },
+        )
         return incident.id
     except Exception as e:
         logger.error(f"Failed to add incident: {e}")
         raise
 
 
+@metrics.instrumented("storage.get_incidents")
 def get_incidents(
     lat_min: Optional[float] = None,
     lat_max: Optional[float] = None,
@@ -85,6 +205,7 @@ def get_incidents(
 ) -> List[Dict]:
     """
     Get incidents with optional filtering
+    Served from the in-process snapshot when it is loaded.
     
     Args:
         lat_min, lat_max: Latitude bounds
@@ -94,6 +215,25 @@ def get_incidents(
     Returns:
         List of incident dictionaries
     """
+    if snapshot.is_ready():
+        return snapshot.query_rows(
+            lat_min, lat_max, lng_min, lng_max,
+            start_time.timestamp() if start_time is not None else None,
+            end_time.timestamp() if end_time is not None else None,
+        )
+    return _query_incidents(lat_min, lat_max, lng_min, lng_max, start_time, end_time)
+
+
+@metrics.instrumented("storage.db_query")
+def _query_incidents(
+    lat_min: Optional[float] = None,
+    lat_max: Optional[float] = None,
+    lng_min: Optional[float] = None,
+    lng_max: Optional[float] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+) -> List[Dict]:
+    """Database implementation of get_incidents (always hits PostgreSQL)"""
     try:
         conditions = []
         params = []
@@ -135,33 +275,18 @@ def get_incidents(
                 rows = cur.fetchall()
                 
                 # Convert to list of dicts
-                incidents = []
-                for row in rows:
-                    incidents.append({
-                        "id": row["id"],
-                        "latitude": float(row["latitude"]),
-                        "longitude": float(row["longitude"]),
-                        "timestamp": row["timestamp"],
-                        "timezone_offset_minutes": row.get("timezone_offset_minutes"),
-                        "incident_local_hour": row.get("incident_local_hour"),
-                        "type": row["type"],
-                        "severity": row["severity"],
-                        "category": row["category"],
-                        "verified": row["verified"],
-                        "moderation_reason": row.get("moderation_reason"),
-                        "user_id": row["user_id"],
-                    })
-                
-                return incidents
+                return [_row_to_incident(row) for row in rows]
     except Exception as e:
         logger.error(f"Failed to get incidents: {e}")
         raise
 
 
+@metrics.instrumented("storage.get_incidents_in_radius")
 def get_incidents_in_radius(
     lat: float,
     lng: float,
-    radius_meters: float
+    radius_meters: float,
+    include_distance: bool = False,
 ) -> List[Dict]:
     """
     Get incidents within a radius using PostGIS
@@ -170,55 +295,175 @@ def get_incidents_in_radius(
         lat: Center latitude
         lng: Center longitude
         radius_meters: Radius in meters
+        include_distance: Add "distance_meters" (distance to the center) to
+            each incident, so callers can derive smaller radii in memory
         
     Returns:
         List of incident dictionaries
     """
+    if snapshot.is_ready():
+        rows = snapshot.query_radius_rows(lat, lng, radius_meters)
+        if include_distance and rows:
+            from app.ml.risk_kernel import haversine_np
+            distances = haversine_np(
+                lat,
+                lng,
+                np.array([float(r["latitude"]) for r in rows]),
+                np.array([float(r["longitude"]) for r in rows]),
+            )
+            for row, d in zip(rows, distances.tolist()):
+                row["distance_meters"] = d
+        return rows
     try:
-        query = """
+        distance_column = ""
+        if include_distance:
+            distance_column = (
+                ", ST_Distance(location, ST_SetSRID(ST_MakePoint(%(lng)s, %(lat)s), 4326)::geography)"
+                " AS distance_meters"
+            )
+        query = f"""
             SELECT 
                 id, latitude, longitude, timestamp,
                 timezone_offset_minutes, incident_local_hour,
                 type, severity, category, verified, moderation_reason, user_id
+                {distance_column}
             FROM incidents
             WHERE ST_DWithin(
                 location,
-                ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography,
-                %s
+                ST_SetSRID(ST_MakePoint(%(lng)s, %(lat)s), 4326)::geography,
+                %(radius)s
             )
             ORDER BY timestamp DESC
         """
         
         with get_db_connection() as conn:
             with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                cur.execute(query, (lng, lat, radius_meters))
+                cur.execute(query, {"lng": lng, "lat": lat, "radius": radius_meters})
                 rows = cur.fetchall()
                 
-                incidents = []
-                for row in rows:
-                    incidents.append({
-                        "id": row["id"],
-                        "latitude": float(row["latitude"]),
-                        "longitude": float(row["longitude"]),
-                        "timestamp": row["timestamp"],
-                        "timezone_offset_minutes": row.get("timezone_offset_minutes"),
-                        "incident_local_hour": row.get("incident_local_hour"),
-                        "type": row["type"],
-                        "severity": row["severity"],
-                        "category": row["category"],
-                        "verified": row["verified"],
-                        "moderation_reason": row.get("moderation_reason"),
-                        "user_id": row["user_id"],
-                    })
-                
+                incidents = [_row_to_incident(row) for row in rows]
+                if include_distance:
+                    for incident, row in zip(incidents, rows):
+                        incident["distance_meters"] = float(row["distance_meters"])
                 return incidents
     except Exception as e:
         logger.error(f"Failed to get incidents in radius: {e}")
         raise
 
 
+@metrics.instrumented("storage.get_incidents_near_points")
+def get_incidents_near_points(
+    points: List[Tuple[float, float]],
+    radius_meters: float
+) -> List[Dict]:
+    """
+    Get incidents within radius_meters of ANY of the given points (one query)
+
+    The points are collected into a single MULTIPOINT so PostGIS can answer the
+    union of all neighborhoods with one GIST-indexed ST_DWithin scan.
+    
+    Args:
+        points: List of (lat, lng) tuples
+        radius_meters: Radius in meters
+        
+    Returns:
+        List of incident dictionaries
+    """
+    if not points:
+        return []
+    if snapshot.is_ready():
+        return snapshot.query_rows_near_points(
+            [p[0] for p in points], [p[1] for p in points], radius_meters
+        )
+    try:
+        query = """
+            WITH pts AS (
+                SELECT ST_Collect(ST_SetSRID(ST_MakePoint(p.lng, p.lat), 4326))::geography AS geog
+                FROM unnest(%s::float8[], %s::float8[]) AS p(lat, lng)
+            )
+            SELECT 
+                id, latitude, longitude, timestamp,
+                timezone_offset_minutes, incident_local_hour,
+                type, severity, category, verified, moderation_reason, user_id
+            FROM incidents, pts
+            WHERE ST_DWithin(incidents.location, pts.geog, %s)
+            ORDER BY timestamp DESC
+        """
+        lats = [float(p[0]) for p in points]
+        lngs = [float(p[1]) for p in points]
+        
+        with get_db_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute(query, (lats, lngs, radius_meters))
+                rows = cur.fetchall()
+                return [_row_to_incident(row) for row in rows]
+    except Exception as e:
+        logger.error(f"Failed to get incidents near points: {e}")
+        raise
+
+
+@metrics.instrumented("storage.get_incident_columns_in_radius")
+def get_incident_columns_in_radius(
+    lat: float,
+    lng: float,
+    radius_meters: float
+) -> Dict[str, np.ndarray]:
+    """
+    Get incidents within a radius as risk-kernel columns
+    (see app.ml.risk_kernel.incidents_to_columns); no per-row dicts when the
+    snapshot is loaded.
+    """
+    if snapshot.is_ready():
+        return snapshot.query_radius_columns(lat, lng, radius_meters)
+    from app.ml.risk_kernel import incidents_to_columns
+    return incidents_to_columns(get_incidents_in_radius(lat, lng, radius_meters))
+
+
+@metrics.instrumented("storage.get_incident_columns_near_points")
+def get_incident_columns_near_points(
+    points: List[Tuple[float, float]],
+    radius_meters: float
+) -> Dict[str, np.ndarray]:
+    """Get incidents within radius_meters of any point as risk-kernel columns"""
+    if snapshot.is_ready():
+        return snapshot.query_columns_near_points(
+            [p[0] for p in points], [p[1] for p in points], radius_meters
+        )
+    from app.ml.risk_kernel import incidents_to_columns
+    return incidents_to_columns(get_incidents_near_points(points, radius_meters))
+
+
+@metrics.instrumented("storage.get_incident_columns")
+def get_incident_columns(
+    lat_min: Optional[float] = None,
+    lat_max: Optional[float] = None,
+    lng_min: Optional[float] = None,
+    lng_max: Optional[float] = None,
+) -> Dict[str, np.ndarray]:
+    """Get incidents inside optional bounds as risk-kernel columns"""
+    if snapshot.is_ready():
+        return snapshot.query_columns(lat_min, lat_max, lng_min, lng_max)
+    from app.ml.risk_kernel import incidents_to_columns
+    return incidents_to_columns(_query_incidents(lat_min, lat_max, lng_min, lng_max))
+
+
+def get_incident_columns_at_version() -> Tuple[int, Dict[str, np.ndarray]]:
+    """
+    All incidents as risk-kernel columns plus the data version they reflect
+
+    No write notification can land between the two reads, so a consumer
+    that replays change events newer than the returned version sees every
+    incident exactly once (when the snapshot is loaded; direct database
+    reads can also include a write whose notification is still pending).
+    """
+    with _notify_lock:
+        return _data_version, get_incident_columns()
+
+
 def get_incident_count() -> int:
     """Get total number of incidents"""
+    if snapshot.is_ready():
+        return snapshot.get_count()
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
@@ -235,6 +480,7 @@ def get_all_incidents() -> List[Dict]:
     return get_incidents()
 
 
+@metrics.instrumented("storage.update_incident_verification", count_rows=False)
 def update_incident_verification(
     incident_id: str,
     verified: bool,
@@ -252,10 +498,24 @@ def update_incident_verification(
                     UPDATE incidents
                     SET verified = %s, moderation_reason = %s, updated_at = NOW()
                     WHERE id = %s
+                    RETURNING latitude, longitude
                     """,
                     (verified, moderation_reason, incident_id),
                 )
-                return cur.rowcount > 0
+                row = cur.fetchone()
+        if row is None:
+            return False
+        _notify_change(
+            "verification",
+            {
+                "id": incident_id,
+                "latitude": float(row[0]),
+                "longitude": float(row[1]),
+                "verified": verified,
+                "moderation_reason": moderation_reason,
+            },
+        )
+        return True
     except Exception as e:
         logger.error(f"Failed to update incident verification: {e}")
         raise
@@ -268,7 +528,211 @@ def clear_incidents():
             with conn.cursor() as cur:
                 cur.execute("TRUNCATE TABLE incidents RESTART IDENTITY CASCADE")
         logger.info("All incidents cleared from database")
+        _notify_change("cleared", {})
     except Exception as e:
         logger.error(f"Failed to clear incidents: {e}")
         raise
 
+
+
+# ==================== Unsafe zones (persisted clusters) ====================
+
+# Session advisory lock electing the one process that writes unsafe_zones
+# (held on a dedicated connection; released when it closes or the process exits)
+ZONE_WRITER_LOCK_KEY = 0x756E7361  # "unsa"
+_zone_writer_conn = None
+_zone_writer_lock = threading.Lock()
+
+
+def try_acquire_zone_writer_lock() -> bool:
+    """
+    Try to become the unsafe_zones writer (pg_try_advisory_lock, never blocks)
+
+    Returns:
+        True when this process holds the lock (also when it already did)
+    """
+    global _zone_writer_conn
+    with _zone_writer_lock:
+        if holds_zone_writer_lock():
+            return True
+        if _zone_writer_conn is not None:
+            # Connection lost: the lock went with it
+            if not _zone_writer_conn.closed:
+                _zone_writer_conn.close()
+            _zone_writer_conn = None
+        conn = open_dedicated_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (ZONE_WRITER_LOCK_KEY,))
+                acquired = bool(cur.fetchone()[0])
+        except Exception:
+            conn.close()
+            raise
+        if not acquired:
+            conn.close()
+            return False
+        _zone_writer_conn = conn
+        logger.info("Acquired the unsafe_zones writer lock")
+        return True
+
+
+def holds_zone_writer_lock() -> bool:
+    """True while the connection holding the writer lock is open"""
+    conn = _zone_writer_conn
+    if conn is None or conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        return True
+    except Exception:
+        return False
+
+
+def release_zone_writer_lock() -> None:
+    global _zone_writer_conn
+    with _zone_writer_lock:
+        conn, _zone_writer_conn = _zone_writer_conn, None
+    if conn is not None and not conn.closed:
+        conn.close()
+
+
+def _row_to_zone(row: Dict) -> Dict:
+    """Convert an unsafe_zones row to a cluster dictionary (see app.ml.clustering)"""
+    return {
+        "id": row["id"],
+        "center": {"lat": float(row["center_lat"]), "lng": float(row["center_lng"])},
+        "radius": float(row["radius_meters"]),
+        "risk_score": float(row["risk_score"]),
+        "incident_count": int(row["incident_count"]),
+    }
+
+
+@metrics.instrumented("storage.save_unsafe_zones", count_rows=False)
+def save_unsafe_zones(
+    zones: List[Dict],
+    version: int,
+    removed_ids: Optional[List[str]] = None,
+    replace: bool = False,
+) -> int:
+    """
+    Bulk-upsert clusters into unsafe_zones with a version stamp
+
+    Rows already written with a newer version (by an earlier writer) are kept.
+
+    Args:
+        zones: Cluster dictionaries (id, center, radius, risk_score, incident_count)
+        version: Version stamp for the upserted rows
+        removed_ids: Zone IDs to delete (clusters merged away)
+        replace: zones is the full set; delete every zone older than version
+
+    Returns:
+        Number of zones upserted
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                if zones:
+                    cur.execute(
+                        """
+                        INSERT INTO unsafe_zones (
+                            id, center_lat, center_lng, center_location,
+                            radius_meters, risk_score, incident_count, version
+                        )
+                        SELECT
+                            z.id, z.lat, z.lng,
+                            ST_SetSRID(ST_MakePoint(z.lng, z.lat), 4326)::geography,
+                            z.radius, z.risk, z.incidents, %s
+                        FROM unnest(
+                            %s::text[], %s::float8[], %s::float8[], %s::float8[], %s::float8[], %s::int[]
+                        ) AS z(id, lat, lng, radius, risk, incidents)
+                        ON CONFLICT (id) DO UPDATE SET
+                            center_lat = EXCLUDED.center_lat,
+                            center_lng = EXCLUDED.center_lng,
+                            center_location = EXCLUDED.center_location,
+                            radius_meters = EXCLUDED.radius_meters,
+                            risk_score = EXCLUDED.risk_score,
+                            incident_count = EXCLUDED.incident_count,
+                            version = EXCLUDED.version
+                        WHERE unsafe_zones.version IS NULL OR unsafe_zones.version <= EXCLUDED.version
+                        """,
+                        (
+                            version,
+                            [z["id"] for z in zones],
+                            [float(z["center"]["lat"]) for z in zones],
+                            [float(z["center"]["lng"]) for z in zones],
+                            [round(float(z["radius"]), 2) for z in zones],
+                            [min(5.0, max(0.0, round(float(z["risk_score"]), 2))) for z in zones],
+                            [int(z["incident_count"]) for z in zones],
+                        ),
+                    )
+                if removed_ids:
+                    cur.execute(
+                        "DELETE FROM unsafe_zones WHERE id = ANY(%s) AND (version IS NULL OR version <= %s)",
+                        (list(removed_ids), version),
+                    )
+                if replace:
+                    cur.execute("DELETE FROM unsafe_zones WHERE version IS NULL OR version < %s", (version,))
+        return len(zones)
+    except Exception as e:
+        logger.error(f"Failed to save unsafe zones: {e}")
+        raise
+
+
+@metrics.instrumented("storage.load_unsafe_zones")
+def load_unsafe_zones() -> Tuple[Optional[int], List[Dict]]:
+    """
+    All persisted clusters
+
+    Returns:
+        (newest version stamp or None when the table is empty, cluster dictionaries)
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute(
+                    """
+                    SELECT id, center_lat, center_lng, radius_meters, risk_score, incident_count, version
+                    FROM unsafe_zones
+                    ORDER BY id
+                    """
+                )
+                rows = cur.fetchall()
+        versions = [int(row["version"]) for row in rows if row["version"] is not None]
+        return (max(versions) if versions else None), [_row_to_zone(row) for row in rows]
+    except Exception as e:
+        logger.error(f"Failed to load unsafe zones: {e}")
+        raise
+
+
+@metrics.instrumented("storage.get_unsafe_zones_in_radius")
+def get_unsafe_zones_in_radius(lat: float, lng: float, radius_meters: float) -> List[Dict]:
+    """
+    Persisted clusters whose center lies within a radius (GIST-indexed ST_DWithin)
+
+    Args:
+        lat: Center latitude
+        lng: Center longitude
+        radius_meters: Radius in meters
+
+    Returns:
+        List of cluster dictionaries, nearest first
+    """
+    try:
+        query = """
+            SELECT id, center_lat, center_lng, radius_meters, risk_score, incident_count
+            FROM unsafe_zones
+            WHERE ST_DWithin(
+                center_location,
+                ST_SetSRID(ST_MakePoint(%(lng)s, %(lat)s), 4326)::geography,
+                %(radius)s
+            )
+            ORDER BY center_location <-> ST_SetSRID(ST_MakePoint(%(lng)s, %(lat)s), 4326)::geography
+        """
+        with get_db_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute(query, {"lng": lng, "lat": lat, "radius": radius_meters})
+                return [_row_to_zone(row) for row in cur.fetchall()]
+    except Exception as e:
+        logger.error(f"Failed to get unsafe zones in radius: {e}")
+        raise
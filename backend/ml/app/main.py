@@ -3,11 +3,17 @@ FastAPI Application Entry Point
 ML Service for Women Safety Analytics
 """
 
-from fastapi import FastAPI
+import logging
+import time
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
 from app.api.routes import router
 from app.db.connection import init_connection_pool, close_connection_pool
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
 
 # Create FastAPI application
 app = FastAPI(
@@ -31,15 +37,72 @@ app.add_middleware(
 app.include_router(router, prefix="/ml", tags=["ML Service"])
 
 
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """Request latency per route template (includes response serialization)"""
+    if not metrics.is_enabled():
+        return await call_next(request)
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.observe(
+        "ml_http_request_duration_seconds",
+        time.perf_counter() - started,
+        method=request.method,
+        path=getattr(route, "path", "unmatched"),
+    )
+    return response
+
+
 @app.on_event("startup")
 async def startup_event():
-    """Initialize database connection pool on startup"""
+    """Initialize database connection pool and background precomputation on startup"""
     init_connection_pool()
+    if settings.incident_snapshot_enabled:
+        from app.db.snapshot import load_snapshot
+        try:
+            load_snapshot()
+        except Exception as e:
+            # Storage falls back to direct database queries
+            logger.error(f"Failed to load incident snapshot: {e}")
+    if settings.aggregates_enabled:
+        from app.ml import aggregates
+        try:
+            aggregates.start()
+        except Exception as e:
+            logger.error(f"Failed to build incident aggregates: {e}")
+    if settings.risk_cache_enabled:
+        from app.ml import risk_cache
+        risk_cache.start()
+    from app.ml import clustering
+    clustering.start()
+    from app.ml import heatmap_delta, heatmap_tiles
+    heatmap_tiles.start()
+    heatmap_delta.start()
+    if settings.heatmap_pyramid_enabled:
+        from app.ml import heatmap_pyramid
+        heatmap_pyramid.start_background_builder()
+    if settings.risk_raster_enabled:
+        from app.ml.risk_raster import start_background_builder
+        start_background_builder()
+    from app.ml import warmup
+    warmup.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Close database connection pool on shutdown"""
+    """Stop background workers and close database connection pool on shutdown"""
+    from app.ml import clustering, warmup
+    warmup.stop()
+    clustering.stop()
+    if settings.risk_raster_enabled:
+        from app.ml.risk_raster import stop_background_builder
+        stop_background_builder()
+    if settings.heatmap_pyramid_enabled:
+        from app.ml import heatmap_pyramid
+        heatmap_pyramid.stop_background_builder()
+    from app.ml import parallel_scoring
+    parallel_scoring.shutdown()
     close_connection_pool()
 
 
@@ -0,0 +1,356 @@
+"""
+Incremental Decayed Aggregates - per grid cell x incident local hour
+
+The recency weight exp(-days_ago / tau) factors as exp(-now/tau) * exp(t/tau),
+so per-cell running totals of exp((t - t0)/tau) (and severity-weighted totals)
+can be kept incrementally and rescaled to any query time with a single
+exp(-(now - t0)/tau) factor. Adding an incident is O(1); scoring a point is
+O(cells within radius) instead of O(incidents).
+
+Channels per (cell, incident hour) — hour bin 24 holds incidents whose local
+hour is unknown:
+- decayed: sum of exp((t - t0)/tau)
+- decayed_severity: sum of severity * exp((t - t0)/tau)
+- count: raw incident count (every incident, as risk_kernel counts them)
+- dated: incidents with a known timestamp (the only ones carrying weight)
+
+Per cell we also keep coordinate sums so distances use the incident
+centroid. Scores are approximate: every incident in a cell is treated as
+sitting at the cell centroid (error grows with aggregate_cell_meters).
+
+The reference time t0 is moved forward (and all decayed totals rescaled)
+when an incident or query time is more than _MAX_EXPONENT decay times past
+it, keeping totals far from float64 range. Aggregates older than
+aggregates_max_age_seconds are rebuilt in the background, so writes made by
+other worker processes are picked up.
+"""
+
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.ml import risk_kernel
+from app.ml.risk_kernel import SCORING_RADIUS_M
+from app.utils import grid
+from app.utils.geospatial import degree_window
+
+logger = logging.getLogger(__name__)
+
+HOUR_BINS = 25  # 0-23 local hours + unknown
+CHANNELS = ("decayed", "decayed_severity", "count", "dated")
+_DECAYED, _DECAYED_SEV, _COUNT, _DATED = range(len(CHANNELS))
+
+# Renormalize when (t - t0) / tau exceeds this (exp(50) ~ 5e21)
+_MAX_EXPONENT = 50.0
+
+_cells: Dict[Tuple[int, int], Dict] = {}
+# incident id -> (cell, hour bin)
+_members: Dict[str, Tuple[Tuple[int, int], int]] = {}
+_t0: float = 0.0
+_tau_s: float = 30.0 * 86400.0
+_ready = False
+_built_at: float = 0.0
+_rebuilding = False
+# Changes seen while a rebuild reads the incident store, one list per rebuild
+_recorders: List[List[Tuple[str, Dict]]] = []
+_lock = threading.RLock()
+
+
+# ==================== Grid ====================
+
+def _cell_size_degrees() -> Tuple[float, float]:
+    return grid.cell_degrees(getattr(settings, "aggregate_cell_meters", 100.0))
+
+
+def cell_of(lat: float, lng: float) -> Tuple[int, int]:
+    """Global grid cell (app.utils.grid) containing (lat, lng)"""
+    return grid.cell_index(lat, lng, getattr(settings, "aggregate_cell_meters", 100.0))
+
+
+def _new_cell() -> Dict:
+    return {
+        "values": np.zeros((HOUR_BINS, len(CHANNELS)), dtype=np.float64),
+        "sum_lat": 0.0,
+        "sum_lng": 0.0,
+        "n": 0,
+    }
+
+
+# ==================== Updates ====================
+
+def _renormalize(new_t0: float) -> None:
+    """Move the reference time to new_t0 and rescale decayed channels"""
+    global _t0
+    factor = math.exp(-(new_t0 - _t0) / _tau_s)
+    for cell in _cells.values():
+        cell["values"][:, _DECAYED] *= factor
+        cell["values"][:, _DECAYED_SEV] *= factor
+    logger.info(f"Aggregates renormalized: t0 moved by {(new_t0 - _t0) / 86400.0:.1f} days")
+    _t0 = new_t0
+
+
+def _add(incident_id: str, lat: float, lng: float, ts: float, hour: int, severity: float) -> None:
+    has_ts = not math.isnan(ts)
+    if has_ts and (ts - _t0) / _tau_s > _MAX_EXPONENT:
+        _renormalize(ts)
+
+    key = cell_of(lat, lng)
+    cell = _cells.get(key)
+    if cell is None:
+        cell = _cells[key] = _new_cell()
+    hb = hour if 0 <= hour <= 23 else 24
+    v = cell["values"][hb]
+    v[_COUNT] += 1
+    if has_ts:
+        e = math.exp((ts - _t0) / _tau_s)
+        v[_DECAYED] += e
+        v[_DECAYED_SEV] += severity * e
+        v[_DATED] += 1
+    cell["sum_lat"] += lat
+    cell["sum_lng"] += lng
+    cell["n"] += 1
+    _members[incident_id] = (key, hb)
+
+
+def rebuild_aggregates() -> int:
+    """
+    Rebuild all aggregates from the incident store
+
+    Returns:
+        Number of incidents aggregated
+    """
+    global _t0, _tau_s, _ready, _built_at
+    from app.db.storage import get_incidents
+
+    changes: List[Tuple[str, Dict]] = []
+    with _lock:
+        _recorders.append(changes)
+    try:
+        incidents = get_incidents()
+    finally:
+        with _lock:
+            _recorders.remove(changes)
+    with _lock:
+        _cells.clear()
+        _members.clear()
+        _tau_s = max(1.0, float(settings.recency_decay_days)) * 86400.0
+        _t0 = datetime.now(timezone.utc).timestamp()
+        for inc in incidents:
+            _apply_added(inc)
+        # Writes made during the read may or may not be in it; replaying is idempotent
+        for event, inc in changes:
+            _apply_change(event, inc)
+        _ready = True
+        _built_at = time.time()
+    logger.info(f"Aggregates rebuilt: {len(_members)} incidents in {len(_cells)} cells")
+    return len(_members)
+
+
+def _apply_added(incident: Dict) -> None:
+    if incident["id"] in _members:
+        return
+    cols = risk_kernel.incidents_to_columns([incident])
+    if cols["lat"].size == 0:
+        return
+    _add(
+        incident["id"],
+        float(cols["lat"][0]),
+        float(cols["lng"][0]),
+        float(cols["ts"][0]),
+        int(cols["hour"][0]),
+        float(cols["severity"][0]),
+    )
+
+
+def _apply_removed(incident: Dict) -> None:
+    member = _members.pop(incident["id"], None)
+    cols = risk_kernel.incidents_to_columns([incident])
+    if member is None or cols["lat"].size == 0:
+        return
+    key, hb = member
+    cell = _cells[key]
+    ts = float(cols["ts"][0])
+    v = cell["values"][hb]
+    v[_COUNT] -= 1
+    if not math.isnan(ts):
+        e = math.exp((ts - _t0) / _tau_s)
+        v[_DECAYED] -= e
+        v[_DECAYED_SEV] -= float(cols["severity"][0]) * e
+        v[_DATED] -= 1
+    cell["sum_lat"] -= float(cols["lat"][0])
+    cell["sum_lng"] -= float(cols["lng"][0])
+    cell["n"] -= 1
+    if cell["n"] <= 0:
+        del _cells[key]
+
+
+def _apply_change(event: str, incident: Dict) -> None:
+    # Verification does not change risk scoring
+    if event == "cleared":
+        _cells.clear()
+        _members.clear()
+    elif event == "added":
+        _apply_added(incident)
+    elif event == "removed":
+        _apply_removed(incident)
+
+
+def _on_incident_change(event: str, incident: Dict) -> None:
+    """Storage change listener: O(1) update per write"""
+    with _lock:
+        for changes in _recorders:
+            changes.append((event, dict(incident)))
+        if _ready:
+            _apply_change(event, incident)
+
+
+def _rebuild_in_background() -> None:
+    global _rebuilding
+    try:
+        rebuild_aggregates()
+    except Exception as e:
+        logger.error(f"Aggregates rebuild failed: {e}")
+    finally:
+        _rebuilding = False
+
+
+def _check_staleness() -> None:
+    global _rebuilding
+    max_age = int(getattr(settings, "aggregates_max_age_seconds", 0))
+    if max_age <= 0 or _rebuilding or not _ready or time.time() - _built_at < max_age:
+        return
+    _rebuilding = True
+    threading.Thread(target=_rebuild_in_background, name="incident-aggregates-rebuild", daemon=True).start()
+
+
+def start() -> None:
+    """Build the aggregates and subscribe to incident writes"""
+    from app.db.storage import register_change_listener
+    register_change_listener(_on_incident_change)
+    rebuild_aggregates()
+
+
+def is_ready() -> bool:
+    return _ready and bool(getattr(settings, "aggregates_enabled", True))
+
+
+# ==================== Queries ====================
+
+def _gather(lat: float, lng: float, radius_meters: float):
+    """Cell centroids and hour-binned channels for cells near (lat, lng)"""
+    dlat, dlng = _cell_size_degrees()
+    ci, cj = cell_of(lat, lng)
+    wlat, wlng = degree_window(radius_meters, lat)
+    ri = int(math.ceil(wlat / dlat)) + 1
+    rj = int(math.ceil(wlng / dlng)) + 1
+
+    found = []
+    if (2 * ri + 1) * (2 * rj + 1) <= 4 * len(_cells):
+        for i in range(ci - ri, ci + ri + 1):
+            for j in range(cj - rj, cj + rj + 1):
+                cell = _cells.get((i, j))
+                if cell is not None:
+                    found.append(cell)
+    else:
+        found = [c for (i, j), c in _cells.items() if abs(i - ci) <= ri and abs(j - cj) <= rj]
+
+    if not found:
+        return None
+    n = np.array([c["n"] for c in found], dtype=np.float64)
+    c_lat = np.array([c["sum_lat"] for c in found]) / n
+    c_lng = np.array([c["sum_lng"] for c in found]) / n
+    values = np.stack([c["values"] for c in found])  # (cells, 25, C)
+    dist = risk_kernel.haversine_np(lat, lng, c_lat, c_lng)
+    keep = dist <= radius_meters
+    if not keep.any():
+        return None
+    return dist[keep], values[keep]
+
+
+def score_point(
+    lat: float,
+    lng: float,
+    local_hour: int,
+    now_ts: Optional[float] = None,
+    radius_meters: float = SCORING_RADIUS_M,
+) -> Dict[str, np.ndarray]:
+    """
+    Approximate risk factors for one point from the aggregates
+
+    Returns:
+        Same keys as risk_kernel.score_points (arrays of shape (1,))
+    """
+    now_ts = datetime.now(timezone.utc).timestamp() if now_ts is None else float(now_ts)
+    params = risk_kernel.scoring_params()
+    q = int(local_hour) % 24
+    with _lock:
+        _check_staleness()
+        if _ready and (now_ts - _t0) / _tau_s > _MAX_EXPONENT:
+            _renormalize(now_ts)
+        gathered = _gather(lat, lng, radius_meters)
+        scale = math.exp(-(now_ts - _t0) / _tau_s)
+
+    if gathered is None:
+        zeros = np.zeros(1)
+        return risk_kernel.combine_factors(
+            query_hour=np.array([q]), raw_count=np.zeros(1, dtype=np.int64), effective=zeros,
+            weighted_severity=zeros, recency_numer=zeros, recency_denom=zeros, total_weight=zeros,
+            pattern=np.zeros((1, len(risk_kernel.PATTERN_WINDOWS)), dtype=np.int64), params=params,
+        )
+
+    dist, values = gathered
+    dw = np.exp(-dist / risk_kernel.DISTANCE_SCALE_M)  # (cells,)
+    sim = np.append(risk_kernel.hour_similarity_matrix(params)[q], 1.0)  # (25,) incl. unknown hour
+
+    decayed = values[:, :, _DECAYED] * scale
+    decayed_sev = values[:, :, _DECAYED_SEV] * scale
+    count = values[:, :, _COUNT]
+    dated = values[:, :, _DATED]
+
+    effective = float((decayed @ sim).sum())
+    rec_numer = float(dw @ (decayed @ sim))
+    rec_denom = float(dw @ (dated @ sim))
+    w_sev = float(dw @ (decayed_sev @ sim))
+
+    # Pattern counts from raw hour histograms (unknown hour has no window)
+    hour_counts = count[:, :24].sum(axis=0)
+    pattern = np.zeros((1, len(risk_kernel.PATTERN_WINDOWS)), dtype=np.int64)
+    for h in range(24):
+        w = risk_kernel.HOUR_TO_WINDOW[h]
+        if w >= 0:
+            pattern[0, w] += int(round(hour_counts[h]))
+
+    return risk_kernel.combine_factors(
+        query_hour=np.array([q]),
+        raw_count=np.array([int(round(count.sum()))]),
+        effective=np.array([effective]),
+        weighted_severity=np.array([w_sev]),
+        recency_numer=np.array([rec_numer]),
+        recency_denom=np.array([rec_denom]),
+        total_weight=np.array([rec_numer]),
+        pattern=pattern,
+        params=params,
+    )
+
+
+def risk_for_point(lat: float, lng: float, local_hour: int, now: Optional[datetime] = None) -> Dict:
+    """Approximate risk dictionary (same shape as calculate_risk_score)"""
+    now = now or datetime.now(timezone.utc)
+    scores = score_point(lat, lng, local_hour, now_ts=now.timestamp())
+    return risk_kernel.result_dict(scores, 0, calculated_at=now.isoformat())
+
+
+def get_status() -> Dict:
+    with _lock:
+        return {
+            "ready": _ready,
+            "cells": len(_cells),
+            "incidents": len(_members),
+            "reference_time": datetime.fromtimestamp(_t0, timezone.utc).isoformat() if _ready else None,
+        }
@@ -1,116 +1,925 @@
 """
 Clustering Module - DBSCAN for unsafe zone detection
+
+Clusters are fitted once over all incidents (get_clusters) and then kept
+current incrementally: a storage change listener inserts every new incident
+into the fitted model (incremental DBSCAN). An insertion only looks at the
+eps-neighborhoods around the new incident:
+
+- neighbor counts of the incidents within eps go up; incidents reaching
+  dbscan_min_samples become core points,
+- each new core point is linked to the core points within eps of it: no
+  existing cluster among them starts a new cluster, one extends it, several
+  are merged into the largest,
+- an incident that is not a core point joins the cluster of a core point
+  within eps (border) or stays noise.
+
+Only the changed clusters are re-summarized and re-scored; risk scores come
+from the incident columns the model already holds, all changed clusters in
+one vectorized pass (_score_centers), so clustering issues no per-cluster
+storage queries. Incidents are
+never deleted or moved, so clusters never split; "cleared" drops the model.
+Writes made by other processes reach the model through the snapshot
+reload's change notifications (app.db.snapshot).
+
+Cluster IDs are derived from the cluster's oldest incident (zone_id), so
+the same cluster gets the same ID in every process and across refits.
+
+With cluster_store_enabled one process is elected writer through a
+PostgreSQL advisory lock (storage.try_acquire_zone_writer_lock): it fits,
+maintains and bulk-upserts the clusters into unsafe_zones with a version
+stamp. Every other process is a reader: it does not fit, and reloads the
+persisted zones after incident changes and every
+cluster_reader_reload_seconds, taking over as writer when the lock is free.
+Viewport queries (get_clusters_in_radius) are spatial queries against the
+table, so all workers serve the same clusters.
+
+A background worker (start / stop, cluster_worker_enabled) takes the
+remaining work off the request path: re-scoring and persisting changed
+clusters and full refits (first fit, after "cleared" or when incremental
+updates are off). Requests arriving within cluster_recompute_debounce_seconds
+of each other are coalesced into one run (at most
+cluster_recompute_max_delay_seconds after the first), a refit is swapped in
+only once fully scored, and readers get the last good clusters without
+waiting for either.
 """
 
-from typing import List, Dict, Optional
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Optional, Set, Tuple
 import numpy as np
 from sklearn.cluster import DBSCAN
 from app.config import settings
-from app.db.storage import get_incidents
 from app.api.schemas import IncidentRequest, RiskCluster, Location
+from app.ml import risk_kernel
+from app.ml.risk_kernel import SCORING_RADIUS_M
+from app.utils import grid, metrics
+from app.utils.geospatial import EARTH_RADIUS_M, METERS_PER_DEG_LAT, degree_window
+
+logger = logging.getLogger(__name__)
+
+# Fitted model (see _build_model); replaced by a full fit, dropped on "cleared"
+_model: Optional[Dict] = None
+# Bumped whenever the model is dropped, so a fit that started earlier is discarded
+_generation = 0
+# Incidents added while a full fit runs: (data_version, column values)
+_building = False
+_backlog: List[Tuple[int, Dict[str, float]]] = []
+# Changed cluster IDs per ingested incident, collected by update_clusters_if_needed
+_changes: "OrderedDict[str, List[str]]" = OrderedDict()
+_MAX_CHANGES = 1000
+# Zones loaded from unsafe_zones: {"version", "clusters"}; served while this
+# process has no fit of its own (always on readers), dropped when incidents
+# change on the writer
+_persisted: Optional[Dict] = None
+_persisted_at = 0.0
+# "writer" (fits and persists), "reader" (serves the writer's zones) or None
+# (store disabled or unreachable at start: fits locally)
+_role: Optional[str] = None
+# Last version stamp written to unsafe_zones and whether that write worked
+_zone_version = 0
+_store_ok: Optional[bool] = None
+# Clusters served while no model or persisted zones exist (model dropped,
+# refit pending in the background worker)
+_last_good: List[Dict] = []
+
+# Background worker: pending recompute requests, coalesced within the debounce window
+_pending: Dict = {"full": False, "first": None, "last": None, "requests": 0}
+_pending_lock = threading.Lock()
+_wake = threading.Event()
+_stop = threading.Event()
+_worker: Optional[threading.Thread] = None
+
+_lock = threading.RLock()
+_build_lock = threading.Lock()
+
+# Per-incident arrays held by the model: incident columns (for scoring) plus
+# DBSCAN state; name -> (dtype, fill of unused capacity)
+_POINT_ARRAYS = {
+    "lat": (np.float64, np.nan),
+    "lng": (np.float64, np.nan),
+    "ts": (np.float64, np.nan),
+    "hour": (np.int8, -1),
+    "severity": (np.float64, 0.0),
+    "labels": (np.int64, -1),
+    "core": (bool, False),
+    "counts": (np.int64, 0),
+}
+
+
+def zone_id(ts: float, lat: float, lng: float) -> str:
+    """Stable cluster ID from the cluster's oldest incident (same in every process)"""
+    key = f"{'nan' if math.isnan(ts) else f'{ts:.3f}'}:{lat:.7f}:{lng:.7f}"
+    return "zone_" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _oldest_id(lat: np.ndarray, lng: np.ndarray, ts: np.ndarray) -> str:
+    """zone_id of the oldest incident (unknown timestamps last, ties by position)"""
+    first = np.lexsort((lng, lat, np.where(np.isnan(ts), np.inf, ts)))[0]
+    return zone_id(float(ts[first]), float(lat[first]), float(lng[first]))
+
+
+def _label_id(model: Dict, label: int) -> Optional[str]:
+    """Current ID of a model cluster (last summarized ID once merged away)"""
+    members = model["members"].get(label)
+    if members:
+        idx = np.asarray(members, dtype=np.int64)
+        return _oldest_id(model["lat"][idx], model["lng"][idx], model["ts"][idx])
+    summary = model["clusters"].get(label)
+    return summary["id"] if summary is not None else None
+
+
+def eps_meters() -> float:
+    """DBSCAN neighborhood radius in meters (dbscan_eps_meters, else dbscan_eps degrees of latitude)"""
+    if settings.dbscan_eps_meters is not None:
+        return float(settings.dbscan_eps_meters)
+    return float(settings.dbscan_eps) * METERS_PER_DEG_LAT
+
+
+def _dbscan(coordinates: np.ndarray, eps_m: float, min_samples: int) -> DBSCAN:
+    return DBSCAN(
+        eps=eps_m / EARTH_RADIUS_M,
+        min_samples=min_samples,
+        metric="haversine",
+        algorithm="ball_tree",
+    ).fit(coordinates)
+
+
+def dbscan_labels(
+    lat: np.ndarray,
+    lng: np.ndarray,
+    eps_m: Optional[float] = None,
+    min_samples: Optional[int] = None,
+) -> np.ndarray:
+    """
+    DBSCAN cluster labels for incident coordinates (-1 = noise)
+
+    Runs on radians with the haversine metric and a ball tree, so eps is a
+    true great-circle distance in meters at any latitude.
+
+    Args:
+        lat, lng: Incident coordinates (degrees)
+        eps_m: Neighborhood radius in meters (default: eps_meters())
+        min_samples: Core point threshold (default: dbscan_min_samples)
+
+    Returns:
+        Label per incident
+    """
+    coordinates = np.radians(np.column_stack((
+        np.asarray(lat, dtype=np.float64), np.asarray(lng, dtype=np.float64)
+    )))
+    return _dbscan(
+        coordinates,
+        eps_m if eps_m is not None else eps_meters(),
+        min_samples if min_samples is not None else settings.dbscan_min_samples,
+    ).labels_
+
+
+# ==================== Fitted model ====================
+
+def _fit(lat: np.ndarray, lng: np.ndarray, eps_m: float, min_samples: int):
+    """
+    Full DBSCAN fit with the state needed for incremental inserts
+
+    Returns:
+        (labels, core mask, neighbor counts); counts include the point itself
+        and are exact for non-core points (core points only need to stay at
+        or above min_samples)
+    """
+    n = lat.shape[0]
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=bool), np.empty(0, dtype=np.int64)
+    coordinates = np.radians(np.column_stack((lat, lng)))
+    fitted = _dbscan(coordinates, eps_m, min_samples)
+    core = np.zeros(n, dtype=bool)
+    core[fitted.core_sample_indices_] = True
+    counts = np.full(n, min_samples, dtype=np.int64)
+    if not core.all():
+        from sklearn.neighbors import BallTree
+        tree = BallTree(coordinates, metric="haversine")
+        counts[~core] = tree.query_radius(coordinates[~core], eps_m / EARTH_RADIUS_M, count_only=True)
+    return fitted.labels_.astype(np.int64), core, counts
+
+
+def _new_model(columns: Dict[str, np.ndarray], version: int) -> Dict:
+    """Fit incident columns (see risk_kernel.incidents_to_columns) into a new model"""
+    eps_m = eps_meters()
+    min_samples = max(1, int(settings.dbscan_min_samples))
+    lat, lng = columns["lat"], columns["lng"]
+    labels, core, counts = _fit(lat, lng, eps_m, min_samples)
+    n = lat.shape[0]
+    capacity = max(1024, 2 * n)
+    values = {**{k: columns[k] for k in risk_kernel.COLUMNS}, "labels": labels, "core": core, "counts": counts}
+    arrays = {}
+    for key, (dtype, fill) in _POINT_ARRAYS.items():
+        arrays[key] = np.full(capacity, fill, dtype=dtype)
+        arrays[key][:n] = values[key]
+
+    # Spatial hash: global grid cells of eps, so a neighborhood is a few cells
+    buckets: Dict[Tuple[int, int], List[int]] = {}
+    bi, bj = grid.cell_indices(lat, lng, eps_m)
+    for idx, key in enumerate(zip(bi.tolist(), bj.tolist())):
+        buckets.setdefault(key, []).append(idx)
+
+    members: Dict[int, List[int]] = {}
+    order = np.argsort(labels, kind="stable")
+    unique_labels, starts, sizes = np.unique(labels[order], return_index=True, return_counts=True)
+    for label, first, size in zip(unique_labels.tolist(), starts.tolist(), sizes.tolist()):
+        if label != -1:
+            members[label] = order[first:first + size].tolist()
+
+    return {
+        "version": version,
+        "eps_m": eps_m,
+        "min_samples": min_samples,
+        "n": n,
+        **arrays,
+        "buckets": buckets,
+        "members": members,
+        "next_label": (max(members) + 1) if members else 0,
+        "clusters": {},  # label -> cluster dictionary
+        "dirty": {label: 1 for label in members},  # label -> revision to re-summarize
+        "cluster_list": None,
+    }
+
+
+def _neighbors(model: Dict, lat: float, lng: float) -> np.ndarray:
+    """Indices of incidents within eps of (lat, lng)"""
+    eps_m = model["eps_m"]
+    i, j = grid.cell_index(lat, lng, eps_m)
+    _, cell_dlng = grid.cell_degrees(eps_m)
+    _, half_dlng = degree_window(eps_m, lat)
+    span = int(math.ceil(half_dlng / cell_dlng))
+    candidates: List[int] = []
+    for di in (-1, 0, 1):
+        for dj in range(-span, span + 1):
+            bucket = model["buckets"].get((i + di, j + dj))
+            if bucket:
+                candidates.extend(bucket)
+    if not candidates:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.asarray(candidates, dtype=np.int64)
+    d = risk_kernel.haversine_np(lat, lng, model["lat"][candidates], model["lng"][candidates])
+    return candidates[d <= eps_m]
+
+
+def _append(model: Dict, row: Dict[str, float], neighbor_count: int) -> int:
+    idx = model["n"]
+    if idx == model["lat"].shape[0]:
+        # Grown arrays replace the old ones, which stay valid for readers of the first idx rows
+        for key, (dtype, fill) in _POINT_ARRAYS.items():
+            grown = np.full(2 * idx, fill, dtype=dtype)
+            grown[:idx] = model[key]
+            model[key] = grown
+    for key in risk_kernel.COLUMNS:
+        if key in row:
+            model[key][idx] = row[key]
+    model["counts"][idx] = neighbor_count
+    model["n"] = idx + 1
+    model["buckets"].setdefault(grid.cell_index(row["lat"], row["lng"], model["eps_m"]), []).append(idx)
+    return idx
+
+
+def _assign(model: Dict, points, target: int, changed: Set[int]) -> None:
+    """Move points into cluster target"""
+    labels, members = model["labels"], model["members"]
+    for q in points:
+        old = int(labels[q])
+        if old == target:
+            continue
+        if old != -1:
+            members[old].remove(q)
+            changed.add(old)
+            if not members[old]:
+                del members[old]
+        labels[q] = target
+        members[target].append(q)
+    changed.add(target)
+
+
+def _merge(model: Dict, labels_to_merge: Set[int], changed: Set[int]) -> int:
+    """Merge clusters into the largest one (or start a new cluster); returns its label"""
+    members = model["members"]
+    if not labels_to_merge:
+        target = model["next_label"]
+        model["next_label"] += 1
+        members[target] = []
+        return target
+    target = max(labels_to_merge, key=lambda label: (len(members[label]), -label))
+    for label in labels_to_merge - {target}:
+        moved = members.pop(label)
+        model["labels"][moved] = target
+        members[target].extend(moved)
+        changed.add(label)
+    changed.add(target)
+    return target
+
+
+def _insert(model: Dict, row: Dict[str, float]) -> Set[int]:
+    """
+    Insert one incident into the model
+
+    Args:
+        model: Fitted model
+        row: Incident column values ("lat" and "lng" required; see risk_kernel.COLUMNS)
+
+    Returns:
+        Labels of the clusters that changed (including clusters merged away)
+    """
+    min_samples = model["min_samples"]
+    neighbors = _neighbors(model, row["lat"], row["lng"])
+    p = _append(model, row, int(neighbors.shape[0]) + 1)
+    labels, core, counts = model["labels"], model["core"], model["counts"]
+
+    counts[neighbors] += 1
+    new_cores = neighbors[~core[neighbors] & (counts[neighbors] >= min_samples)].tolist()
+    core[new_cores] = True
+    hoods = {}
+    if counts[p] >= min_samples:
+        core[p] = True
+        new_cores.append(p)
+        hoods[p] = neighbors
+
+    changed: Set[int] = set()
+    if new_cores:
+        new_set = set(new_cores)
+        for c in new_cores:
+            if c not in hoods:
+                hoods[c] = _neighbors(model, float(model["lat"][c]), float(model["lng"][c]))
+
+        # Components of new core points (linked when within eps of each other)
+        # and the existing clusters of the old core points they reach
+        seen: Set[int] = set()
+        for start in new_cores:
+            if start in seen:
+                continue
+            component, reached, stack = [], set(), [start]
+            seen.add(start)
+            while stack:
+                c = stack.pop()
+                component.append(c)
+                for q in hoods[c].tolist():
+                    if not core[q]:
+                        continue
+                    if q in new_set:
+                        if q not in seen:
+                            seen.add(q)
+                            stack.append(q)
+                    else:
+                        reached.add(int(labels[q]))
+            target = _merge(model, reached, changed)
+            _assign(model, component, target, changed)
+            # Noise within eps of the new core points becomes border points
+            for c in component:
+                hood = hoods[c]
+                _assign(model, hood[labels[hood] == -1].tolist(), target, changed)
+
+    if labels[p] == -1:
+        core_neighbors = neighbors[core[neighbors]]
+        if core_neighbors.shape[0]:
+            _assign(model, [p], int(labels[core_neighbors[0]]), changed)
+    return changed
+
+
+def _mark_dirty(model: Dict, changed: Set[int]) -> None:
+    for label in changed:
+        model["dirty"][label] = model["dirty"].get(label, 0) + 1
+    if changed:
+        model["cluster_list"] = None
+
+
+def _summarize(lat: np.ndarray, lng: np.ndarray, ts: np.ndarray) -> Dict:
+    # Calculate cluster center
+    center_lat = float(np.mean(lat))
+    center_lng = float(np.mean(lng))
+    # Calculate cluster radius (max great-circle distance from center)
+    radius_meters = float(np.max(risk_kernel.haversine_np(center_lat, center_lng, lat, lng)))
+    return {
+        "id": _oldest_id(lat, lng, ts),
+        "center": {
+            "lat": center_lat,
+            "lng": center_lng,
+        },
+        "radius": radius_meters,
+        "incident_count": int(lat.shape[0]),
+    }
+
+
+def _persist(zones: List[Dict], removed_ids: List[str], replace: bool = False) -> None:
+    """Write clusters to unsafe_zones (failures only disable viewport queries on the table)"""
+    global _zone_version, _store_ok
+    if not settings.cluster_store_enabled or not (zones or removed_ids or replace):
+        return
+    from app.db.storage import save_unsafe_zones, try_acquire_zone_writer_lock
+
+    try:
+        writer = try_acquire_zone_writer_lock()
+    except Exception as e:
+        logger.warning(f"Failed to take the unsafe_zones writer lock: {e}")
+        _store_ok = False
+        return
+    if not writer:
+        # Another process persists clusters (lock lost or never held)
+        _become_reader()
+        return
+
+    with _lock:
+        _zone_version = max(int(time.time() * 1000), _zone_version + 1)
+        version = _zone_version
+    try:
+        save_unsafe_zones(zones, version, removed_ids, replace=replace)
+        _store_ok = True
+    except Exception as e:
+        logger.warning(f"Failed to persist clusters to unsafe_zones: {e}")
+        _store_ok = False
+
+
+def _score_centers(arrays: Dict, n: int, center_lat: np.ndarray, center_lng: np.ndarray) -> np.ndarray:
+    """
+    Current risk scores at cluster centers in one vectorized pass
 
-# Cache for clusters
-_clusters_cache: Optional[List[Dict]] = None
-_clusters_last_update: Optional[float] = None
+    Scored from the first n incidents of the model arrays (no storage queries):
+    incidents within SCORING_RADIUS_M of the centers' bounding box are
+    selected and risk_kernel.score_points scores every center at once, with
+    the same kernel and query hour as calculate_risk_score(exact=True).
+
+    Returns:
+        Risk score per center (rounded like the point API)
+    """
+    from app.ml.risk_scoring import _query_now
+
+    now = _query_now(None)
+    dlat, dlng = degree_window(SCORING_RADIUS_M, float(np.max(np.abs(center_lat))))
+    lat, lng = arrays["lat"][:n], arrays["lng"][:n]
+    near = (
+        (lat >= center_lat.min() - dlat) & (lat <= center_lat.max() + dlat)
+        & (lng >= center_lng.min() - dlng) & (lng <= center_lng.max() + dlng)
+    )
+    columns = {key: arrays[key][:n][near] for key in risk_kernel.COLUMNS}
+    with metrics.timed("clustering.risk_scoring") as stage:
+        scores = risk_kernel.score_points(
+            center_lat, center_lng, now.hour, columns, now_ts=now.timestamp(), radius_meters=SCORING_RADIUS_M
+        )
+        stage.rows = int(columns["lat"].shape[0])
+        stage.cells = int(center_lat.shape[0])
+    return np.round(scores["risk_score"], 2)
+
+
+def _refresh(model: Dict, replace: bool = False) -> int:
+    """
+    Re-summarize, re-score and persist changed clusters
+
+    Scoring runs outside the lock; a cluster that changes again meanwhile
+    stays dirty and is picked up by the next refresh.
+
+    Args:
+        model: Fitted model
+        replace: The refresh covers a new fit; persisted zones of older fits are deleted
+
+    Returns:
+        Number of clusters re-scored
+    """
+    removed = []
+    with _lock:
+        dirty = []
+        for label, revision in list(model["dirty"].items()):
+            cluster_members = model["members"].get(label)
+            if cluster_members is None:
+                # Merged away
+                summary = model["clusters"].pop(label, None)
+                del model["dirty"][label]
+                model["cluster_list"] = None
+                if summary is not None:
+                    removed.append(summary["id"])
+                continue
+            dirty.append((label, revision, np.asarray(cluster_members, dtype=np.int64)))
+        # Rows below n never change; arrays grown meanwhile replace these references
+        n = model["n"]
+        held = {key: model[key] for key in risk_kernel.COLUMNS}
+    pending = [
+        (label, revision, _summarize(held["lat"][idx], held["lng"][idx], held["ts"][idx]))
+        for label, revision, idx in dirty
+    ]
+    if not pending:
+        _persist([], removed, replace=replace)
+        return 0
+
+    risk = _score_centers(
+        held,
+        n,
+        np.array([summary["center"]["lat"] for _, _, summary in pending]),
+        np.array([summary["center"]["lng"] for _, _, summary in pending]),
+    )
+    for (_, _, summary), score in zip(pending, risk.tolist()):
+        summary["risk_score"] = score
+
+    installed = []
+    with _lock:
+        for label, revision, summary in pending:
+            if model["dirty"].get(label) == revision:
+                previous = model["clusters"].get(label)
+                if previous is not None and previous["id"] != summary["id"]:
+                    # A merge brought in an older incident
+                    removed.append(previous["id"])
+                model["clusters"][label] = summary
+                del model["dirty"][label]
+                installed.append(summary)
+        model["cluster_list"] = None
+    # An ID can move to the cluster it was merged into
+    kept = {summary["id"] for summary in installed}
+    _persist(installed, [i for i in removed if i not in kept], replace=replace)
+    return len(pending)
+
+
+def _build_model(force: bool) -> Dict:
+    """Full DBSCAN fit over all incidents, then replay incidents added meanwhile"""
+    global _model, _building, _persisted
+    from app.db.storage import get_incident_columns_at_version, register_change_listener
+
+    register_change_listener(_on_incident_change)
+    with _build_lock:
+        if _model is not None and not force:
+            return _model
+        with _lock:
+            _building = True
+            _backlog.clear()
+            generation = _generation
+        started = time.perf_counter()
+        try:
+            # All incident coordinates as NumPy columns (no per-row dicts)
+            version, columns = get_incident_columns_at_version()
+            with metrics.timed("clustering.dbscan") as stage:
+                model = _new_model(columns, version)
+                stage.rows = model["n"]
+            # Score before swapping in, so readers never see an unscored fit
+            _refresh(model, replace=True)
+        except Exception:
+            with _lock:
+                _building = False
+                _backlog.clear()
+            raise
+        with _lock:
+            _building = False
+            for entry_version, row in _backlog:
+                if entry_version > version:
+                    _mark_dirty(model, _insert(model, row))
+            _backlog.clear()
+            if generation == _generation:
+                _model = model
+                _persisted = None
+    if model["dirty"]:
+        # Incidents added during the fit
+        _request_recompute(full=False)
+    metrics.observe_stage(
+        "clustering.total", time.perf_counter() - started, rows=model["n"], cells=len(model["members"])
+    )
+    return model
+
+
+def _become_reader() -> None:
+    """Lost the writer election: keep serving the current clusters, then reload the writer's"""
+    global _role, _model, _persisted, _last_good, _generation
+    logger.warning("Another process persists clusters; switching to reading unsafe_zones")
+    with _lock:
+        _role = "reader"
+        if _model is not None:
+            _last_good = _cluster_list(_model)
+            _persisted = {"version": None, "clusters": _last_good}
+        _model = None
+        _generation += 1
+        _changes.clear()
+    _request_recompute(full=False)
+
+
+def _load_persisted(keep_empty: bool) -> Optional[int]:
+    """Serve the zones in unsafe_zones until this process fits its own; returns the version"""
+    global _persisted, _persisted_at
+    from app.db.storage import load_unsafe_zones
+
+    version, zones = load_unsafe_zones()
+    # version is None for an empty table or zones written before versioning
+    if version is None and not keep_empty:
+        return None
+    with _lock:
+        if _model is None:
+            _persisted = {"version": version, "clusters": zones}
+            _persisted_at = time.monotonic()
+    return version
+
+
+def _sync_reader() -> None:
+    """Reader cycle: take over as writer when the lock is free, else reload the writer's zones"""
+    global _role
+    from app.db.storage import try_acquire_zone_writer_lock
+
+    if try_acquire_zone_writer_lock():
+        logger.info("Took over as the unsafe_zones writer")
+        _role = "writer"
+        _build_model(force=True)
+        return
+    with _pending_lock:
+        # This reload covers every change notified so far
+        _pending.update(full=False, first=None, last=None, requests=0)
+    _load_persisted(keep_empty=True)
+
+
+def _reader_reload_seconds() -> float:
+    return max(1.0, float(settings.cluster_reader_reload_seconds))
+
+
+def _on_incident_change(event: str, incident: Dict) -> None:
+    """Storage change listener: insert new incidents into the fitted model"""
+    global _model, _generation, _persisted, _last_good
+    if _role == "reader":
+        # The writer refits; reload its zones once it had time to persist
+        if event != "verification":
+            _request_recompute(full=False)
+        return
+    if event == "verification":
+        # Every incident is clustered regardless of verification
+        return
+    if event == "added" and settings.dbscan_incremental:
+        columns = risk_kernel.incidents_to_columns([incident])
+        if columns["lat"].shape[0]:
+            from app.db.storage import get_data_version
+            version = get_data_version()
+            row = {key: columns[key][0] for key in risk_kernel.COLUMNS}
+            changed: Set[int] = set()
+            with _lock:
+                building = _building
+                if building:
+                    _backlog.append((version, row))
+                if _model is not None:
+                    with metrics.timed("clustering.insert") as stage:
+                        changed = _insert(_model, row)
+                        stage.cells = len(changed)
+                    _mark_dirty(_model, changed)
+                    _changes[str(incident.get("id"))] = sorted(
+                        {i for i in (_label_id(_model, label) for label in changed) if i is not None}
+                    )
+                    while len(_changes) > _MAX_CHANGES:
+                        _changes.popitem(last=False)
+            if _model is not None:
+                if changed:
+                    _request_recompute(full=False)
+                return
+            if building:
+                # Replayed into the fit in progress
+                return
+            # Loaded zones no longer match the incidents: refit (keep serving them meanwhile)
+            with _lock:
+                if _persisted is not None:
+                    _last_good = _persisted["clusters"]
+                _persisted = None
+            _request_recompute(full=True)
+            return
+    # Cleared, removed, unusable location or incremental updates disabled: refit
+    with _lock:
+        if event == "cleared":
+            _last_good = []
+        elif _model is not None:
+            _last_good = _cluster_list(_model)
+        elif _persisted is not None:
+            _last_good = _persisted["clusters"]
+        _model = None
+        _persisted = None
+        _generation += 1
+        _changes.clear()
+    _request_recompute(full=True)
 
 
 def update_clusters_if_needed(incident: IncidentRequest) -> List[str]:
     """
-    Update clusters if needed after new incident
-    
+    Update clusters after a new incident
+
+    The incident was already inserted into the fitted clusters by the
+    storage change listener; this re-scores the clusters it changed (left
+    to the background worker when it runs).
+
     Args:
         incident: New incident that was added
-        
+
     Returns:
-        List of affected cluster IDs
+        List of affected cluster IDs (extended, new, merged and merged-away
+        clusters; empty when the incident is noise or clusters are not
+        fitted yet)
     """
-    global _clusters_cache, _clusters_last_update
-    
-    # Invalidate cache
-    _clusters_cache = None
-    _clusters_last_update = None
-    
-    # For now, return empty list
-    # Full implementation would recalculate clusters
-    return []
+    with _lock:
+        model = _model
+        changed = _changes.pop(str(incident.id), None)
+    if model is None or not changed:
+        return []
+    if not _worker_running():
+        _refresh(model)
+    return changed
 
 
 def get_clusters(force_recalculate: bool = False) -> List[Dict]:
     """
-    Get unsafe zone clusters using DBSCAN
-    
+    Get unsafe zone clusters using DBSCAN (haversine, see dbscan_labels)
+
+    Fits all incidents on first use and keeps the fit current on ingest
+    (see module docstring). While the background worker runs this never
+    fits or scores: it returns the last good clusters and leaves pending
+    work to the worker. Readers return the writer's persisted zones.
+
+    Args:
+        force_recalculate: Refit over all incidents now, even if a fit exists
+
+    Returns:
+        List of cluster dictionaries
+    """
+    if _role == "reader":
+        stale = time.monotonic() - _persisted_at >= _reader_reload_seconds() or _recompute_pending()
+        if force_recalculate or (not _worker_running() and stale):
+            _sync_reader()
+        if _role == "reader":
+            with _lock:
+                persisted = _persisted
+            return persisted["clusters"] if persisted is not None else _last_good
+    with _lock:
+        model = _model
+        persisted = _persisted
+        last_good = _last_good
+    if not force_recalculate:
+        if model is None and persisted is not None:
+            return persisted["clusters"]
+        if _worker_running():
+            if model is None:
+                if not _building and not _recompute_pending():
+                    _request_recompute(full=True)
+                return last_good
+            return _cluster_list(model)
+    if model is None or force_recalculate:
+        model = _build_model(force_recalculate)
+    _refresh(model)
+    return _cluster_list(model)
+
+
+def _cluster_list(model: Dict) -> List[Dict]:
+    with _lock:
+        if model["cluster_list"] is None:
+            model["cluster_list"] = [model["clusters"][label] for label in sorted(model["clusters"])]
+        return model["cluster_list"]
+
+
+def get_clusters_in_radius(lat: float, lng: float, radius_meters: float) -> List[Dict]:
+    """
+    Clusters whose center lies within a radius (viewport query)
+
+    Answered by a spatial query on unsafe_zones when the store is enabled
+    and writable, so every worker serves the clusters persisted by any of
+    them; otherwise filters get_clusters().
+
     Args:
-        force_recalculate: Force recalculation even if cache exists
-        
+        lat: Center latitude
+        lng: Center longitude
+        radius_meters: Radius in meters
+
     Returns:
         List of cluster dictionaries
     """
-    global _clusters_cache, _clusters_last_update
-    
-    if _clusters_cache is not None and not force_recalculate:
-        return _clusters_cache
-    
-    # Get all incidents
-    incidents = get_incidents()
-    
-    if len(incidents) < settings.dbscan_min_samples:
-        _clusters_cache = []
+    # Fits (and persists) on first use, flushes pending changes otherwise
+    clusters = get_clusters()
+    if settings.cluster_store_enabled and _store_ok is not False:
+        from app.db.storage import get_unsafe_zones_in_radius
+        try:
+            return get_unsafe_zones_in_radius(lat, lng, radius_meters)
+        except Exception as e:
+            logger.warning(f"Cluster viewport query on unsafe_zones failed, filtering in memory: {e}")
+    if not clusters:
         return []
-    
-    # Prepare data for clustering
-    coordinates = np.array([
-        [incident["latitude"], incident["longitude"]]
-        for incident in incidents
-    ])
-    
-    # Apply DBSCAN clustering
-    clustering = DBSCAN(
-        eps=settings.dbscan_eps,
-        min_samples=settings.dbscan_min_samples,
-        metric='euclidean'
+    d = risk_kernel.haversine_np(
+        lat, lng,
+        np.array([c["center"]["lat"] for c in clusters]),
+        np.array([c["center"]["lng"] for c in clusters]),
     )
-    
-    cluster_labels = clustering.fit_predict(coordinates)
-    
-    # Extract cluster information
-    clusters = []
-    unique_labels = set(cluster_labels)
-    
-    # Remove noise label (-1)
-    unique_labels.discard(-1)
-    
-    for cluster_id in unique_labels:
-        # Get incidents in this cluster
-        cluster_indices = np.where(cluster_labels == cluster_id)[0]
-        cluster_incidents = [incidents[i] for i in cluster_indices]
-        
-        # Calculate cluster center
-        cluster_coords = coordinates[cluster_indices]
-        center_lat = float(np.mean(cluster_coords[:, 0]))
-        center_lng = float(np.mean(cluster_coords[:, 1]))
-        
-        # Calculate cluster radius (max distance from center)
-        distances = np.sqrt(
-            np.sum((cluster_coords - [center_lat, center_lng])**2, axis=1)
-        )
-        radius_degrees = float(np.max(distances))
-        radius_meters = radius_degrees * 111000  # Convert to meters
-        
-        # Calculate average risk score for cluster
-        from app.ml.risk_scoring import calculate_risk_score
-        risk_data = calculate_risk_score(center_lat, center_lng)
-        
-        clusters.append({
-            "id": f"cluster_{cluster_id}",
-            "center": {
-                "lat": center_lat,
-                "lng": center_lng,
-            },
-            "radius": radius_meters,
-            "risk_score": risk_data["risk_score"],
-            "incident_count": len(cluster_incidents),
-        })
-    
-    _clusters_cache = clusters
-    return clusters
+    return [c for c, inside in zip(clusters, (d <= radius_meters).tolist()) if inside]
+
+
+# ==================== Background worker ====================
+
+def _request_recompute(full: bool) -> None:
+    """Ask the worker for a refresh (or a full refit); coalesced within the debounce window"""
+    now = time.monotonic()
+    with _pending_lock:
+        _pending["full"] = _pending["full"] or full
+        if _pending["first"] is None:
+            _pending["first"] = now
+        _pending["last"] = now
+        _pending["requests"] += 1
+    _wake.set()
+
+
+def _recompute_pending() -> bool:
+    with _pending_lock:
+        return _pending["first"] is not None
+
+
+def _worker_running() -> bool:
+    return _worker is not None and _worker.is_alive() and not _stop.is_set()
+
+
+def _take_pending() -> Optional[Dict]:
+    """Wait out the debounce window, then take the coalesced request (None when stopping)"""
+    debounce = max(0.0, float(settings.cluster_recompute_debounce_seconds))
+    max_delay = max(debounce, float(settings.cluster_recompute_max_delay_seconds))
+    while not _stop.is_set():
+        with _pending_lock:
+            first, last = _pending["first"], _pending["last"]
+            if first is None:
+                return None
+            due = min(last + debounce, first + max_delay)
+            if time.monotonic() >= due:
+                taken = dict(_pending)
+                _pending.update(full=False, first=None, last=None, requests=0)
+                return taken
+        _stop.wait(max(0.01, due - time.monotonic()))
+    return None
+
+
+def _run_worker() -> None:
+    while not _stop.is_set():
+        woke = _wake.wait(_reader_reload_seconds() if _role == "reader" else None)
+        _wake.clear()
+        taken = _take_pending() if woke else None
+        if _stop.is_set():
+            break
+        if _role == "reader":
+            # Periodic and after incident changes (debounced, so the writer persisted)
+            try:
+                _sync_reader()
+                metrics.inc("ml_cluster_recompute_total", kind="reload")
+            except Exception as e:
+                logger.error(f"Cluster reload failed: {e}", exc_info=True)
+                metrics.inc("ml_cluster_recompute_total", kind="error")
+            continue
+        if taken is None:
+            continue
+        kind = "full" if taken["full"] or _model is None else "refresh"
+        try:
+            if kind == "full":
+                _build_model(force=True)
+            else:
+                _refresh(_model)
+            metrics.inc("ml_cluster_recompute_total", kind=kind)
+            metrics.inc("ml_cluster_recompute_requests_total", taken["requests"], kind=kind)
+        except Exception as e:
+            # Readers keep the last good clusters; retry on the next request
+            logger.error(f"Cluster recompute ({kind}) failed: {e}", exc_info=True)
+            metrics.inc("ml_cluster_recompute_total", kind="error")
+
+
+def start() -> None:
+    """
+    Elect the unsafe_zones writer, load persisted clusters and start the
+    recompute worker (idempotent)
+
+    A restarted or forked writer serves the persisted zones without
+    refitting; without any, the first fit runs in the background worker.
+    Readers only ever serve the persisted zones.
+    """
+    global _role, _worker
+    from app.db.storage import register_change_listener, try_acquire_zone_writer_lock
+
+    register_change_listener(_on_incident_change)
+    if settings.cluster_store_enabled and _role is None:
+        try:
+            _role = "writer" if try_acquire_zone_writer_lock() else "reader"
+        except Exception as e:
+            # Fit locally; _persist retries the election
+            logger.warning(f"Failed to take the unsafe_zones writer lock: {e}")
+        try:
+            version = _load_persisted(keep_empty=_role == "reader")
+        except Exception as e:
+            logger.warning(f"Failed to load persisted clusters: {e}")
+            version = None
+        if version is not None:
+            logger.info(f"Loaded {len(_persisted['clusters'])} persisted clusters (version {version})")
+        logger.info(f"Clusters: {_role or 'local'} role")
+
+    if not settings.cluster_worker_enabled or (_worker is not None and _worker.is_alive()):
+        return
+    _stop.clear()
+    _worker = threading.Thread(target=_run_worker, name="cluster-recompute", daemon=True)
+    _worker.start()
+    if _model is None and _persisted is None and _role != "reader":
+        _request_recompute(full=True)
+
 
+def stop() -> None:
+    """Stop the recompute worker (pending requests are dropped) and release the writer lock"""
+    global _worker, _role
+    _stop.set()
+    _wake.set()
+    if _worker is not None:
+        _worker.join(timeout=5)
+        _worker = None
+    if _role == "writer":
+        from app.db.storage import release_zone_writer_lock
+        release_zone_writer_lock()
+    _role = None
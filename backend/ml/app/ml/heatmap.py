@@ -3,18 +3,355 @@ Heatmap Generator - Grid-based risk visualization
 NOW SUPPORTS TIME-BASED RISK CALCULATION
 """
 
+import logging
 import math
-from typing import Dict, Optional
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from datetime import datetime, timezone
-from app.ml.risk_scoring import calculate_risk_score, _calculate_risk_score_from_incidents
-from app.ml.clustering import get_clusters
-from app.utils.geospatial import calculate_distance_haversine
+import numpy as np
+from cachetools import TTLCache
+from app.config import settings
+from app.ml import risk_kernel
+from app.ml.risk_scoring import _query_now
+from app.ml.clustering import get_clusters_in_radius
 from app.utils.land_mask import is_point_allowed
+from app.utils import geospatial, grid, metrics
 
+logger = logging.getLogger(__name__)
 
-def meters_to_degrees(meters: float) -> float:
-    """Convert meters to degrees (approximate)"""
-    return meters / 111000.0
+# Maximum cells per heatmap response (prevents timeout); also the target
+# upper bound when picking a pyramid level
+MAX_HEATMAP_CELLS = 3000
+
+# Placeholder risk for cells that failed to score (never cached)
+_UNSCORED_RISK = {"risk_score": 0.0, "risk_level": "very_safe"}
+
+# Scored on-demand cells shared across views (see score_cells)
+_cell_cache: Optional[TTLCache] = None
+_cell_cache_lock = threading.Lock()
+
+
+def _fetch_buffer(level: int, center_lat: float, radius_meters: float) -> float:
+    """Meters to fetch beyond the view radius: whole edge cells plus the 1km scoring context"""
+    # Cells are widest east-west at the view latitude closest to the equator
+    widest_lat = max(0.0, abs(center_lat) - geospatial.meters_to_degrees(radius_meters))
+    ns, ew = grid.cell_size_meters(grid.level_cell_meters(level), widest_lat)
+    return max(1000.0, math.hypot(ns, ew))
+
+
+def _bin_view(
+    incidents: List[Dict],
+    center_lat: float,
+    center_lng: float,
+    radius_meters: float,
+    level: int,
+) -> Dict[Tuple[int, int], List[Dict]]:
+    """
+    Group incidents into global grid cells at a level
+
+    A cell belongs to the view when its incident centroid is within the
+    radius, and then holds all of its incidents (not only those in view), so
+    its centroid, count and score do not depend on the view. incidents must
+    cover radius_meters + the cell diagonal (see _fetch_buffer).
+
+    Returns:
+        {(i, j): incidents} in first-seen order
+    """
+    view_bins: Dict[Tuple[int, int], List[Dict]] = {}
+    if not incidents:
+        return view_bins
+    lats = np.array([float(x["latitude"]) for x in incidents], dtype=np.float64)
+    lngs = np.array([float(x["longitude"]) for x in incidents], dtype=np.float64)
+    ci, cj = grid.cell_indices(lats, lngs, grid.level_cell_meters(level))
+    sums: Dict[Tuple[int, int], List[float]] = {}
+    for inc, i, j, lat_v, lng_v in zip(incidents, ci.tolist(), cj.tolist(), lats.tolist(), lngs.tolist()):
+        key = (i, j)
+        view_bins.setdefault(key, []).append(inc)
+        acc = sums.setdefault(key, [0.0, 0.0])
+        acc[0] += lat_v
+        acc[1] += lng_v
+
+    keys = list(view_bins)
+    n = np.array([len(view_bins[k]) for k in keys], dtype=np.float64)
+    d = risk_kernel.haversine_np(
+        center_lat, center_lng,
+        np.array([sums[k][0] for k in keys]) / n, np.array([sums[k][1] for k in keys]) / n,
+    )
+    return {k: view_bins[k] for k, inside in zip(keys, (d <= radius_meters).tolist()) if inside}
+
+
+def _bin_key(bin_incidents: List[Dict], level: int) -> Tuple[int, int]:
+    """Global grid cell of a bin from _bin_view"""
+    first = bin_incidents[0]
+    return grid.cell_index(float(first["latitude"]), float(first["longitude"]), grid.level_cell_meters(level))
+
+
+def collect_cells(bins: Iterable[list], max_cells: int) -> Tuple[list, int]:
+    """
+    Turn incident bins into candidate cells
+
+    Each cell sits at the centroid of its incidents (aligns better than the
+    grid center); cells outside the land/city mask are dropped.
+
+    Args:
+        bins: Lists of incident dicts, one per grid bin
+        max_cells: Stop after this many cells
+
+    Returns:
+        ([(cell_lat, cell_lng, bin_incidents), ...], skipped_mask_cells)
+    """
+    cell_bins: list = []
+    skipped_mask_cells = 0
+    for bin_incidents in bins:
+        if len(cell_bins) >= max_cells:
+            break
+        lats = [float(x["latitude"]) for x in bin_incidents]
+        lngs = [float(x["longitude"]) for x in bin_incidents]
+        cell_lat = sum(lats) / len(lats)
+        cell_lng = sum(lngs) / len(lngs)
+
+        # Research-grade land/city masking: discard cells outside polygon boundary
+        if not is_point_allowed(cell_lat, cell_lng):
+            skipped_mask_cells += 1
+            continue
+        cell_bins.append((cell_lat, cell_lng, bin_incidents))
+    return cell_bins, skipped_mask_cells
+
+
+def _score_centroids(
+    cell_lat: np.ndarray,
+    cell_lng: np.ndarray,
+    query_local_hour: int,
+    context_columns: Dict[str, np.ndarray],
+    now: datetime,
+) -> Dict[str, np.ndarray]:
+    """risk_kernel.score_points (1km) for cell centroids; large batches go to the process pool"""
+    from app.ml import parallel_scoring
+    if parallel_scoring.is_enabled(cell_lat.shape[0]):
+        return parallel_scoring.score_points_parallel(
+            cell_lat, cell_lng, query_local_hour, context_columns, now.timestamp()
+        )
+    return risk_kernel.score_points(
+        cell_lat,
+        cell_lng,
+        np.full(cell_lat.shape[0], query_local_hour, dtype=np.int64),
+        context_columns,
+        now_ts=now.timestamp(),
+        radius_meters=1000.0,
+    )
+
+
+def _get_cell_cache() -> TTLCache:
+    global _cell_cache
+    if _cell_cache is None:
+        _cell_cache = TTLCache(
+            maxsize=max(1, int(settings.heatmap_cell_cache_max_entries)),
+            ttl=max(1, int(settings.cache_ttl)),
+        )
+    return _cell_cache
+
+
+def _score_cells_cached(
+    cell_bins: list,
+    context_incidents: List[Dict],
+    query_local_hour: int,
+    now: datetime,
+    use_aggregates: bool,
+    context_columns: Optional[Dict[str, np.ndarray]],
+    level: int,
+) -> Tuple[List[Dict], int]:
+    """score_cells through the shared cell cache (current-time views only)"""
+    from app.db.storage import get_data_version
+    from app.ml.risk_cache import params_hash
+
+    # A cell's score depends only on its incidents and their 1km context, so
+    # one entry serves every view containing the cell until the next write
+    suffix = (int(query_local_hour) % 24, bool(use_aggregates), get_data_version(), params_hash())
+    keys = [(level, *_bin_key(bin_incidents, level)) + suffix for _, _, bin_incidents in cell_bins]
+    cache = _get_cell_cache()
+    with _cell_cache_lock:
+        results = [cache.get(key) for key in keys]
+    missing = [idx for idx, r in enumerate(results) if r is None]
+    metrics.inc("ml_heatmap_cell_cache_total", len(cell_bins) - len(missing), result="hit")
+    metrics.inc("ml_heatmap_cell_cache_total", len(missing), result="miss")
+    if not missing:
+        return results, 0
+
+    scored, scored_rows = score_cells(
+        [cell_bins[idx] for idx in missing], context_incidents, query_local_hour, now,
+        use_aggregates, context_columns,
+    )
+    with _cell_cache_lock:
+        for idx, risk_data in zip(missing, scored):
+            results[idx] = risk_data
+            if risk_data is not _UNSCORED_RISK:
+                cache[keys[idx]] = risk_data
+    return results, scored_rows
+
+
+def score_cells(
+    cell_bins: list,
+    context_incidents: List[Dict],
+    query_local_hour: int,
+    now: datetime,
+    use_aggregates: bool = False,
+    context_columns: Optional[Dict[str, np.ndarray]] = None,
+    cache_level: Optional[int] = None,
+) -> Tuple[List[Dict], int]:
+    """
+    Risk for every cell from collect_cells
+
+    The raw-incident path runs one batched KD-tree radius query (1km, matches
+    risk scoring semantics) for all centroids and scores them in a single
+    vectorized pass (split across the process pool for large batches, see
+    parallel_scoring); context_incidents must cover every cell's 1km neighborhood.
+    Pass context_columns (kernel columns of context_incidents) when scoring
+    several batches against the same context.
+
+    With cache_level (the global grid level of the bins, see _bin_view) scores
+    are shared across views through a cache keyed on the cell ID, local hour
+    and incident-store version; pass it only for current-time views.
+
+    Returns:
+        (risk dictionaries in cell order, number of context incidents scored)
+    """
+    if cache_level is not None and cell_bins and settings.heatmap_cell_cache_max_entries > 0:
+        return _score_cells_cached(
+            cell_bins, context_incidents, query_local_hour, now, use_aggregates, context_columns, cache_level
+        )
+
+    if use_aggregates:
+        from app.ml import aggregates
+        results = []
+        for cell_lat, cell_lng, _ in cell_bins:
+            try:
+                results.append(aggregates.risk_for_point(cell_lat, cell_lng, query_local_hour, now))
+            except Exception as e:
+                logger.error(f"Error calculating aggregate risk for cell ({cell_lat}, {cell_lng}): {e}")
+                results.append(_UNSCORED_RISK)
+        return results, 0
+
+    if not cell_bins:
+        return [], 0
+    try:
+        if context_columns is None:
+            context_columns = risk_kernel.incidents_to_columns(context_incidents)
+        cell_lat = np.array([c[0] for c in cell_bins], dtype=np.float64)
+        cell_lng = np.array([c[1] for c in cell_bins], dtype=np.float64)
+        scores = _score_centroids(cell_lat, cell_lng, query_local_hour, context_columns, now)
+        return risk_kernel.result_dicts(scores, calculated_at=now.isoformat()), len(context_columns["lat"])
+    except Exception as e:
+        logger.error(f"Error calculating risk for incident-cells: {e}", exc_info=True)
+        return [_UNSCORED_RISK] * len(cell_bins), 0
+
+
+def cell_dict(
+    cell_lat: float, cell_lng: float, bin_incidents: List[Dict], risk_data: Dict, level: Optional[int] = None
+) -> Dict:
+    """Heatmap cell payload (with the global cell "id" when the grid level is given)"""
+    # last incident timestamp in this bin (best-effort)
+    last_incident = None
+    try:
+        ts_list = []
+        for x in bin_incidents:
+            ts = x.get("timestamp")
+            ts_list.append(ts)
+        # timestamps may be datetime or strings; keep as-is for now
+        last_incident = max(ts_list) if ts_list else None
+    except Exception:
+        last_incident = None
+
+    cell = {} if level is None else {"id": grid.cell_id(level, *_bin_key(bin_incidents, level))}
+    cell.update({
+        "lat": cell_lat,
+        "lng": cell_lng,
+        "risk_score": risk_data.get("risk_score", 0.0),
+        "risk_level": risk_data.get("risk_level", "very_safe"),
+        "incident_count": len(bin_incidents),
+        "last_incident": last_incident,
+    })
+    return cell
+
+
+def _view_cell_bins(
+    center_lat: float,
+    center_lng: float,
+    radius_meters: int,
+    grid_size_meters: int,
+    query_timestamp: Optional[datetime],
+    local_hour: Optional[int],
+) -> Dict:
+    """
+    Fetch, bin and mask the incidents of a heatmap view (on-demand path)
+
+    Returns:
+        Dictionary with cell_bins (see collect_cells), level (global grid
+        level of the cells), incidents_context, use_aggregates, now,
+        query_local_hour, max_cells and skipped_mask_cells
+    """
+    import time
+    from app.db.storage import get_incidents_in_radius
+
+    # Cells come from the global grid (app.utils.grid): the finest level that
+    # fits the grid size and keeps the view within the cell cap. Cell
+    # boundaries do not depend on the view, so overlapping views share cells.
+    max_cells = MAX_HEATMAP_CELLS  # Maximum cells to generate (prevents timeout)
+    level = grid.view_level(radius_meters, grid_size_meters, max_cells)
+    if grid.level_cell_meters(level) > grid_size_meters:
+        logger.info(
+            f"Using {grid.level_cell_meters(level):.0f}m grid cells (level {level}) for "
+            f"grid_size={grid_size_meters}m, radius={radius_meters}m"
+        )
+
+    # OPTION B (performance + UX): generate cells ONLY where incidents exist.
+    # This avoids computing thousands of "safe" grid cells and keeps the heatmap focused
+    # on reported/incident regions.
+    with metrics.timed("heatmap.fetch") as stage:
+        # One fetch covering every cell whose centroid can fall in view plus a
+        # 1km buffer for neighborhood context (so cell scoring near edges still
+        # sees incidents within its 1km local neighborhood).
+        incidents_context = get_incidents_in_radius(
+            center_lat, center_lng, radius_meters + _fetch_buffer(level, center_lat, radius_meters),
+            include_distance=True,
+        )
+        stage.rows = len(incidents_context)
+    binning_started = time.perf_counter()
+    view_bins = _bin_view(incidents_context, center_lat, center_lng, radius_meters, level)
+    metrics.observe_stage(
+        "heatmap.binning", time.perf_counter() - binning_started,
+        rows=len(incidents_context), cells=len(view_bins),
+    )
+
+    # Wide views score cells from the decayed per-cell aggregates (O(cells)
+    # per cell instead of a neighborhood scan over raw incidents).
+    from app.ml import aggregates
+    use_aggregates = (
+        radius_meters >= settings.aggregate_heatmap_min_radius and aggregates.is_ready()
+    )
+    now = _query_now(query_timestamp)
+    query_local_hour = local_hour if local_hour is not None else now.hour
+
+    logger.info(
+        f"Incident-based heatmap: incidents_context={len(incidents_context)}, active_bins={len(view_bins)}"
+    )
+
+    # Pass 1: cell centroids, land/city masking and the max_cells cap
+    t = time.perf_counter()
+    cell_bins, skipped_mask_cells = collect_cells(view_bins.values(), max_cells)
+    metrics.observe_stage(
+        "heatmap.land_mask", time.perf_counter() - t, cells=len(cell_bins) + skipped_mask_cells
+    )
+
+    return {
+        "cell_bins": cell_bins,
+        "level": level,
+        "incidents_context": incidents_context,
+        "use_aggregates": use_aggregates,
+        "now": now,
+        "query_local_hour": query_local_hour,
+        "max_cells": max_cells,
+        "skipped_mask_cells": skipped_mask_cells,
+    }
 
 
 def generate_heatmap(
@@ -39,186 +376,71 @@ def generate_heatmap(
         Dictionary with heatmap data
     """
     import logging
+    import time
     logger = logging.getLogger(__name__)
+    started = time.perf_counter()
     
     try:
-        # Convert to degrees
-        radius_degrees = meters_to_degrees(radius_meters)
-        grid_size_degrees = meters_to_degrees(grid_size_meters)
-        
-        # Calculate grid bounds
-        lat_min = center_lat - radius_degrees
-        lat_max = center_lat + radius_degrees
-        lng_min = center_lng - radius_degrees
-        lng_max = center_lng + radius_degrees
-        
-        # Limit grid size to prevent excessive computation and timeout
-        # For large radii, use a maximum number of cells to prevent timeout
-        # Reduced from 10000 to 3000 to prevent timeout issues
-        max_cells = 3000  # Maximum cells to generate (prevents timeout)
-        estimated_cells = int((2 * radius_degrees / grid_size_degrees) ** 2)
-        
-        if estimated_cells > max_cells:
-            # Adjust grid size to stay within limit
-            # Increase grid size (larger cells) to reduce total cell count
-            adjusted_grid_size = math.sqrt((2 * radius_degrees) ** 2 / max_cells)
-            grid_size_degrees = max(grid_size_degrees, adjusted_grid_size)
-            logger.warning(f"Grid too large ({estimated_cells} cells), adjusting grid_size to {grid_size_degrees:.6f} degrees (was {meters_to_degrees(grid_size_meters):.6f}) to prevent timeout")
-
-        # Safety check: ensure bounds are valid (after any clipping)
-        if lat_min >= lat_max or lng_min >= lng_max:
-            logger.error(
-                f"Invalid bounds after clipping: lat [{lat_min:.6f}, {lat_max:.6f}], "
-                f"lng [{lng_min:.6f}, {lng_max:.6f}]"
+        # Current-time views are answered from the precomputed multi-resolution
+        # pyramid (finest level that fits the radius and grid size).
+        from app.ml import heatmap_pyramid
+        from app.db.storage import get_data_version, get_version_token
+        pyramid_result = None
+        grid_level = None
+        # Incident-store version the cells reflect (base for /heatmap/delta)
+        data_version = get_data_version()
+        if heatmap_pyramid.is_ready() and heatmap_pyramid.is_current(query_timestamp):
+            with metrics.timed("heatmap.pyramid") as stage:
+                pyramid_result = heatmap_pyramid.query_cells_by_key(
+                    center_lat,
+                    center_lng,
+                    radius_meters,
+                    grid_size_meters,
+                    local_hour if local_hour is not None else _query_now(query_timestamp).hour,
+                    MAX_HEATMAP_CELLS,
+                )
+                if pyramid_result is not None:
+                    stage.cells = len(pyramid_result[2])
+
+        if pyramid_result is not None:
+            grid_level, data_version, keyed_cells = pyramid_result
+            cells = list(keyed_cells.values())
+            logger.info(
+                f"Heatmap from pyramid level {grid_level} "
+                f"({heatmap_pyramid.level_cell_meters(grid_level):.0f}m cells): {len(cells)} cells"
             )
-            # Use original bounds if clipping resulted in invalid bounds
-            lat_min = center_lat - radius_degrees
-            lat_max = center_lat + radius_degrees
-            lng_min = center_lng - radius_degrees
-            lng_max = center_lng + radius_degrees
-            logger.warning(
-                f"Using original bounds: lat [{lat_min:.6f}, {lat_max:.6f}], "
-                f"lng [{lng_min:.6f}, {lng_max:.6f}]"
+        else:
+            view = _view_cell_bins(
+                center_lat, center_lng, radius_meters, grid_size_meters, query_timestamp, local_hour
             )
+            cell_bins = view["cell_bins"]
+            use_aggregates = view["use_aggregates"]
+            max_cells = view["max_cells"]
+            grid_level = view["level"]
+            skipped_mask_cells = view["skipped_mask_cells"]
 
-        # Safety check: ensure grid_size is smaller than bounds range
-        lat_range = lat_max - lat_min
-        lng_range = lng_max - lng_min
-        if grid_size_degrees >= lat_range or grid_size_degrees >= lng_range:
-            logger.warning(
-                f"Grid size ({grid_size_degrees:.6f}) is too large for bounds range "
-                f"(lat: {lat_range:.6f}, lng: {lng_range:.6f}). Using smaller grid size."
+            # Pass 2: score every cell
+            t = time.perf_counter()
+            risk_results, scored_rows = score_cells(
+                cell_bins, view["incidents_context"], view["query_local_hour"], view["now"], use_aggregates,
+                cache_level=grid_level if heatmap_pyramid.is_current(query_timestamp) else None,
+            )
+            metrics.observe_stage(
+                "heatmap.aggregate_scoring" if use_aggregates else "heatmap.scoring",
+                time.perf_counter() - t, rows=scored_rows, cells=len(cell_bins),
             )
-            grid_size_degrees = min(lat_range, lng_range) / 10  # 10% of smallest range
-            logger.info(f"Adjusted grid_size to {grid_size_degrees:.6f} degrees")
-        
-        # OPTION B (performance + UX): generate cells ONLY where incidents exist.
-        # This avoids computing thousands of "safe" grid cells and keeps the heatmap focused
-        # on reported/incident regions.
-        from app.db.storage import get_incidents_in_radius
-
-        # Fetch incidents in view (for deciding which cells exist)
-        incidents_in_view = get_incidents_in_radius(center_lat, center_lng, radius_meters)
-
-        # Fetch a slightly larger radius for neighborhood context (so cell scoring near edges
-        # still sees incidents within its 1km local neighborhood).
-        incidents_context = get_incidents_in_radius(center_lat, center_lng, radius_meters + 1000)
-
-        # Bin incidents into grid buckets (based on bounding box + grid size).
-        # We keep two maps:
-        # - view_bins: bins that have incidents within the requested view radius
-        # - context_bins: bins that include a buffer for neighborhood scoring
-        view_bins: Dict[tuple, list] = {}
-        context_bins: Dict[tuple, list] = {}
-
-        def _bin_key(lat_v: float, lng_v: float) -> tuple:
-            i = int((lat_v - lat_min) / grid_size_degrees)
-            j = int((lng_v - lng_min) / grid_size_degrees)
-            return (i, j)
-
-        for inc in incidents_context:
-            try:
-                k = _bin_key(float(inc["latitude"]), float(inc["longitude"]))
-                context_bins.setdefault(k, []).append(inc)
-            except Exception:
-                continue
-
-        for inc in incidents_in_view:
-            try:
-                k = _bin_key(float(inc["latitude"]), float(inc["longitude"]))
-                view_bins.setdefault(k, []).append(inc)
-            except Exception:
-                continue
-
-        # Score each bin that has at least one incident in view.
-        # For each bin center, we compute risk using only incidents in nearby bins within ~1km.
-        neighbor_range = int(math.ceil(1000.0 / max(1.0, float(grid_size_meters))))
-
-        cells = []
-        skipped_mask_cells = 0
-        cell_count = 0
-
-        logger.info(
-            f"Incident-based heatmap: incidents_in_view={len(incidents_in_view)}, "
-            f"incidents_context={len(incidents_context)}, active_bins={len(view_bins)}"
-        )
-
-        for (i, j), bin_incidents in view_bins.items():
-            if cell_count >= max_cells:
-                break
-
-            # Use centroid of incidents in this bin for better alignment than grid center.
-            lats = [float(x["latitude"]) for x in bin_incidents]
-            lngs = [float(x["longitude"]) for x in bin_incidents]
-            cell_lat = sum(lats) / len(lats)
-            cell_lng = sum(lngs) / len(lngs)
-
-            # Research-grade land/city masking: discard cells outside polygon boundary
-            if not is_point_allowed(cell_lat, cell_lng):
-                skipped_mask_cells += 1
-                continue
-
-            # Build neighborhood incident set from nearby bins
-            neighborhood: list = []
-            for di in range(-neighbor_range, neighbor_range + 1):
-                for dj in range(-neighbor_range, neighbor_range + 1):
-                    neighborhood.extend(context_bins.get((i + di, j + dj), []))
-
-            # Filter neighborhood to within 1km of cell center (matches risk scoring semantics)
-            nearby_for_cell: list = []
-            for inc in neighborhood:
-                try:
-                    d_m = calculate_distance_haversine(
-                        cell_lat, cell_lng, float(inc["latitude"]), float(inc["longitude"])
-                    )
-                    if d_m <= 1000.0:
-                        nearby_for_cell.append(inc)
-                except Exception:
-                    continue
 
-            try:
-                risk_data = _calculate_risk_score_from_incidents(
-                    lat=cell_lat,
-                    lng=cell_lng,
-                    incidents=nearby_for_cell,
-                    query_timestamp=query_timestamp,
-                    local_hour=local_hour,
-                    radius_meters=1000.0,
-                )
-            except Exception as e:
-                logger.error(f"Error calculating risk for incident-cell ({cell_lat}, {cell_lng}): {e}")
-                risk_data = {"risk_score": 0.0, "risk_level": "very_safe"}
+            cells = [
+                cell_dict(cell_lat, cell_lng, bin_incidents, risk_data, grid_level)
+                for (cell_lat, cell_lng, bin_incidents), risk_data in zip(cell_bins, risk_results)
+            ]
 
-            # last incident timestamp in this bin (best-effort)
-            last_incident = None
-            try:
-                ts_list = []
-                for x in bin_incidents:
-                    ts = x.get("timestamp")
-                    ts_list.append(ts)
-                # timestamps may be datetime or strings; keep as-is for now
-                last_incident = max(ts_list) if ts_list else None
-            except Exception:
-                last_incident = None
-
-            cells.append(
-                {
-                    "lat": cell_lat,
-                    "lng": cell_lng,
-                    "risk_score": risk_data.get("risk_score", 0.0),
-                    "risk_level": risk_data.get("risk_level", "very_safe"),
-                    "incident_count": len(bin_incidents),
-                    "last_incident": last_incident,
-                }
+            logger.info(
+                f"Generated {len(cells)} incident-based heatmap cells for area centered at ({center_lat}, {center_lng}). "
+                f"Skipped {skipped_mask_cells} masked-out cells; capped at {max_cells}."
             )
-            cell_count += 1
-
-        logger.info(
-            f"Generated {len(cells)} incident-based heatmap cells for area centered at ({center_lat}, {center_lng}). "
-            f"Skipped {skipped_mask_cells} masked-out cells; capped at {max_cells}."
-        )
-        # No fallback center cell: when no incidents are in view, return empty cells.
-        # A fallback at viewport center created a confusing "moving circle" that followed pan/zoom.
+            # No fallback center cell: when no incidents are in view, return empty cells.
+            # A fallback at viewport center created a confusing "moving circle" that followed pan/zoom.
 
     except Exception as e:
         logger.error(f"Error generating heatmap: {e}", exc_info=True)
@@ -232,13 +454,16 @@ def generate_heatmap(
             "last_incident": None,
         }]
         logger.warning("Returning minimal heatmap due to error")
+        data_version = None
+        grid_level = None
     
     filtered_clusters = []
     if include_clusters:
         # Admin-only: clusters can be computed/returned for dashboards and analysis.
         # Mobile heatmap UI intentionally does not rely on clusters.
         try:
-            clusters = get_clusters()
+            with metrics.timed("heatmap.clusters"):
+                clusters = get_clusters_in_radius(center_lat, center_lng, radius_meters)
             all_clusters = []
             for cluster in clusters:
                 all_clusters.append(
@@ -255,6 +480,7 @@ def generate_heatmap(
             logger.error(f"Error getting clusters: {e}", exc_info=True)
             filtered_clusters = []
     
+    metrics.observe_stage("heatmap.total", time.perf_counter() - started, cells=len(cells))
     return {
         "center": {
             "lat": center_lat,
@@ -264,6 +490,287 @@ def generate_heatmap(
         "grid_size": grid_size_meters,
         "cells": cells,
         "clusters": filtered_clusters,
+        "version": get_version_token(data_version) if data_version is not None else None,
+        "level": grid_level,
+    }
+
+
+def cell_columns(
+    cell_bins: list,
+    context_incidents: List[Dict],
+    query_local_hour: int,
+    now: datetime,
+    use_aggregates: bool = False,
+) -> Dict[str, np.ndarray]:
+    """
+    Score cells from collect_cells into parallel arrays
+
+    Same scores as score_cells + cell_dict, taken straight from the kernel
+    arrays (no per-cell dicts). Columns: lat, lng, risk_score, risk_level
+    (index into risk_kernel.RISK_LEVELS), incident_count and last_incident
+    (epoch seconds, NaN when unknown).
+    """
+    n = len(cell_bins)
+    lat = np.fromiter((c[0] for c in cell_bins), dtype=np.float64, count=n)
+    lng = np.fromiter((c[1] for c in cell_bins), dtype=np.float64, count=n)
+    counts = np.fromiter((len(c[2]) for c in cell_bins), dtype=np.int64, count=n)
+    last = np.full(n, np.nan)
+    for idx, (_, _, bin_incidents) in enumerate(cell_bins):
+        epochs = [risk_kernel.timestamp_to_epoch(x.get("timestamp")) for x in bin_incidents]
+        epochs = [e for e in epochs if not math.isnan(e)]
+        if epochs:
+            last[idx] = max(epochs)
+
+    score = np.zeros(n)
+    levels = np.zeros(n, dtype=np.uint8)  # very_safe, as score_cells on error
+    if n and use_aggregates:
+        risk_results, _ = score_cells(cell_bins, context_incidents, query_local_hour, now, use_aggregates=True)
+        score = np.array([r.get("risk_score", 0.0) for r in risk_results], dtype=np.float64)
+        levels = np.array(
+            [risk_kernel.RISK_LEVELS.index(r.get("risk_level", "very_safe")) for r in risk_results],
+            dtype=np.uint8,
+        )
+    elif n:
+        try:
+            scores = _score_centroids(
+                lat, lng, query_local_hour, risk_kernel.incidents_to_columns(context_incidents), now
+            )
+            score = scores["risk_score"]
+            levels = risk_kernel.risk_level_codes(score, scores["raw_incident_count"])
+        except Exception as e:
+            logger.error(f"Error calculating risk for incident-cells: {e}", exc_info=True)
+
+    return {
+        "lat": lat,
+        "lng": lng,
+        "risk_score": np.round(score, 2),
+        "risk_level": levels,
+        "incident_count": counts,
+        "last_incident": last,
+    }
+
+
+def heatmap_columns(
+    center_lat: float,
+    center_lng: float,
+    radius_meters: int,
+    grid_size_meters: int,
+    query_timestamp: Optional[datetime] = None,
+    local_hour: Optional[int] = None,
+) -> Dict:
+    """
+    Heatmap as parallel arrays for the binary encodings (app.ml.heatmap_encoding)
+
+    Same cells as generate_heatmap (pyramid when current, else on-demand
+    scoring with the same cap); clusters are not included.
+
+    Returns:
+        Dictionary with center, radius, grid_size, local_hour and columns
+        (see cell_columns)
+    """
+    import time
+    from app.ml import heatmap_pyramid
+
+    started = time.perf_counter()
+    query_local_hour = local_hour if local_hour is not None else _query_now(query_timestamp).hour
+    columns = None
+    if heatmap_pyramid.is_ready() and heatmap_pyramid.is_current(query_timestamp):
+        with metrics.timed("heatmap.pyramid") as stage:
+            result = heatmap_pyramid.query_columns(
+                center_lat, center_lng, radius_meters, grid_size_meters, query_local_hour, MAX_HEATMAP_CELLS
+            )
+            if result is not None:
+                columns = result[1]
+                stage.cells = len(columns["lat"])
+
+    if columns is None:
+        view = _view_cell_bins(
+            center_lat, center_lng, radius_meters, grid_size_meters, query_timestamp, local_hour
+        )
+        with metrics.timed(
+            "heatmap.aggregate_scoring" if view["use_aggregates"] else "heatmap.scoring"
+        ) as stage:
+            columns = cell_columns(
+                view["cell_bins"], view["incidents_context"], view["query_local_hour"], view["now"],
+                view["use_aggregates"],
+            )
+            stage.cells = len(columns["lat"])
+
+    metrics.observe_stage("heatmap.total", time.perf_counter() - started, cells=len(columns["lat"]))
+    return {
+        "center": {"lat": center_lat, "lng": center_lng},
+        "radius": radius_meters,
+        "grid_size": grid_size_meters,
+        "local_hour": query_local_hour,
+        "columns": columns,
     }
 
 
+def generate_heatmap_hours(
+    center_lat: float,
+    center_lng: float,
+    radius_meters: int,
+    grid_size_meters: int,
+    query_timestamp: Optional[datetime] = None,
+) -> Dict:
+    """
+    Heatmap for all 24 LOCAL hours in one pass (time slider)
+
+    Same cells as generate_heatmap; distance and recency terms are computed
+    once per (cell, incident) pair and expanded to every hour with the
+    24x24 hour-similarity matrix (risk_kernel.score_points_all_hours), so
+    this costs about as much as a single-hour heatmap.
+
+    Returns:
+        Dictionary with center, radius, grid_size and cells; each cell has
+        risk_scores and risk_levels lists indexed by local hour (0-23)
+    """
+    import time
+    from app.ml import heatmap_pyramid
+
+    started = time.perf_counter()
+    cells = None
+    if heatmap_pyramid.is_ready() and heatmap_pyramid.is_current(query_timestamp):
+        with metrics.timed("heatmap_hours.pyramid") as stage:
+            result = heatmap_pyramid.query_cells_all_hours(
+                center_lat, center_lng, radius_meters, grid_size_meters, MAX_HEATMAP_CELLS
+            )
+            if result is not None:
+                cells = result[1]
+                stage.cells = len(cells)
+
+    if cells is None:
+        view = _view_cell_bins(center_lat, center_lng, radius_meters, grid_size_meters, query_timestamp, None)
+        cell_bins = view["cell_bins"]
+        cells = []
+        if cell_bins:
+            with metrics.timed("heatmap_hours.scoring") as stage:
+                scores = risk_kernel.score_points_all_hours(
+                    np.array([c[0] for c in cell_bins], dtype=np.float64),
+                    np.array([c[1] for c in cell_bins], dtype=np.float64),
+                    risk_kernel.incidents_to_columns(view["incidents_context"]),
+                    now_ts=view["now"].timestamp(),
+                    radius_meters=1000.0,
+                )
+                stage.rows = len(view["incidents_context"])
+                stage.cells = len(cell_bins)
+
+            rounded = np.round(scores["risk_score"], 2).tolist()
+            levels = risk_kernel.risk_level_codes(scores["risk_score"], scores["raw_incident_count"])
+            for (cell_lat, cell_lng, bin_incidents), cell_scores, cell_levels in zip(cell_bins, rounded, levels):
+                cell = cell_dict(cell_lat, cell_lng, bin_incidents, {})
+                cells.append({
+                    "lat": cell_lat,
+                    "lng": cell_lng,
+                    "risk_scores": cell_scores,
+                    "risk_levels": [risk_kernel.RISK_LEVELS[c] for c in cell_levels],
+                    "incident_count": cell["incident_count"],
+                    "last_incident": cell["last_incident"],
+                })
+
+    metrics.observe_stage("heatmap_hours.total", time.perf_counter() - started, cells=len(cells))
+    return {
+        "center": {"lat": center_lat, "lng": center_lng},
+        "radius": radius_meters,
+        "grid_size": grid_size_meters,
+        "hours": list(range(24)),
+        "cells": cells,
+    }
+
+
+def stream_heatmap(
+    center_lat: float,
+    center_lng: float,
+    radius_meters: int,
+    grid_size_meters: int,
+    query_timestamp: Optional[datetime] = None,
+    local_hour: Optional[int] = None,
+    include_clusters: bool = False,
+    chunk_cells: int = 500,
+) -> Iterator[bytes]:
+    """
+    Stream a heatmap as NDJSON (one JSON object per line)
+
+    Unlike generate_heatmap there is no cell cap and the grid is not
+    coarsened to fit one: cells are the finest global grid level with cells
+    of at least grid_size_meters (app.utils.grid), scored chunk_cells at a time and each chunk is
+    yielded as soon as it is ready, so memory stays bounded by the incident
+    context and clients get the first cells immediately.
+
+    Lines:
+        {"type": "meta", ...}     request parameters (first line)
+        {"type": "cell", ...}     one per cell (same fields as /heatmap cells)
+        {"type": "cluster", ...}  only with include_clusters
+        {"type": "end", "cells": N} or {"type": "error", "detail": ...} (last line)
+    """
+    import json
+    import time
+    from itertools import islice
+    from fastapi.encoders import jsonable_encoder
+    from app.db.storage import get_incidents_in_radius
+    from app.ml import heatmap_pyramid
+
+    def _line(obj: Dict) -> str:
+        return json.dumps(jsonable_encoder(obj), separators=(",", ":"))
+
+    started = time.perf_counter()
+    now = _query_now(query_timestamp)
+    query_local_hour = local_hour if local_hour is not None else now.hour
+    level = grid.level_for_size(grid_size_meters)
+    yield (_line({
+        "type": "meta",
+        "center": {"lat": center_lat, "lng": center_lng},
+        "radius": radius_meters,
+        "grid_size": grid_size_meters,
+        "level": level,
+        "local_hour": query_local_hour,
+        "timestamp": now,
+    }) + "\n").encode()
+
+    count = 0
+    try:
+        with metrics.timed("heatmap_stream.fetch") as stage:
+            incidents_context = get_incidents_in_radius(
+                center_lat, center_lng, radius_meters + _fetch_buffer(level, center_lat, radius_meters),
+                include_distance=True,
+            )
+            stage.rows = len(incidents_context)
+        context_columns = risk_kernel.incidents_to_columns(incidents_context)
+        view_bins = _bin_view(incidents_context, center_lat, center_lng, radius_meters, level)
+
+        bins = iter(view_bins.values())
+        while True:
+            chunk = list(islice(bins, chunk_cells))
+            if not chunk:
+                break
+            cell_bins, _ = collect_cells(chunk, len(chunk))
+            risk_results, _ = score_cells(
+                cell_bins, incidents_context, query_local_hour, now, context_columns=context_columns,
+                cache_level=level if heatmap_pyramid.is_current(query_timestamp) else None,
+            )
+            lines = [
+                _line({"type": "cell", **cell_dict(cell_lat, cell_lng, bin_incidents, risk_data, level)})
+                for (cell_lat, cell_lng, bin_incidents), risk_data in zip(cell_bins, risk_results)
+            ]
+            count += len(lines)
+            if lines:
+                yield ("\n".join(lines) + "\n").encode()
+
+        if include_clusters:
+            for cluster in get_clusters_in_radius(center_lat, center_lng, radius_meters):
+                yield (_line({
+                    "type": "cluster",
+                    "id": cluster["id"],
+                    "center": cluster["center"],
+                    "radius": cluster["radius"],
+                    "risk_score": cluster["risk_score"],
+                    "incident_count": cluster["incident_count"],
+                }) + "\n").encode()
+    except Exception as e:
+        logger.error(f"Error streaming heatmap: {e}", exc_info=True)
+        yield (_line({"type": "error", "detail": str(e), "cells": count}) + "\n").encode()
+        return
+    finally:
+        metrics.observe_stage("heatmap_stream.total", time.perf_counter() - started, cells=count)
+
+    yield (_line({"type": "end", "cells": count}) + "\n").encode()
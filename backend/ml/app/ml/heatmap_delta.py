@@ -0,0 +1,213 @@
+"""
+Heatmap Delta - incremental heatmap updates keyed on the incident-store version
+
+Every incident write bumps storage.get_data_version() and is appended to a
+bounded change log (version, event, location). Clients see versions as
+tokens tagged with the process epoch (storage.get_version_token), since
+versions of different worker processes are not comparable. GET
+/ml/heatmap/delta?since=V returns only the pyramid cells of the viewport that those writes touched
+(cells within the 1km scoring radius of a written incident):
+
+- added:   cells that did not exist at version V (all their incidents are newer)
+- changed: other touched cells (full cell payload, same fields as /heatmap)
+- removed: IDs of touched cells that no longer exist in the view
+
+Cells are identified by their pyramid cell ID ("level:i:j"), which is also
+returned in /heatmap responses served from the pyramid, along with the
+version they reflect. When V predates the log (truncated or cleared) or was
+issued by another process the response is {"full_refresh": true} and the
+client should refetch /heatmap.
+
+Recency decay and hour changes are not writes: clients switching local_hour
+should refetch in full.
+"""
+
+import logging
+import math
+import threading
+from collections import Counter, deque
+from typing import Deque, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.ml import risk_kernel
+from app.ml.risk_kernel import SCORING_RADIUS_M
+from app.utils import metrics
+from app.utils.geospatial import degree_window
+
+logger = logging.getLogger(__name__)
+
+# Log entries tested against the view cells per vectorized batch
+_ENTRY_BATCH = 512
+
+# (version, event, lat, lng); lat/lng are NaN for events without a location
+_log: Deque[Tuple[int, str, float, float]] = deque()
+# Oldest version a client may still ask for (changes <= it are not in the log)
+_floor_version: Optional[int] = None
+_lock = threading.Lock()
+
+
+def _on_incident_change(event: str, incident: Dict) -> None:
+    """Storage change listener"""
+    global _floor_version
+    from app.db.storage import get_data_version
+
+    version = get_data_version()
+    with _lock:
+        if event == "cleared":
+            _log.clear()
+            _floor_version = version
+            return
+        try:
+            lat, lng = float(incident["latitude"]), float(incident["longitude"])
+        except (KeyError, TypeError, ValueError):
+            lat = lng = math.nan
+        max_entries = max(1, int(settings.heatmap_delta_log_size))
+        while len(_log) >= max_entries:
+            _floor_version = _log.popleft()[0]
+        _log.append((version, event, lat, lng))
+
+
+def start() -> None:
+    """Subscribe to incident writes; versions before now need a full refresh"""
+    global _floor_version
+    from app.db.storage import get_data_version, register_change_listener
+
+    with _lock:
+        if _floor_version is None:
+            _floor_version = get_data_version()
+    register_change_listener(_on_incident_change)
+
+
+def _full_refresh(version: int, since: str, reason: str) -> Dict:
+    from app.db.storage import get_version_token
+
+    metrics.inc("ml_heatmap_delta_total", result="full_refresh")
+    return {"version": get_version_token(version), "since": since, "full_refresh": True, "reason": reason}
+
+
+def get_delta(
+    since: str,
+    center_lat: float,
+    center_lng: float,
+    radius_meters: float,
+    grid_size_meters: float,
+    local_hour: int,
+) -> Dict:
+    """
+    Cells of a view changed by incident writes after version `since`
+
+    Args:
+        since: Version token of the client's current heatmap
+        center_lat, center_lng, radius_meters, grid_size_meters: View (same as /heatmap)
+        local_hour: LOCAL hour (0-23)
+
+    Returns:
+        Dictionary with version, full_refresh and either added / changed /
+        removed or a reason for the full refresh
+    """
+    from app.db.storage import get_data_version, get_version_token, parse_version_token
+    from app.ml import heatmap_pyramid
+    from app.ml.heatmap import MAX_HEATMAP_CELLS
+
+    current = get_data_version()
+    since_version = parse_version_token(since)
+    if since_version is None:
+        return _full_refresh(current, since, "other_process")
+    if _floor_version is None or since_version < _floor_version:
+        return _full_refresh(current, since, "log_truncated")
+    if since_version > current:
+        return _full_refresh(current, since, "unknown_version")
+    if not heatmap_pyramid.is_ready():
+        return _full_refresh(current, since, "pyramid_not_ready")
+
+    with metrics.timed("heatmap_delta.total") as stage:
+        # Apply pending writes so the delta is as fresh as possible
+        heatmap_pyramid.refresh_dirty()
+        result = heatmap_pyramid.query_cells_by_key(
+            center_lat, center_lng, radius_meters, grid_size_meters, local_hour, MAX_HEATMAP_CELLS
+        )
+        if result is None or result[1] is None:
+            return _full_refresh(current, since, "pyramid_not_ready")
+        level, version, cells = result
+
+        with _lock:
+            if since_version < _floor_version:
+                return _full_refresh(current, since, "log_truncated")
+            entries = [e for e in _log if since_version < e[0] <= version and not math.isnan(e[2])]
+
+        added, changed, removed = [], [], []
+        if entries and version > since_version:
+            dlat, dlng = heatmap_pyramid.level_cell_degrees(0)
+            lats = np.array([e[2] for e in entries])
+            lngs = np.array([e[3] for e in entries])
+
+            # Touched cells: the base cells within the scoring radius of each
+            # write (what the pyramid re-scores) and their ancestors at `level`
+            blat, blng = degree_window(SCORING_RADIUS_M, float(np.max(np.abs(lats))))
+            i0 = np.floor((lats - blat) / dlat).astype(np.int64) >> level
+            i1 = np.floor((lats + blat) / dlat).astype(np.int64) >> level
+            j0 = np.floor((lngs - blng) / dlng).astype(np.int64) >> level
+            j1 = np.floor((lngs + blng) / dlng).astype(np.int64) >> level
+
+            keys = list(cells)
+            touched = np.zeros(len(keys), dtype=bool)
+            if keys:
+                ki = np.array([k[0] for k in keys], dtype=np.int64)[:, None]
+                kj = np.array([k[1] for k in keys], dtype=np.int64)[:, None]
+                for s in range(0, len(entries), _ENTRY_BATCH):
+                    sl = slice(s, s + _ENTRY_BATCH)
+                    touched |= (
+                        (ki >= i0[sl]) & (ki <= i1[sl]) & (kj >= j0[sl]) & (kj <= j1[sl])
+                    ).any(axis=1)
+
+            # Cells holding the written incidents: new incidents per cell tell
+            # added from changed; a cell that is gone from the view is removed
+            own_i = np.floor(lats / dlat).astype(np.int64) >> level
+            own_j = np.floor(lngs / dlng).astype(np.int64) >> level
+            new_incidents = Counter(
+                (int(i), int(j)) for (i, j, e) in zip(own_i, own_j, entries) if e[1] == "added"
+            )
+            for key, hit in zip(keys, touched.tolist()):
+                if not hit:
+                    continue
+                cell = cells[key]
+                if cell["incident_count"] <= new_incidents.get(key, 0):
+                    added.append(cell)
+                else:
+                    changed.append(cell)
+
+            # Writes just outside the view can move a cell's centroid out of it:
+            # take every write whose cell square may overlap the view
+            reach = radius_meters + 2.0 * heatmap_pyramid.level_cell_meters(level)
+            near = risk_kernel.haversine_np(center_lat, center_lng, lats, lngs) <= reach
+            own_keys = {(int(i), int(j)) for i, j, hit in zip(own_i, own_j, near.tolist()) if hit}
+            removed = [heatmap_pyramid.cell_id(level, *key) for key in sorted(own_keys) if key not in cells]
+
+        stage.rows = len(entries)
+        stage.cells = len(added) + len(changed)
+
+    metrics.inc("ml_heatmap_delta_total", result="delta")
+    return {
+        "version": get_version_token(max(version, since_version)),
+        "since": since,
+        "full_refresh": False,
+        "level": level,
+        "added": added,
+        "changed": changed,
+        "removed": removed,
+    }
+
+
+def get_status() -> Dict:
+    from app.db.storage import get_data_version
+
+    version = get_data_version()
+    with _lock:
+        return {
+            "version": version,
+            "floor_version": _floor_version,
+            "log_entries": len(_log),
+            "max_log_entries": max(1, int(settings.heatmap_delta_log_size)),
+        }
@@ -0,0 +1,166 @@
+"""
+Heatmap Encoding - compact binary heatmap payloads
+
+Opt-in alternatives to the JSON heatmap, chosen by the Accept header of
+GET /ml/heatmap and built directly from heatmap_columns() arrays:
+
+application/x-heatmap-columns (packed, little-endian)
+    header (36 bytes):
+        magic       4s   b"HMAP"
+        version     u8   1
+        local_hour  u8
+        reserved    2 bytes
+        n_cells     u32
+        center_lat  f64
+        center_lng  f64
+        radius      f32  meters
+        grid_size   f32  meters
+    columns, each n_cells long, in this order:
+        lat             f32
+        lng             f32
+        risk_score      f32
+        incident_count  u32
+        last_incident   u32  epoch seconds, 0 = unknown
+        risk_level      u8   index into RISK_LEVELS
+
+application/x-msgpack
+    one map with the header fields plus "risk_levels" and one array per
+    column (floats packed as float32). Needs the optional msgpack package.
+
+Clusters are not part of either encoding (use the JSON response).
+"""
+
+import struct
+from typing import Dict, Optional
+
+import numpy as np
+
+from app.ml import risk_kernel
+
+PACKED_MEDIA_TYPE = "application/x-heatmap-columns"
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+MAGIC = b"HMAP"
+VERSION = 1
+HEADER = struct.Struct("<4sBB2xIddff")
+
+# (column, little-endian dtype) in payload order
+PACKED_COLUMNS = (
+    ("lat", "<f4"),
+    ("lng", "<f4"),
+    ("risk_score", "<f4"),
+    ("incident_count", "<u4"),
+    ("last_incident", "<u4"),
+    ("risk_level", "u1"),
+)
+
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """Binary media type requested by an Accept header (None = JSON)"""
+    if not accept:
+        return None
+    for part in accept.split(","):
+        media_type = part.split(";")[0].strip().lower()
+        if media_type in (PACKED_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, "application/msgpack"):
+            return MSGPACK_MEDIA_TYPE if media_type == "application/msgpack" else media_type
+    return None
+
+
+def _epoch_u32(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(np.isfinite(values), np.clip(values, 0, 2 ** 32 - 1), 0).astype("<u4")
+
+
+def encode_packed(heatmap: Dict) -> bytes:
+    """
+    Packed columnar encoding of a heatmap_columns() result
+
+    Returns:
+        Header followed by the raw column buffers
+    """
+    columns = heatmap["columns"]
+    n = len(columns["lat"])
+    parts = [HEADER.pack(
+        MAGIC,
+        VERSION,
+        int(heatmap["local_hour"]) % 24,
+        n,
+        float(heatmap["center"]["lat"]),
+        float(heatmap["center"]["lng"]),
+        float(heatmap["radius"]),
+        float(heatmap["grid_size"]),
+    )]
+    for name, dtype in PACKED_COLUMNS:
+        if name == "last_incident":
+            parts.append(_epoch_u32(columns[name]).tobytes())
+        else:
+            parts.append(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+    return b"".join(parts)
+
+
+def decode_packed(payload: bytes) -> Dict:
+    """
+    Inverse of encode_packed (for tests and Python clients)
+
+    Raises:
+        ValueError: Bad magic, unknown version or truncated payload
+    """
+    if len(payload) < HEADER.size:
+        raise ValueError("Truncated heatmap payload")
+    magic, version, local_hour, n, center_lat, center_lng, radius, grid_size = HEADER.unpack_from(payload)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Unsupported heatmap payload (magic={magic!r}, version={version})")
+
+    columns: Dict[str, np.ndarray] = {}
+    offset = HEADER.size
+    for name, dtype in PACKED_COLUMNS:
+        size = np.dtype(dtype).itemsize * n
+        if offset + size > len(payload):
+            raise ValueError("Truncated heatmap payload")
+        columns[name] = np.frombuffer(payload, dtype=dtype, count=n, offset=offset)
+        offset += size
+    return {
+        "center": {"lat": center_lat, "lng": center_lng},
+        "radius": radius,
+        "grid_size": grid_size,
+        "local_hour": local_hour,
+        "columns": columns,
+    }
+
+
+def encode_msgpack(heatmap: Dict) -> bytes:
+    """
+    MessagePack encoding of a heatmap_columns() result
+
+    Raises:
+        ImportError: msgpack is not installed
+    """
+    import msgpack
+
+    columns = heatmap["columns"]
+    return msgpack.packb(
+        {
+            "version": VERSION,
+            "center": heatmap["center"],
+            "radius": heatmap["radius"],
+            "grid_size": heatmap["grid_size"],
+            "local_hour": heatmap["local_hour"],
+            "risk_levels": list(risk_kernel.RISK_LEVELS),
+            "lat": columns["lat"].astype(np.float32).tolist(),
+            "lng": columns["lng"].astype(np.float32).tolist(),
+            "risk_score": columns["risk_score"].astype(np.float32).tolist(),
+            "risk_level": columns["risk_level"].tolist(),
+            "incident_count": columns["incident_count"].tolist(),
+            "last_incident": _epoch_u32(columns["last_incident"]).tolist(),
+        },
+        use_single_float=True,
+    )
+
+
+def encode(heatmap: Dict, media_type: str) -> bytes:
+    """Encode a heatmap_columns() result as media_type (see negotiate)"""
+    if media_type == PACKED_MEDIA_TYPE:
+        return encode_packed(heatmap)
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return encode_msgpack(heatmap)
+    raise ValueError(f"Unsupported heatmap media type: {media_type}")
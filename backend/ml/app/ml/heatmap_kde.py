@@ -0,0 +1,243 @@
+"""
+Heatmap KDE - full-grid heatmap via FFT convolution
+
+The risk model's spatial terms are fixed kernels applied to weighted
+incident points: exp(-d / 111m) truncated at 1km for the weighted sums and
+a 1km disk for the counts. On a regular metric grid those are
+convolutions, so instead of scoring cells one neighborhood at a time this
+mode:
+
+1. rasterizes the per-incident weights (count, time x recency weight,
+   time weight, severity x time x recency weight, per-window counts) onto
+   a local equirectangular grid covering the view plus the 1km buffer,
+2. convolves each raster with the kernels via scipy.signal.fftconvolve,
+3. samples the convolved sums at the output cell centers and combines
+   them with risk_kernel.combine_factors.
+
+Every cell in the viewport gets a score (not just incident-bearing ones)
+in O(N log N) in the raster size. Incidents are snapped to raster cells
+(heatmap_kde_raster_meters), so scores are approximate near incidents.
+"""
+
+import logging
+import math
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.config import settings
+from app.ml import risk_kernel
+from app.ml.risk_kernel import SCORING_RADIUS_M
+from app.utils import metrics
+from app.utils.geospatial import METERS_PER_DEG_LAT, degree_window, meters_to_lng_degrees
+
+logger = logging.getLogger(__name__)
+
+
+def _kernels(step: float, half: int):
+    """(exp(-d/111m) truncated at 1km, 1km disk) sampled on the raster"""
+    offsets = np.arange(-half, half + 1) * step
+    d = np.hypot(offsets[:, None], offsets[None, :])
+    inside = d <= SCORING_RADIUS_M
+    return np.where(inside, np.exp(-d / risk_kernel.DISTANCE_SCALE_M), 0.0), inside.astype(np.float64)
+
+
+def _cell_timestamps(
+    rows: List[Dict], center_lat: float, center_lng: float, lng_per_m: float, n_out: int, out_cell: float
+) -> Dict[int, List[Any]]:
+    """Raw incident timestamps per output cell (flat index), as heatmap.cell_dict bins them"""
+    half = n_out * out_cell / 2.0
+    bins: Dict[int, List[Any]] = {}
+    for row in rows:
+        try:
+            ox = int(math.floor(((float(row["longitude"]) - center_lng) / lng_per_m + half) / out_cell))
+            oy = int(math.floor(((float(row["latitude"]) - center_lat) * METERS_PER_DEG_LAT + half) / out_cell))
+        except Exception:
+            continue
+        if 0 <= ox < n_out and 0 <= oy < n_out:
+            bins.setdefault(oy * n_out + ox, []).append(row.get("timestamp"))
+    return bins
+
+
+def generate_kde_heatmap(
+    center_lat: float,
+    center_lng: float,
+    radius_meters: int,
+    grid_size_meters: int,
+    query_timestamp: Optional[datetime] = None,
+    local_hour: Optional[int] = None,
+    include_clusters: bool = False,
+) -> Dict:
+    """
+    Full-grid heatmap for an area (KDE / FFT convolution mode)
+
+    Args:
+        center_lat: Center latitude
+        center_lng: Center longitude
+        radius_meters: Radius in meters (cells with center inside are returned)
+        grid_size_meters: Requested cell size; coarsened so the view stays
+            within heatmap_kde_max_cells
+        query_timestamp: Recency reference (default: now)
+        local_hour: LOCAL hour (0-23)
+        include_clusters: Include unsafe-zone clusters (as generate_heatmap)
+
+    Returns:
+        Dictionary with heatmap data (same shape as generate_heatmap, plus
+        mode="kde"; grid_size is the effective cell size)
+    """
+    from scipy.signal import fftconvolve
+    from app.db.storage import get_incident_columns, get_incidents
+    from app.ml.clustering import get_clusters_in_radius
+    from app.ml.risk_scoring import _query_now
+    from app.utils.land_mask import is_point_allowed
+
+    started = time.perf_counter()
+    now = _query_now(query_timestamp)
+    hour = int(local_hour if local_hour is not None else now.hour) % 24
+    p = risk_kernel.scoring_params()
+
+    # Output grid: square of side 2r, coarsened to the cell cap. The raster
+    # step divides the output cell an odd number of times so every output
+    # center is a raster cell center.
+    radius = float(radius_meters)
+    max_cells = max(1, int(settings.heatmap_kde_max_cells))
+    out_cell = max(float(grid_size_meters), 2.0 * radius / math.sqrt(max_cells))
+    n_out = max(1, int(math.ceil(2.0 * radius / out_cell)))
+    max_side = max(64, int(settings.heatmap_kde_max_raster))
+    k = max(1, int(math.ceil(out_cell / max(1.0, float(settings.heatmap_kde_raster_meters)))))
+    while k > 1 and n_out * k + 2 * int(math.ceil(SCORING_RADIUS_M * k / out_cell)) > max_side:
+        k -= 1
+    if k % 2 == 0:
+        k -= 1
+    step = out_cell / k
+    pad = int(math.ceil(SCORING_RADIUS_M / step))
+    side = n_out * k + 2 * pad
+    origin = -n_out * out_cell / 2.0 - pad * step  # projected meters relative to the center
+
+    # Incidents in the raster extent
+    lng_per_m = meters_to_lng_degrees(1.0, center_lat)
+    dlat, dlng = degree_window(-origin, center_lat)
+    with metrics.timed("heatmap_kde.fetch") as stage:
+        cols = get_incident_columns(center_lat - dlat, center_lat + dlat, center_lng - dlng, center_lng + dlng)
+        # Rows of the output square only: incident_count and last_incident
+        # come from the raw incidents, as on the incident-cell path
+        vlat, vlng = degree_window(n_out * out_cell / 2.0, center_lat)
+        view_rows = get_incidents(center_lat - vlat, center_lat + vlat, center_lng - vlng, center_lng + vlng)
+        stage.rows = int(cols["lat"].shape[0])
+
+    with metrics.timed("heatmap_kde.rasterize") as stage:
+        x = (cols["lng"] - center_lng) / lng_per_m
+        y = (cols["lat"] - center_lat) * METERS_PER_DEG_LAT
+        ix = np.floor((x - origin) / step).astype(np.int64)
+        iy = np.floor((y - origin) / step).astype(np.int64)
+        ok = (ix >= 0) & (ix < side) & (iy >= 0) & (iy < side)
+        ix, iy = ix[ok], iy[ok]
+        flat = iy * side + ix
+
+        ts = cols["ts"][ok]
+        valid = ~np.isnan(ts)
+        inc_hour = cols["hour"][ok].astype(np.int64)
+        days_ago = (now.timestamp() - np.where(valid, ts, now.timestamp())) / 86400.0
+        recency_w = np.where(valid, np.exp(-days_ago / p["decay_days"]), 0.0)
+        sim = risk_kernel.hour_similarity_matrix(p)
+        time_w = np.where(valid, sim[hour, np.where(inc_hour >= 0, inc_hour, hour)], 0.0)
+        window = risk_kernel.HOUR_TO_WINDOW[np.where(inc_hour >= 0, inc_hour, 5)].astype(np.int64)
+
+        def _raster(weights) -> np.ndarray:
+            return np.bincount(flat, weights=weights, minlength=side * side).reshape(side, side)
+
+        disk_layers = [np.ones(flat.shape[0]), recency_w * time_w] + [
+            (window == w).astype(np.float64) for w in range(len(risk_kernel.PATTERN_WINDOWS))
+        ]
+        exp_layers = [time_w * recency_w, time_w, cols["severity"][ok] * time_w * recency_w]
+        stage.rows = int(flat.shape[0])
+
+    with metrics.timed("heatmap_kde.convolve") as stage:
+        exp_kernel, disk_kernel = _kernels(step, pad)
+        # Sample the convolved rasters at the output cell centers only
+        centers = pad + np.arange(n_out) * k + k // 2
+        sample = np.ix_(centers, centers)
+        disk = [fftconvolve(_raster(w), disk_kernel, mode="same")[sample] for w in disk_layers]
+        expo = [fftconvolve(_raster(w), exp_kernel, mode="same")[sample] for w in exp_layers]
+        stage.cells = side * side
+
+    # FFT round-off: counts are integers, sums are non-negative
+    raw_count = np.rint(disk[0]).astype(np.int64).reshape(-1)
+    effective = np.maximum(disk[1], 0.0).reshape(-1)
+    pattern = np.rint(np.stack([d.reshape(-1) for d in disk[2:]], axis=1)).astype(np.int64)
+    rec_numer = np.maximum(expo[0], 0.0).reshape(-1)
+    rec_denom = np.maximum(expo[1], 0.0).reshape(-1)
+    w_sev = np.maximum(expo[2], 0.0).reshape(-1)
+    scores = risk_kernel.combine_factors(
+        query_hour=np.full(raw_count.shape[0], hour, dtype=np.int64),
+        raw_count=raw_count,
+        effective=effective,
+        weighted_severity=w_sev,
+        recency_numer=rec_numer,
+        recency_denom=rec_denom,
+        total_weight=rec_numer,
+        pattern=pattern,
+        params=p,
+    )
+
+    # Output cell centers, incidents per output cell and latest incident
+    offsets = (np.arange(n_out) + 0.5) * out_cell - n_out * out_cell / 2.0
+    cell_lat = np.repeat(center_lat + offsets / METERS_PER_DEG_LAT, n_out)
+    cell_lng = np.tile(center_lng + offsets * lng_per_m, n_out)
+    cell_timestamps = _cell_timestamps(view_rows, center_lat, center_lng, lng_per_m, n_out, out_cell)
+
+    inside = risk_kernel.haversine_np(center_lat, center_lng, cell_lat, cell_lng) <= radius
+    risk = np.round(scores["risk_score"], 2)
+    levels = risk_kernel.risk_level_codes(scores["risk_score"], raw_count)
+    cells = []
+    for idx in np.flatnonzero(inside).tolist():
+        lat_c, lng_c = float(cell_lat[idx]), float(cell_lng[idx])
+        if not is_point_allowed(lat_c, lng_c):
+            continue
+        ts_list = cell_timestamps.get(idx, [])
+        # timestamps may be datetime or strings; kept as-is (see heatmap.cell_dict)
+        try:
+            last_incident = max(ts_list) if ts_list else None
+        except Exception:
+            last_incident = None
+        cells.append({
+            "lat": lat_c,
+            "lng": lng_c,
+            "risk_score": float(risk[idx]),
+            "risk_level": risk_kernel.RISK_LEVELS[levels[idx]],
+            "incident_count": len(ts_list),
+            "last_incident": last_incident,
+        })
+
+    clusters = []
+    if include_clusters:
+        try:
+            with metrics.timed("heatmap_kde.clusters"):
+                for cluster in get_clusters_in_radius(center_lat, center_lng, radius_meters):
+                    clusters.append({
+                        "id": cluster["id"],
+                        "center": cluster["center"],
+                        "radius": cluster["radius"],
+                        "risk_score": cluster["risk_score"],
+                        "incident_count": cluster["incident_count"],
+                    })
+        except Exception as e:
+            logger.error(f"Error getting clusters: {e}", exc_info=True)
+            clusters = []
+
+    elapsed = time.perf_counter() - started
+    metrics.observe_stage("heatmap_kde.total", elapsed, rows=int(flat.shape[0]), cells=len(cells))
+    logger.info(
+        f"KDE heatmap: {len(cells)} cells of {out_cell:.0f}m from {flat.shape[0]} incidents "
+        f"({side}x{side} raster at {step:.0f}m) in {elapsed:.2f}s"
+    )
+    return {
+        "center": {"lat": center_lat, "lng": center_lng},
+        "radius": radius_meters,
+        "grid_size": out_cell,
+        "mode": "kde",
+        "cells": cells,
+        "clusters": clusters,
+    }
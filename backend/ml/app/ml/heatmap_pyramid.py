@@ -0,0 +1,538 @@
+"""
+Heatmap Pyramid - precomputed multi-resolution heatmap cells
+
+Level 0 holds every non-empty base cell (heatmap_pyramid_base_cell_meters,
+default 50m) with its incident centroid, count, last incident time and the
+risk score at the centroid for all 24 LOCAL hours. Each coarser level doubles
+the cell size (100m, 200m, 400m, ...) and rolls up its four children:
+incident-weighted centroid and mean score, summed counts, latest incident.
+
+- Built by a background worker (full rebuild every
+  heatmap_pyramid_refresh_seconds keeps recency decay current).
+- Incident writes mark the base cells within the scoring radius dirty; the
+  worker re-scores just those and recomputes their ancestors.
+- /ml/heatmap picks the finest level that fits the requested radius and
+  grid size and answers from memory (query_cells).
+
+Grid cells use the global grid (app.utils.grid), so cell IDs are stable
+across rebuilds and match the on-demand heatmap path.
+"""
+
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.ml import risk_kernel
+from app.ml.risk_kernel import SCORING_RADIUS_M
+from app.utils import grid, metrics
+from app.utils.geospatial import degree_window
+
+logger = logging.getLogger(__name__)
+
+# Base cells scored per vectorized batch (bounds pair-array memory)
+_SCORE_BATCH = 2000
+
+# Cell record: [sum_lat, sum_lng, n, last_ts, score_sum (24,)]
+# score_sum is the incident-weighted sum of child scores (score = score_sum / n)
+_levels: Optional[List[Dict[Tuple[int, int], list]]] = None
+_built_at: Optional[datetime] = None
+_dirty_points: List[Tuple[float, float]] = []
+_full_rebuild_requested = False
+# Incident-store version (storage.get_data_version) the levels fully reflect
+_applied_version: Optional[int] = None
+_lock = threading.RLock()
+# Serializes builds and dirty refreshes (the worker and delta queries both refresh)
+_refresh_lock = threading.Lock()
+_wake = threading.Event()
+_stop = threading.Event()
+_worker: Optional[threading.Thread] = None
+
+
+# ==================== Grid ====================
+# Cells live on the global heatmap grid (app.utils.grid), shared with the
+# on-demand heatmap path, so a cell ID means the same square everywhere.
+
+level_cell_degrees = grid.level_cell_degrees
+level_cell_meters = grid.level_cell_meters
+cell_id = grid.cell_id
+
+
+def _base_cell_degrees() -> Tuple[float, float]:
+    return grid.level_cell_degrees(0)
+
+
+def _num_levels() -> int:
+    return grid.num_levels()
+
+
+# ==================== Building ====================
+
+def _build_base(columns: Dict[str, np.ndarray], keep, context: Dict[str, np.ndarray], now_ts: float) -> Dict:
+    """
+    Base cells for the incidents selected by keep, scored against context
+
+    Returns:
+        {(i, j): record}
+    """
+    from app.utils.land_mask import is_point_allowed
+
+    dlat, dlng = _base_cell_degrees()
+    lat = columns["lat"][keep]
+    lng = columns["lng"][keep]
+    if lat.size == 0:
+        return {}
+    ts = np.nan_to_num(columns["ts"][keep], nan=-np.inf)
+    keys = np.column_stack((np.floor(lat / dlat), np.floor(lng / dlng))).astype(np.int64)
+    uniq, inv = np.unique(keys, axis=0, return_inverse=True)
+    inv = inv.reshape(-1)
+    n = np.bincount(inv).astype(np.float64)
+    sum_lat = np.bincount(inv, weights=lat)
+    sum_lng = np.bincount(inv, weights=lng)
+    last_ts = np.full(uniq.shape[0], -np.inf)
+    np.maximum.at(last_ts, inv, ts)
+
+    c_lat = sum_lat / n
+    c_lng = sum_lng / n
+    allowed = np.array([is_point_allowed(float(a), float(b)) for a, b in zip(c_lat, c_lng)], dtype=bool)
+
+    scores = np.zeros((uniq.shape[0], 24), dtype=np.float32)
+    idx = np.flatnonzero(allowed)
+    for start in range(0, idx.size, _SCORE_BATCH):
+        batch = idx[start:start + _SCORE_BATCH]
+        out = risk_kernel.score_points_all_hours(
+            c_lat[batch], c_lng[batch], context, now_ts=now_ts, radius_meters=SCORING_RADIUS_M
+        )
+        scores[batch] = out["risk_score"]
+
+    cells = {}
+    for k in idx.tolist():
+        cells[(int(uniq[k, 0]), int(uniq[k, 1]))] = [
+            float(sum_lat[k]), float(sum_lng[k]), int(n[k]), float(last_ts[k]), scores[k] * float(n[k]),
+        ]
+    return cells
+
+
+def _rollup(children: Dict[Tuple[int, int], list], key: Tuple[int, int]) -> Optional[list]:
+    """Parent record from its (up to four) children"""
+    i, j = key
+    parts = [children.get((2 * i + a, 2 * j + b)) for a in (0, 1) for b in (0, 1)]
+    parts = [p for p in parts if p is not None]
+    if not parts:
+        return None
+    return [
+        sum(p[0] for p in parts),
+        sum(p[1] for p in parts),
+        sum(p[2] for p in parts),
+        max(p[3] for p in parts),
+        np.sum([p[4] for p in parts], axis=0),
+    ]
+
+
+def build_pyramid() -> Dict:
+    """
+    Build every level from scratch and swap it in
+
+    Returns:
+        Pyramid summary (see get_status)
+    """
+    global _levels, _built_at, _applied_version
+    from app.db.storage import get_data_version, get_incident_columns
+
+    with _refresh_lock:
+        started = time.perf_counter()
+        now = datetime.now(timezone.utc)
+        version = get_data_version()
+        with _lock:
+            _dirty_points.clear()
+        columns = get_incident_columns()
+        keep = np.ones(columns["lat"].shape[0], dtype=bool)
+        levels = [_build_base(columns, keep, columns, now.timestamp())]
+        for _ in range(1, _num_levels()):
+            below = levels[-1]
+            parents = {(i >> 1, j >> 1) for i, j in below}
+            levels.append({key: _rollup(below, key) for key in parents})
+
+        with _lock:
+            _levels = levels
+            _built_at = now
+            _applied_version = version
+    elapsed = time.perf_counter() - started
+    metrics.observe_stage("heatmap_pyramid.build", elapsed, rows=int(columns["lat"].shape[0]), cells=len(levels[0]))
+    logger.info(
+        f"Heatmap pyramid built: {len(levels[0])} base cells, {len(levels)} levels "
+        f"from {columns['lat'].shape[0]} incidents in {elapsed:.1f}s"
+    )
+    return get_status()
+
+
+def _refresh_region(lat: float, lng: float, now_ts: float) -> int:
+    """Re-score base cells within the scoring radius of (lat, lng) and their ancestors"""
+    from app.db.storage import get_incident_columns
+
+    dlat, dlng = _base_cell_degrees()
+    blat, blng = degree_window(SCORING_RADIUS_M, lat)
+    i0, i1 = int(math.floor((lat - blat) / dlat)), int(math.floor((lat + blat) / dlat))
+    j0, j1 = int(math.floor((lng - blng) / dlng)), int(math.floor((lng + blng) / dlng))
+
+    # Incidents in the region (cell membership) plus a scoring buffer around it
+    context = get_incident_columns(
+        i0 * dlat - blat, (i1 + 1) * dlat + blat, j0 * dlng - blng, (j1 + 1) * dlng + blng
+    )
+    ci = np.floor(context["lat"] / dlat)
+    cj = np.floor(context["lng"] / dlng)
+    keep = (ci >= i0) & (ci <= i1) & (cj >= j0) & (cj <= j1)
+    base = _build_base(context, keep, context, now_ts)
+
+    with _lock:
+        levels = _levels
+        if levels is None:
+            return 0
+        level0 = levels[0]
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                level0.pop((i, j), None)
+        level0.update(base)
+        for k in range(1, len(levels)):
+            below, level = levels[k - 1], levels[k]
+            for i in range(i0 >> k, (i1 >> k) + 1):
+                for j in range(j0 >> k, (j1 >> k) + 1):
+                    record = _rollup(below, (i, j))
+                    if record is None:
+                        level.pop((i, j), None)
+                    else:
+                        level[(i, j)] = record
+    return len(base)
+
+
+def refresh_dirty() -> int:
+    """
+    Refresh the branches touched by incident writes since the last refresh
+
+    Returns:
+        Number of dirty points processed
+    """
+    global _applied_version
+    from app.db.storage import get_data_version
+
+    with _refresh_lock:
+        # Every write up to this version has queued its dirty point
+        version = get_data_version()
+        if _levels is None or _full_rebuild_requested:
+            return 0
+        with _lock:
+            points = list(_dirty_points)
+            _dirty_points.clear()
+        if not points:
+            _applied_version = version
+            return 0
+        started = time.perf_counter()
+        now_ts = datetime.now(timezone.utc).timestamp()
+        # Points closer than a base cell share one refresh
+        dlat, dlng = _base_cell_degrees()
+        unique = {(math.floor(p[0] / dlat), math.floor(p[1] / dlng)): p for p in points}
+        cells = 0
+        for lat, lng in unique.values():
+            cells += _refresh_region(lat, lng, now_ts)
+        with _lock:
+            _applied_version = version
+        metrics.observe_stage("heatmap_pyramid.refresh", time.perf_counter() - started, cells=cells)
+        return len(unique)
+
+
+def _on_incident_change(event: str, incident: Dict) -> None:
+    """Storage change listener"""
+    global _full_rebuild_requested
+    if event == "cleared":
+        _full_rebuild_requested = True
+    else:
+        try:
+            point = (float(incident["latitude"]), float(incident["longitude"]))
+        except (KeyError, TypeError, ValueError):
+            return
+        with _lock:
+            _dirty_points.append(point)
+    _wake.set()
+
+
+# ==================== Queries ====================
+
+def is_ready() -> bool:
+    return _levels is not None and bool(settings.heatmap_pyramid_enabled)
+
+
+def is_current(query_timestamp: Optional[datetime]) -> bool:
+    """True when query_timestamp is close enough to now for precomputed scores"""
+    if query_timestamp is None:
+        return True
+    if query_timestamp.tzinfo is None:
+        query_timestamp = query_timestamp.replace(tzinfo=timezone.utc)
+    age = abs((datetime.now(timezone.utc) - query_timestamp).total_seconds())
+    return age <= max(60, int(settings.heatmap_pyramid_refresh_seconds))
+
+
+def choose_level(radius_meters: float, grid_size_meters: float, max_cells: int) -> int:
+    """Finest level with cells >= grid_size_meters and at most ~max_cells in the view"""
+    return grid.view_level(radius_meters, grid_size_meters, max_cells)
+
+
+def _record_cell(record: list, hour: int) -> Dict:
+    n = record[2]
+    score = float(record[4][hour]) / n
+    return {
+        "lat": record[0] / n,
+        "lng": record[1] / n,
+        "risk_score": round(score, 2),
+        "risk_level": risk_kernel.risk_level_for_score(score, n),
+        "incident_count": n,
+        "last_incident": (
+            datetime.fromtimestamp(record[3], timezone.utc) if math.isfinite(record[3]) else None
+        ),
+    }
+
+
+def _view_records(
+    levels: List[Dict],
+    center_lat: float,
+    center_lng: float,
+    radius_meters: float,
+    grid_size_meters: float,
+    max_cells: int,
+) -> Tuple[int, List[Tuple[Tuple[int, int], list]]]:
+    """Level and (key, record) of the cells whose grid square overlaps the view bbox (call under _lock)"""
+    level = choose_level(radius_meters, grid_size_meters, max_cells)
+    cells_at = levels[level]
+
+    dlat, dlng = _base_cell_degrees()
+    dlat *= 2 ** level
+    dlng *= 2 ** level
+    blat, blng = degree_window(radius_meters, center_lat)
+    i0, i1 = int(math.floor((center_lat - blat) / dlat)), int(math.floor((center_lat + blat) / dlat))
+    j0, j1 = int(math.floor((center_lng - blng) / dlng)), int(math.floor((center_lng + blng) / dlng))
+
+    if (i1 - i0 + 1) * (j1 - j0 + 1) <= len(cells_at):
+        records = [
+            ((i, j), cells_at[(i, j)])
+            for i in range(i0, i1 + 1) for j in range(j0, j1 + 1) if (i, j) in cells_at
+        ]
+    else:
+        records = [((i, j), r) for (i, j), r in cells_at.items() if i0 <= i <= i1 and j0 <= j <= j1]
+    return level, records
+
+
+def query_cells(
+    center_lat: float,
+    center_lng: float,
+    radius_meters: float,
+    grid_size_meters: float,
+    local_hour: int,
+    max_cells: int,
+) -> Optional[Tuple[int, List[Dict]]]:
+    """
+    Heatmap cells for a circular view from the pyramid
+
+    Args:
+        center_lat, center_lng: View center
+        radius_meters: View radius (cells with centroid inside are returned)
+        grid_size_meters: Requested cell size (lower bound for the level)
+        local_hour: LOCAL hour (0-23)
+        max_cells: Target upper bound on cells in the view
+
+    Returns:
+        (level, cells) or None when the pyramid is not built
+    """
+    result = query_cells_by_key(center_lat, center_lng, radius_meters, grid_size_meters, local_hour, max_cells)
+    if result is None:
+        return None
+    level, _, cells = result
+    return level, list(cells.values())
+
+
+def query_cells_all_hours(
+    center_lat: float,
+    center_lng: float,
+    radius_meters: float,
+    grid_size_meters: float,
+    max_cells: int,
+) -> Optional[Tuple[int, List[Dict]]]:
+    """
+    query_cells for all 24 LOCAL hours at once
+
+    Returns:
+        (level, cells) with risk_scores / risk_levels lists indexed by hour,
+        or None when the pyramid is not built
+    """
+    with _lock:
+        levels = _levels
+        if levels is None:
+            return None
+        level, records = _view_records(levels, center_lat, center_lng, radius_meters, grid_size_meters, max_cells)
+        cells = []
+        for key, r in records:
+            n = r[2]
+            scores = np.asarray(r[4], dtype=np.float64) / n
+            cells.append({
+                "id": cell_id(level, *key),
+                "lat": r[0] / n,
+                "lng": r[1] / n,
+                "risk_scores": np.round(scores, 2).tolist(),
+                "risk_levels": [risk_kernel.RISK_LEVELS[c] for c in risk_kernel.risk_level_codes(scores, np.full(24, n))],
+                "incident_count": n,
+                "last_incident": datetime.fromtimestamp(r[3], timezone.utc) if math.isfinite(r[3]) else None,
+            })
+
+    if cells:
+        d = risk_kernel.haversine_np(
+            center_lat, center_lng,
+            np.array([c["lat"] for c in cells]), np.array([c["lng"] for c in cells]),
+        )
+        cells = [c for c, inside in zip(cells, (d <= radius_meters).tolist()) if inside]
+    return level, cells
+
+
+def query_columns(
+    center_lat: float,
+    center_lng: float,
+    radius_meters: float,
+    grid_size_meters: float,
+    local_hour: int,
+    max_cells: int,
+) -> Optional[Tuple[int, Dict[str, np.ndarray]]]:
+    """
+    Same cells as query_cells as parallel arrays (no per-cell dicts)
+
+    Returns:
+        (level, columns) or None when the pyramid is not built; columns are
+        lat, lng, risk_score, risk_level (RISK_LEVELS index), incident_count
+        and last_incident (epoch seconds, NaN when unknown)
+    """
+    with _lock:
+        levels = _levels
+        if levels is None:
+            return None
+        level, records = _view_records(levels, center_lat, center_lng, radius_meters, grid_size_meters, max_cells)
+        hour = int(local_hour) % 24
+        n = np.fromiter((r[2] for _, r in records), dtype=np.float64, count=len(records))
+        lat = np.fromiter((r[0] for _, r in records), dtype=np.float64, count=len(records))
+        lng = np.fromiter((r[1] for _, r in records), dtype=np.float64, count=len(records))
+        score_sum = np.fromiter((r[4][hour] for _, r in records), dtype=np.float64, count=len(records))
+        last = np.fromiter((r[3] for _, r in records), dtype=np.float64, count=len(records))
+
+    lat /= n
+    lng /= n
+    score = score_sum / n
+    inside = risk_kernel.haversine_np(center_lat, center_lng, lat, lng) <= radius_meters
+    counts = n[inside].astype(np.int64)
+    score = score[inside]
+    last = last[inside]
+    return level, {
+        "lat": lat[inside],
+        "lng": lng[inside],
+        "risk_score": np.round(score, 2),
+        "risk_level": risk_kernel.risk_level_codes(score, counts),
+        "incident_count": counts,
+        "last_incident": np.where(np.isfinite(last), last, np.nan),
+    }
+
+
+def query_cells_by_key(
+    center_lat: float,
+    center_lng: float,
+    radius_meters: float,
+    grid_size_meters: float,
+    local_hour: int,
+    max_cells: int,
+) -> Optional[Tuple[int, int, Dict[Tuple[int, int], Dict]]]:
+    """
+    query_cells keyed by grid index, with the data version the cells reflect
+
+    Returns:
+        (level, applied version, {(i, j): cell}) or None when the pyramid is not built
+    """
+    with _lock:
+        levels = _levels
+        if levels is None:
+            return None
+        version = _applied_version
+        level, records = _view_records(levels, center_lat, center_lng, radius_meters, grid_size_meters, max_cells)
+        hour = int(local_hour) % 24
+        cells = {key: {"id": cell_id(level, *key), **_record_cell(r, hour)} for key, r in records}
+
+    if cells:
+        keys = list(cells)
+        d = risk_kernel.haversine_np(
+            center_lat, center_lng,
+            np.array([cells[k]["lat"] for k in keys]), np.array([cells[k]["lng"] for k in keys]),
+        )
+        cells = {k: cells[k] for k, inside in zip(keys, (d <= radius_meters).tolist()) if inside}
+    return level, version, cells
+
+
+def applied_version() -> Optional[int]:
+    """Incident-store version the pyramid reflects (None before the first build)"""
+    return _applied_version
+
+
+def get_status() -> Dict:
+    with _lock:
+        levels = _levels
+        return {
+            "ready": levels is not None,
+            "built_at": _built_at.isoformat() if _built_at else None,
+            "levels": [
+                {"cell_meters": level_cell_meters(k), "cells": len(levels[k])} for k in range(len(levels))
+            ] if levels is not None else [],
+            "dirty_points": len(_dirty_points),
+            "applied_version": _applied_version,
+        }
+
+
+# ==================== Background worker ====================
+
+def _run_worker() -> None:
+    global _full_rebuild_requested
+    refresh_s = max(60, int(settings.heatmap_pyramid_refresh_seconds))
+    while not _stop.is_set():
+        try:
+            stale = _built_at is None or (
+                (datetime.now(timezone.utc) - _built_at).total_seconds() >= refresh_s
+            )
+            if stale or _full_rebuild_requested:
+                _full_rebuild_requested = False
+                build_pyramid()
+            else:
+                refresh_dirty()
+            age_s = (datetime.now(timezone.utc) - _built_at).total_seconds()
+            wait_s = max(1.0, refresh_s - age_s)
+        except Exception as e:
+            logger.error(f"Heatmap pyramid build failed: {e}", exc_info=True)
+            wait_s = 60
+        _wake.wait(timeout=wait_s)
+        _wake.clear()
+
+
+def start_background_builder() -> None:
+    """Start the pyramid worker thread (idempotent)"""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    from app.db.storage import register_change_listener
+    register_change_listener(_on_incident_change)
+    _stop.clear()
+    _worker = threading.Thread(target=_run_worker, name="heatmap-pyramid", daemon=True)
+    _worker.start()
+
+
+def stop_background_builder() -> None:
+    """Stop the pyramid worker thread"""
+    global _worker
+    _stop.set()
+    _wake.set()
+    if _worker is not None:
+        _worker.join(timeout=5)
+        _worker = None
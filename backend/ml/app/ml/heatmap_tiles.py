@@ -0,0 +1,231 @@
+"""
+Heatmap Tiles - web-mercator (slippy map) tiles with a per-tile cache
+
+GET /ml/heatmap/tiles/{z}/{x}/{y} returns the heatmap cells whose incidents
+fall inside one standard XYZ tile. Cells come from a fixed 2^k x 2^k grid
+aligned to the tile, so neighboring tiles never share a cell and panning
+reuses every tile that was already computed.
+
+Rendered tiles (JSON body + ETag) are cached per (z, x, y, local hour,
+cells per edge). Tiles below heatmap_tile_min_zoom are not served and cells
+per tile are capped at heatmap_tile_max_cells. An incident write evicts only the tiles whose scoring buffer
+(tile bounds + 1km) contains the incident; entries also expire after
+heatmap_tile_cache_ttl seconds so recency decay stays current.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from cachetools import TTLCache
+from fastapi.encoders import jsonable_encoder
+
+from app.config import settings
+from app.ml.risk_kernel import SCORING_RADIUS_M
+from app.utils import metrics
+from app.utils.geospatial import METERS_PER_DEG_LAT, degree_window
+
+logger = logging.getLogger(__name__)
+
+MAX_ZOOM = 22
+# Cells per tile edge are a power of two in [1, 2^MAX_CELL_LEVEL]
+MAX_CELL_LEVEL = 8
+
+_cache: Optional[TTLCache] = None
+# Bumped on every invalidation; a render that overlaps one is not cached
+_generation = 0
+_lock = threading.RLock()
+
+
+def _get_cache() -> TTLCache:
+    global _cache
+    if _cache is None:
+        _cache = TTLCache(
+            maxsize=max(1, int(settings.heatmap_tile_cache_max_entries)),
+            ttl=max(1, int(settings.heatmap_tile_cache_ttl)),
+        )
+    return _cache
+
+
+# ==================== Tile math ====================
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """(lat_min, lat_max, lng_min, lng_max) of an XYZ tile"""
+    n = 2 ** z
+    lng_min = x / n * 360.0 - 180.0
+    lng_max = (x + 1) / n * 360.0 - 180.0
+    lat_max = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    lat_min = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return lat_min, lat_max, lng_min, lng_max
+
+
+def tile_xy(lat: float, lng: float, z: int) -> Tuple[float, float]:
+    """Fractional tile coordinates of a point at zoom z"""
+    n = 2 ** z
+    lat = max(-85.05112878, min(85.05112878, lat))
+    fx = (lng + 180.0) / 360.0 * n
+    lat_r = math.radians(lat)
+    fy = (1.0 - math.asinh(math.tan(lat_r)) / math.pi) / 2.0 * n
+    return fx, fy
+
+
+def cells_per_edge(z: int, y: int, grid_size_meters: Optional[float] = None) -> int:
+    """Power-of-two cell count per tile edge giving cells of ~grid_size_meters"""
+    lat_min, lat_max, lng_min, lng_max = tile_bounds(z, 0, y)
+    mid_lat = math.radians((lat_min + lat_max) / 2.0)
+    tile_width_m = (lng_max - lng_min) * METERS_PER_DEG_LAT * math.cos(mid_lat)
+    grid = float(grid_size_meters or settings.default_grid_size)
+    level = int(round(math.log2(max(1.0, tile_width_m / max(1.0, grid)))))
+    max_level = int(math.log2(max(1, int(settings.heatmap_tile_max_cells)))) // 2
+    return 2 ** max(0, min(MAX_CELL_LEVEL, max_level, level))
+
+
+def _buffer_degrees(lat: float) -> Tuple[float, float]:
+    return degree_window(SCORING_RADIUS_M, lat)
+
+
+# ==================== Rendering ====================
+
+def _render_tile(z: int, x: int, y: int, local_hour: int, n_cells: int) -> Dict:
+    from app.db.storage import get_incidents
+    from app.ml.heatmap import cell_dict, collect_cells, score_cells
+
+    lat_min, lat_max, lng_min, lng_max = tile_bounds(z, x, y)
+    blat, blng = _buffer_degrees(max(abs(lat_min), abs(lat_max)))
+    with metrics.timed("heatmap_tiles.fetch") as stage:
+        context = get_incidents(lat_min - blat, lat_max + blat, lng_min - blng, lng_max + blng)
+        stage.rows = len(context)
+
+    # Bin incidents inside the tile on the tile-aligned grid (half-open bounds
+    # so an incident on a tile edge belongs to exactly one tile)
+    bins: Dict[Tuple[int, int], list] = {}
+    for inc in context:
+        fx, fy = tile_xy(float(inc["latitude"]), float(inc["longitude"]), z)
+        fx -= x
+        fy -= y
+        if 0.0 <= fx < 1.0 and 0.0 <= fy < 1.0:
+            bins.setdefault((int(fy * n_cells), int(fx * n_cells)), []).append(inc)
+
+    now = datetime.now(timezone.utc)
+    with metrics.timed("heatmap_tiles.scoring") as stage:
+        cell_bins, _ = collect_cells((bins[k] for k in sorted(bins)), n_cells * n_cells)
+        risk_results, stage.rows = score_cells(cell_bins, context, local_hour, now)
+        stage.cells = len(cell_bins)
+
+    return {
+        "success": True,
+        "tile": {
+            "z": z,
+            "x": x,
+            "y": y,
+            "bounds": {"lat_min": lat_min, "lat_max": lat_max, "lng_min": lng_min, "lng_max": lng_max},
+        },
+        "local_hour": local_hour,
+        "cells_per_edge": n_cells,
+        "cells": [
+            cell_dict(cell_lat, cell_lng, bin_incidents, risk_data)
+            for (cell_lat, cell_lng, bin_incidents), risk_data in zip(cell_bins, risk_results)
+        ],
+    }
+
+
+def get_tile(
+    z: int,
+    x: int,
+    y: int,
+    local_hour: int,
+    grid_size_meters: Optional[float] = None,
+) -> Tuple[bytes, str]:
+    """
+    JSON body and ETag for a heatmap tile (cached)
+
+    Args:
+        z, x, y: XYZ tile address
+        local_hour: LOCAL hour (0-23)
+        grid_size_meters: Approximate cell size (default: settings.default_grid_size)
+
+    Returns:
+        (body bytes, quoted ETag)
+    """
+    n_cells = cells_per_edge(z, y, grid_size_meters)
+    key = (z, x, y, int(local_hour) % 24, n_cells)
+    cache = _get_cache()
+    with _lock:
+        entry = cache.get(key)
+    if entry is not None:
+        metrics.inc("ml_heatmap_tile_cache_total", result="hit")
+        return entry
+
+    metrics.inc("ml_heatmap_tile_cache_total", result="miss")
+    generation = _generation
+    started = time.perf_counter()
+    body = json.dumps(jsonable_encoder(_render_tile(z, x, y, key[3], n_cells)), separators=(",", ":")).encode()
+    etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+    metrics.observe_stage("heatmap_tiles.render", time.perf_counter() - started)
+    with _lock:
+        if generation == _generation:
+            cache[key] = (body, etag)
+    return body, etag
+
+
+# ==================== Invalidation ====================
+
+def invalidate_near(lat: float, lng: float) -> int:
+    """
+    Evict tiles whose scoring buffer contains (lat, lng)
+
+    Returns:
+        Number of tiles evicted
+    """
+    global _generation
+    blat, blng = _buffer_degrees(lat)
+    evicted = 0
+    with _lock:
+        _generation += 1
+        cache = _get_cache()
+        zooms = {k[0] for k in cache.keys()}
+        for z in zooms:
+            x_lo, y_lo = tile_xy(lat + blat, lng - blng, z)
+            x_hi, y_hi = tile_xy(lat - blat, lng + blng, z)
+            for key in [k for k in cache.keys() if k[0] == z]:
+                if int(x_lo) <= key[1] <= int(x_hi) and int(y_lo) <= key[2] <= int(y_hi):
+                    if cache.pop(key, None) is not None:
+                        evicted += 1
+    return evicted
+
+
+def clear() -> None:
+    global _generation
+    with _lock:
+        _generation += 1
+        cache = _get_cache()
+        for key in list(cache.keys()):
+            cache.pop(key, None)
+
+
+def _on_incident_change(event: str, incident: Dict) -> None:
+    """Storage change listener"""
+    if event == "cleared":
+        clear()
+        return
+    try:
+        invalidate_near(float(incident["latitude"]), float(incident["longitude"]))
+    except (KeyError, TypeError, ValueError):
+        clear()
+
+
+def start() -> None:
+    """Subscribe to incident writes"""
+    from app.db.storage import register_change_listener
+    register_change_listener(_on_incident_change)
+
+
+def get_cache_status() -> Dict:
+    with _lock:
+        cache = _get_cache()
+        return {"tiles": len(cache), "max_tiles": cache.maxsize, "ttl_seconds": cache.ttl}
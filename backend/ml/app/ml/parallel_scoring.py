@@ -0,0 +1,177 @@
+"""
+Parallel Scoring - large heatmaps scored on a process pool
+
+Cells are split into spatial tiles (a k x k grid over the cell bbox). The
+incident columns are copied once into a shared-memory block; each worker
+maps it, selects the incidents inside its tile bbox plus the 1km scoring
+buffer (neighboring tiles overlap in the buffer) and scores its cells with
+risk_kernel.score_points. Results are written back by cell index, so the
+merge does not depend on completion order and matches serial scoring.
+
+Used by heatmap.score_cells for views with at least heatmap_parallel_min_cells
+cells; heatmap_parallel_workers sets the pool size (0 = one per CPU,
+1 = disabled).
+"""
+
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.ml import risk_kernel
+from app.ml.risk_kernel import SCORING_RADIUS_M
+from app.utils.geospatial import degree_window
+
+logger = logging.getLogger(__name__)
+
+# Shared block rows: lat, lng, ts, hour, severity (float64)
+_SHARED_COLUMNS = ("lat", "lng", "ts", "hour", "severity")
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_workers = 0
+_lock = threading.Lock()
+
+
+def num_workers() -> int:
+    workers = int(settings.heatmap_parallel_workers)
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def is_enabled(n_cells: int) -> bool:
+    """True when n_cells should be scored on the process pool"""
+    return num_workers() > 1 and n_cells >= int(settings.heatmap_parallel_min_cells)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor, _executor_workers
+    workers = num_workers()
+    with _lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            # spawn: workers never inherit the parent's threads, locks or DB pool
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+            _executor_workers = workers
+        return _executor
+
+
+def shutdown() -> None:
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _score_tile(
+    shm_name: str,
+    n_incidents: int,
+    bbox: Tuple[float, float, float, float],
+    cell_lat: np.ndarray,
+    cell_lng: np.ndarray,
+    query_hour: int,
+    now_ts: float,
+    params: Dict[str, float],
+) -> Dict[str, np.ndarray]:
+    """Worker: score one tile's cells against the shared incident columns"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        block = np.ndarray((len(_SHARED_COLUMNS), n_incidents), dtype=np.float64, buffer=shm.buf)
+        lat_min, lat_max, lng_min, lng_max = bbox
+        keep = np.flatnonzero(
+            (block[0] >= lat_min) & (block[0] <= lat_max) & (block[1] >= lng_min) & (block[1] <= lng_max)
+        )
+        # Fancy indexing copies, so nothing references the block after close()
+        columns = {
+            "lat": block[0, keep],
+            "lng": block[1, keep],
+            "ts": block[2, keep],
+            "hour": block[3, keep].astype(np.int8),
+            "severity": block[4, keep],
+        }
+    finally:
+        shm.close()
+    return risk_kernel.score_points(
+        cell_lat,
+        cell_lng,
+        np.full(cell_lat.shape[0], query_hour, dtype=np.int64),
+        columns,
+        now_ts=now_ts,
+        radius_meters=SCORING_RADIUS_M,
+        params=params,
+    )
+
+
+def _tiles(cell_lat: np.ndarray, cell_lng: np.ndarray, n_tiles: int) -> List[np.ndarray]:
+    """Cell indices per spatial tile (k x k grid over the cell bbox, empty tiles dropped)"""
+    k = max(1, int(math.ceil(math.sqrt(n_tiles))))
+    lat_min, lat_max = float(cell_lat.min()), float(cell_lat.max())
+    lng_min, lng_max = float(cell_lng.min()), float(cell_lng.max())
+    ti = np.minimum(((cell_lat - lat_min) / max(lat_max - lat_min, 1e-12) * k).astype(np.int64), k - 1)
+    tj = np.minimum(((cell_lng - lng_min) / max(lng_max - lng_min, 1e-12) * k).astype(np.int64), k - 1)
+    tile = ti * k + tj
+    order = np.argsort(tile, kind="stable")
+    bounds = np.flatnonzero(np.diff(tile[order])) + 1
+    return [idx for idx in np.split(order, bounds) if idx.size]
+
+
+def score_points_parallel(
+    cell_lat: np.ndarray,
+    cell_lng: np.ndarray,
+    query_hour: int,
+    columns: Dict[str, np.ndarray],
+    now_ts: float,
+) -> Dict[str, np.ndarray]:
+    """
+    risk_kernel.score_points (1km radius, one query hour) on the process pool
+
+    Returns:
+        Same arrays as risk_kernel.score_points, in cell order
+    """
+    cell_lat = np.asarray(cell_lat, dtype=np.float64)
+    cell_lng = np.asarray(cell_lng, dtype=np.float64)
+    n_incidents = int(columns["lat"].shape[0])
+    params = risk_kernel.scoring_params()
+    workers = num_workers()
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(_SHARED_COLUMNS) * n_incidents * 8))
+    try:
+        block = np.ndarray((len(_SHARED_COLUMNS), n_incidents), dtype=np.float64, buffer=shm.buf)
+        for row, name in enumerate(_SHARED_COLUMNS):
+            block[row] = columns[name]
+        del block
+
+        # Twice as many tiles as workers evens out dense and sparse tiles
+        tiles = _tiles(cell_lat, cell_lng, 2 * workers)
+        executor = _get_executor()
+        futures = []
+        for idx in tiles:
+            t_lat, t_lng = cell_lat[idx], cell_lng[idx]
+            blat, blng = degree_window(SCORING_RADIUS_M, float(np.max(np.abs(t_lat))))
+            bbox = (
+                float(t_lat.min()) - blat, float(t_lat.max()) + blat,
+                float(t_lng.min()) - blng, float(t_lng.max()) + blng,
+            )
+            futures.append(executor.submit(
+                _score_tile, shm.name, n_incidents, bbox, t_lat, t_lng, int(query_hour), float(now_ts), params
+            ))
+
+        merged: Dict[str, np.ndarray] = {}
+        for idx, future in zip(tiles, futures):
+            result = future.result()
+            for key, values in result.items():
+                if key not in merged:
+                    merged[key] = np.zeros(cell_lat.shape[0], dtype=values.dtype)
+                merged[key][idx] = values
+    finally:
+        shm.close()
+        shm.unlink()
+    return merged
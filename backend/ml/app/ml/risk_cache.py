@@ -0,0 +1,243 @@
+"""
+Risk Score Cache - spatially quantized LRU + TTL cache for point queries
+
+Moving clients re-query nearly the same spot every few seconds. Current-time
+risk queries are snapped to a fixed grid (risk_cache_cell_meters) and cached
+under (cell, local hour, scoring-parameter hash), so every GPS fix
+inside one cell is served from memory for up to cache_ttl seconds.
+
+Entries are scored at the cell center, so the answer does not depend on
+which fix happened to miss first.
+
+Invalidation is targeted: an incident write evicts only the cells whose
+center lies within the scoring radius of the incident (plus the cell
+half-diagonal). Risk raster tile rebuilds evict the cells in the rebuilt area.
+Entries are indexed by cell, so an invalidation only visits the cells in the
+affected bounding box. A score computed while an invalidation runs is not
+cached.
+"""
+
+import hashlib
+import logging
+import math
+import threading
+from typing import Callable, Dict, Hashable, Optional, Set, Tuple
+
+import numpy as np
+from cachetools import TTLCache
+
+from app.config import settings
+from app.ml import risk_kernel
+from app.ml.risk_kernel import SCORING_RADIUS_M
+from app.utils import grid
+from app.utils.geospatial import degree_window
+
+logger = logging.getLogger(__name__)
+
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+_lock = threading.RLock()
+# Bumped on every invalidation; a score computed across one is not cached
+_generation = 0
+# Cell -> cache keys of that cell (may hold keys that already left the cache)
+_by_cell: Dict[Tuple[int, int], Set[Hashable]] = {}
+
+
+def _unindex(key: Hashable) -> None:
+    keys = _by_cell.get(key[0])
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            del _by_cell[key[0]]
+
+
+class _CountingTTLCache(TTLCache):
+    """TTLCache that counts capacity evictions and expirations (and keeps _by_cell in step)"""
+
+    def popitem(self):
+        item = super().popitem()
+        _unindex(item[0])
+        _stats["evictions"] += 1
+        return item
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for key, _ in expired:
+            _unindex(key)
+        _stats["expirations"] += len(expired)
+        return expired
+
+
+_cache: Optional[_CountingTTLCache] = None
+
+
+def _get_cache() -> _CountingTTLCache:
+    global _cache
+    if _cache is None:
+        _cache = _CountingTTLCache(
+            maxsize=max(1, int(settings.risk_cache_max_entries)),
+            ttl=max(1, int(settings.cache_ttl)),
+        )
+    return _cache
+
+
+# ==================== Keys ====================
+
+def quantize(lat: float, lng: float) -> Tuple[int, int]:
+    """Global grid cell (app.utils.grid) containing (lat, lng)"""
+    return grid.cell_index(lat, lng, settings.risk_cache_cell_meters)
+
+
+def cell_center(cell: Tuple[int, int]) -> Tuple[float, float]:
+    return grid.cell_center(cell[0], cell[1], settings.risk_cache_cell_meters)
+
+
+def params_hash() -> str:
+    """Short hash of the scoring settings (entries from older settings never match)"""
+    params = risk_kernel.scoring_params()
+    text = ",".join(f"{k}={params[k]!r}" for k in sorted(params))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+
+# ==================== Lookup ====================
+
+def get_or_compute(
+    lat: float,
+    lng: float,
+    local_hour: int,
+    compute: Callable[[float, float], Dict],
+) -> Dict:
+    """
+    Cached risk for the cell containing (lat, lng)
+
+    Args:
+        lat: Latitude
+        lng: Longitude
+        local_hour: LOCAL hour (0-23)
+        compute: Called with the cell center (lat, lng) on a miss
+
+    Returns:
+        Risk dictionary (a copy; callers may mutate it)
+    """
+    cell = quantize(lat, lng)
+    key: Hashable = (cell, int(local_hour) % 24, params_hash())
+    cache = _get_cache()
+    with _lock:
+        value = cache.get(key)
+        if value is not None:
+            _stats["hits"] += 1
+            return dict(value)
+        _stats["misses"] += 1
+        generation = _generation
+
+    center_lat, center_lng = cell_center(cell)
+    value = compute(center_lat, center_lng)
+    with _lock:
+        if generation == _generation:
+            cache[key] = value
+            _by_cell.setdefault(cell, set()).add(key)
+    return dict(value)
+
+
+# ==================== Invalidation ====================
+
+def _evict_where(
+    lat_min: float,
+    lat_max: float,
+    lng_min: float,
+    lng_max: float,
+    predicate_mask: Callable[[np.ndarray, np.ndarray], np.ndarray],
+) -> int:
+    """Evict cached cells inside the bounds whose center satisfies predicate_mask"""
+    global _generation
+    i_lo, j_lo = quantize(lat_min, lng_min)
+    i_hi, j_hi = quantize(lat_max, lng_max)
+    with _lock:
+        _generation += 1
+        cache = _get_cache()
+        if (i_hi - i_lo + 1) * (j_hi - j_lo + 1) <= len(_by_cell):
+            cells = [(i, j) for i in range(i_lo, i_hi + 1) for j in range(j_lo, j_hi + 1) if (i, j) in _by_cell]
+        else:
+            cells = [c for c in _by_cell if i_lo <= c[0] <= i_hi and j_lo <= c[1] <= j_hi]
+        if not cells:
+            return 0
+        centers = np.array([cell_center(c) for c in cells], dtype=np.float64)
+        mask = predicate_mask(centers[:, 0], centers[:, 1])
+        evicted = 0
+        for cell, hit in zip(cells, mask):
+            if not hit:
+                continue
+            for key in _by_cell.pop(cell):
+                if cache.pop(key, None) is not None:
+                    evicted += 1
+        _stats["invalidations"] += evicted
+    return evicted
+
+
+def invalidate_near(lat: float, lng: float, radius_meters: float = SCORING_RADIUS_M) -> int:
+    """
+    Evict cells whose score can depend on an incident at (lat, lng)
+
+    Returns:
+        Number of entries evicted
+    """
+    half_diagonal = float(settings.risk_cache_cell_meters) * math.sqrt(2.0) / 2.0
+    limit = radius_meters + half_diagonal
+    dlat, dlng = degree_window(limit, lat)
+    return _evict_where(
+        lat - dlat, lat + dlat, lng - dlng, lng + dlng,
+        lambda c_lat, c_lng: risk_kernel.haversine_np(lat, lng, c_lat, c_lng) <= limit,
+    )
+
+
+def invalidate_bounds(lat_min: float, lat_max: float, lng_min: float, lng_max: float) -> int:
+    """Evict cells whose center lies inside the bounds"""
+    return _evict_where(
+        lat_min, lat_max, lng_min, lng_max,
+        lambda c_lat, c_lng: (c_lat >= lat_min) & (c_lat <= lat_max) & (c_lng >= lng_min) & (c_lng <= lng_max),
+    )
+
+
+def clear() -> None:
+    global _generation
+    with _lock:
+        _generation += 1
+        cache = _get_cache()
+        # MutableMapping.clear() goes through popitem(); pop keys directly so
+        # the drop is not counted as capacity evictions
+        keys = list(cache.keys())
+        for key in keys:
+            cache.pop(key, None)
+        _by_cell.clear()
+        _stats["invalidations"] += len(keys)
+
+
+def _on_incident_change(event: str, incident: Dict) -> None:
+    """Storage change listener"""
+    if event == "cleared":
+        clear()
+        return
+    try:
+        invalidate_near(float(incident["latitude"]), float(incident["longitude"]))
+    except (KeyError, TypeError, ValueError):
+        # No usable location: fall back to dropping everything
+        clear()
+
+
+def start() -> None:
+    """Subscribe to incident writes"""
+    from app.db.storage import register_change_listener
+    register_change_listener(_on_incident_change)
+
+
+def get_stats() -> Dict:
+    """Hit / miss / eviction counters and current size"""
+    with _lock:
+        cache = _get_cache()
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "size": len(cache),
+            "max_size": cache.maxsize,
+            "ttl_seconds": cache.ttl,
+            "hit_rate": round(_stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,592 @@
+"""
+Vectorized Risk Scoring Kernel
+NumPy implementation of the risk model used by risk_scoring.py
+
+Incidents are passed around as struct-of-arrays "columns" instead of lists of
+dicts so the distance, recency, time-of-day and pattern terms can be computed
+as whole-array operations.
+
+Equivalence with the original per-incident loop (kept as the reference in
+test_vectorized_scoring.py):
+- Intermediate factors match the scalar implementation to ~1e-9 (only the
+  floating point summation order differs).
+- Rounded outputs (2 decimals for risk_score, 3 for factors) are identical
+  except when a value sits exactly on a rounding boundary, where they may
+  differ by one unit in the last place (0.01 risk / 0.001 factor).
+"""
+
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from app.config import settings
+from app.utils.geospatial import EARTH_RADIUS_M
+
+# Neighborhood of the risk model: incidents farther than this do not
+# contribute to a point's score (every precomputed path scores with it)
+SCORING_RADIUS_M = 1000.0
+
+# Distance kernel scale used by the risk model: weight = exp(-d / 111 m)
+DISTANCE_SCALE_M = 111.0
+
+# Time windows used for the historical pattern term. Index order matters: it is
+# the tie-break order of the original dict-based "dominant pattern" selection.
+PATTERN_WINDOWS = ("night", "evening", "afternoon", "morning")
+HOUR_TO_WINDOW = np.full(24, -1, dtype=np.int8)
+for _h in (21, 22, 23, 0, 1, 2, 3, 4):
+    HOUR_TO_WINDOW[_h] = 0
+for _h in (18, 19, 20):
+    HOUR_TO_WINDOW[_h] = 1
+for _h in range(12, 18):
+    HOUR_TO_WINDOW[_h] = 2
+for _h in range(6, 12):
+    HOUR_TO_WINDOW[_h] = 3
+
+# Time-of-day risk factor per LOCAL hour (mirrors calculate_time_of_day_factor)
+TIME_OF_DAY_FACTOR = np.array(
+    [0.9 if (h >= 21 or h < 4) else 0.7 if 18 <= h < 21 else 0.6 if 4 <= h < 8 else 0.3 for h in range(24)],
+    dtype=np.float64,
+)
+
+RISK_LEVELS = ("very_safe", "safe", "medium", "high", "very_high")
+
+COLUMNS = ("lat", "lng", "ts", "hour", "severity")
+
+
+# ==================== Incident columns ====================
+
+def empty_columns() -> Dict[str, np.ndarray]:
+    """Return an empty incident column set"""
+    return {
+        "lat": np.empty(0, dtype=np.float64),
+        "lng": np.empty(0, dtype=np.float64),
+        "ts": np.empty(0, dtype=np.float64),
+        "hour": np.empty(0, dtype=np.int8),
+        "severity": np.empty(0, dtype=np.float64),
+    }
+
+
+def timestamp_to_epoch(ts: Any) -> float:
+    """Epoch seconds for a datetime/ISO string (naive = UTC); NaN if unparseable."""
+    if isinstance(ts, datetime):
+        ts_dt = ts if ts.tzinfo is not None else ts.replace(tzinfo=timezone.utc)
+    elif isinstance(ts, str):
+        try:
+            ts_dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+        except Exception:
+            return math.nan
+        if ts_dt.tzinfo is None:
+            ts_dt = ts_dt.replace(tzinfo=timezone.utc)
+    else:
+        return math.nan
+    return ts_dt.timestamp()
+
+
+def _incident_local_hour(incident: Dict[str, Any]) -> int:
+    """Same preference order as risk_scoring._incident_hour_local; -1 when unknown."""
+    try:
+        h = incident.get("incident_local_hour", None)
+        if h is not None:
+            h_int = int(h)
+            if 0 <= h_int <= 23:
+                return h_int
+    except Exception:
+        pass
+
+    ts = incident.get("timestamp")
+    if isinstance(ts, datetime):
+        ts_dt = ts if ts.tzinfo is not None else ts.replace(tzinfo=timezone.utc)
+    elif isinstance(ts, str):
+        try:
+            ts_dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+        except Exception:
+            return -1
+    else:
+        return -1
+
+    tz_off = incident.get("timezone_offset_minutes", None)
+    if tz_off is not None:
+        try:
+            return int((ts_dt + timedelta(minutes=int(tz_off))).hour)
+        except Exception:
+            return int(ts_dt.hour)
+    return int(ts_dt.hour)
+
+
+def incidents_to_columns(incidents: Sequence[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """
+    Convert incident dicts (as returned by app.db.storage) into columns
+
+    Rows whose coordinates cannot be parsed are dropped, matching the scalar
+    implementation which skipped them in its distance pre-filter.
+
+    Args:
+        incidents: List of incident dictionaries
+
+    Returns:
+        Dict with float64 "lat", "lng", "ts" (epoch seconds, NaN if unknown),
+        "severity" and int8 "hour" (local hour-of-day, -1 if unknown)
+    """
+    n = len(incidents)
+    lat = np.empty(n, dtype=np.float64)
+    lng = np.empty(n, dtype=np.float64)
+    ts = np.empty(n, dtype=np.float64)
+    hour = np.empty(n, dtype=np.int8)
+    severity = np.empty(n, dtype=np.float64)
+
+    k = 0
+    for inc in incidents:
+        try:
+            lat[k] = float(inc["latitude"])
+            lng[k] = float(inc["longitude"])
+        except Exception:
+            continue
+        ts[k] = timestamp_to_epoch(inc.get("timestamp"))
+        hour[k] = _incident_local_hour(inc)
+        try:
+            severity[k] = float(inc.get("severity", 0) or 0)
+        except Exception:
+            severity[k] = 0.0
+        k += 1
+
+    return {
+        "lat": lat[:k],
+        "lng": lng[:k],
+        "ts": ts[:k],
+        "hour": hour[:k],
+        "severity": severity[:k],
+    }
+
+
+def take_columns(columns: Dict[str, np.ndarray], idx: np.ndarray) -> Dict[str, np.ndarray]:
+    """Select rows from a column set (index array or boolean mask)"""
+    return {k: columns[k][idx] for k in COLUMNS}
+
+
+# ==================== Geometry ====================
+
+def haversine_np(lat1, lng1, lat2, lng2) -> np.ndarray:
+    """
+    Vectorized Haversine distance in meters (broadcasts like NumPy ufuncs)
+
+    Uses the same formula as app.utils.geospatial.calculate_distance_haversine.
+    """
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    dlat = lat2 - lat1
+    dlng = np.radians(np.asarray(lng2) - np.asarray(lng1))
+    a = np.sin(dlat / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2.0) ** 2
+    a = np.clip(a, 0.0, 1.0)
+    return EARTH_RADIUS_M * 2.0 * np.arctan2(np.sqrt(a), np.sqrt(1.0 - a))
+
+
+def project_equirectangular(lat, lng, lat0: float):
+    """Project lat/lng (degrees) to local x/y meters around reference latitude lat0"""
+    x = np.radians(np.asarray(lng, dtype=np.float64)) * EARTH_RADIUS_M * math.cos(math.radians(lat0))
+    y = np.radians(np.asarray(lat, dtype=np.float64)) * EARTH_RADIUS_M
+    return x, y
+
+
+def radius_pairs(
+    point_lat: np.ndarray,
+    point_lng: np.ndarray,
+    inc_lat: np.ndarray,
+    inc_lng: np.ndarray,
+    radius_meters: float,
+):
+    """
+    Candidate (point, incident) index pairs within ~radius_meters via a KD-tree
+
+    Uses a local equirectangular projection with the search radius inflated
+    to cover projection error, so the result is a superset of the exact
+    Haversine neighborhood (score_points applies the exact filter).
+
+    Returns:
+        (pair_point, pair_incident) int64 arrays
+    """
+    point_lat = np.asarray(point_lat, dtype=np.float64)
+    point_lng = np.asarray(point_lng, dtype=np.float64)
+    if point_lat.size == 0 or inc_lat.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    lat0 = float(np.mean(point_lat))
+    max_abs_lat = min(89.0, float(max(np.max(np.abs(point_lat)), np.max(np.abs(inc_lat)))))
+    inflate = max(1.0, math.cos(math.radians(lat0)) / math.cos(math.radians(max_abs_lat))) * 1.01
+
+    ix, iy = project_equirectangular(inc_lat, inc_lng, lat0)
+    px, py = project_equirectangular(point_lat, point_lng, lat0)
+    tree = cKDTree(np.column_stack((ix, iy)))
+    hits = tree.query_ball_point(np.column_stack((px, py)), r=radius_meters * inflate + 1.0)
+
+    lengths = np.fromiter((len(h) for h in hits), dtype=np.int64, count=len(hits))
+    pair_point = np.repeat(np.arange(len(hits), dtype=np.int64), lengths)
+    if lengths.sum() == 0:
+        return pair_point, np.empty(0, dtype=np.int64)
+    pair_incident = np.concatenate([np.asarray(h, dtype=np.int64) for h in hits if h])
+    return pair_point, pair_incident
+
+
+# ==================== Model parameters ====================
+
+def scoring_params() -> Dict[str, float]:
+    """Snapshot of the scoring settings (read once per call, not per incident)"""
+    sigma = max(0.25, float(getattr(settings, "time_of_day_sigma_hours", 3.0)))
+    floor = max(0.0, min(1.0, float(getattr(settings, "time_of_day_min_weight", 0.05))))
+    return {
+        "decay_days": max(1.0, float(getattr(settings, "recency_decay_days", 30.0))),
+        "sigma_hours": sigma,
+        "time_floor": floor,
+        "max_expected": max(1.0, float(getattr(settings, "max_expected_effective_incidents", 10.0))),
+        "w_density": float(settings.weight_incident_density),
+        "w_recency": float(settings.weight_recency),
+        "w_severity": float(settings.weight_severity),
+        "w_time": float(settings.weight_time_pattern),
+    }
+
+
+def hour_similarity_matrix(params: Optional[Dict[str, float]] = None) -> np.ndarray:
+    """
+    24x24 time-of-day similarity weights: M[query_hour, incident_hour]
+
+    Mirrors risk_scoring._time_of_day_similarity_weight.
+    """
+    p = params or scoring_params()
+    h = np.arange(24)
+    d = np.abs(h[:, None] - h[None, :]) % 24
+    d = np.minimum(d, 24 - d).astype(np.float64)
+    sigma = p["sigma_hours"]
+    w = np.exp(-(d * d) / (2.0 * sigma * sigma))
+    return np.clip(w, p["time_floor"], 1.0)
+
+
+# ==================== Scoring ====================
+
+def score_points(
+    point_lat: np.ndarray,
+    point_lng: np.ndarray,
+    query_hour: np.ndarray,
+    columns: Dict[str, np.ndarray],
+    pair_point: Optional[np.ndarray] = None,
+    pair_incident: Optional[np.ndarray] = None,
+    now_ts: Optional[float] = None,
+    radius_meters: float = SCORING_RADIUS_M,
+    params: Optional[Dict[str, float]] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Score many points against one incident column set in a single pass
+
+    Candidate (point, incident) pairs may be supplied by the caller; when
+    omitted they come from a KD-tree radius query (or all incidents for a
+    single point). Pairs are always filtered by exact Haversine distance
+    <= radius_meters.
+
+    Args:
+        point_lat, point_lng: Query coordinates, shape (P,)
+        query_hour: LOCAL query hour (0-23) per point, shape (P,)
+        columns: Incident columns (see incidents_to_columns)
+        pair_point, pair_incident: Optional candidate pair indices
+        now_ts: Reference time as epoch seconds (default: now)
+        radius_meters: Neighborhood radius
+        params: Scoring parameters (default: scoring_params())
+
+    Returns:
+        Dict of arrays, shape (P,): risk_score, incident_density, recency,
+        severity, time_pattern, current_time_factor, raw_incident_count,
+        effective_incident_count
+    """
+    p = params or scoring_params()
+    point_lat = np.atleast_1d(np.asarray(point_lat, dtype=np.float64))
+    point_lng = np.atleast_1d(np.asarray(point_lng, dtype=np.float64))
+    query_hour = np.broadcast_to(np.asarray(query_hour, dtype=np.int64) % 24, point_lat.shape)
+    n_points = point_lat.shape[0]
+    now_ts = datetime.now(timezone.utc).timestamp() if now_ts is None else float(now_ts)
+
+    t = _pair_terms(point_lat, point_lng, columns, pair_point, pair_incident, now_ts, radius_meters, p)
+    pp = t["pp"]
+    inc_hour = t["inc_hour"]
+    q_hour = query_hour[pp]
+
+    # Time-of-day similarity (incidents with unknown hour match any query hour;
+    # incidents with unknown timestamp contribute no weight).
+    sim = hour_similarity_matrix(p)
+    time_w = sim[q_hour, np.where(inc_hour >= 0, inc_hour, q_hour)]
+    time_w = np.where(t["valid_ts"], time_w, 0.0)
+
+    dt_w = t["distance_w"] * time_w
+    weight = dt_w * t["recency_w"]
+
+    def _sum(values: np.ndarray) -> np.ndarray:
+        return np.bincount(pp, weights=values, minlength=n_points)
+
+    rec_numer = _sum(weight)
+    return combine_factors(
+        query_hour=query_hour,
+        raw_count=t["raw_count"],
+        effective=_sum(t["recency_w"] * time_w),
+        weighted_severity=_sum(t["severity"] * weight),
+        recency_numer=rec_numer,
+        recency_denom=_sum(dt_w),
+        total_weight=rec_numer,
+        pattern=t["pattern"],
+        params=p,
+    )
+
+
+def score_points_all_hours(
+    point_lat: np.ndarray,
+    point_lng: np.ndarray,
+    columns: Dict[str, np.ndarray],
+    pair_point: Optional[np.ndarray] = None,
+    pair_incident: Optional[np.ndarray] = None,
+    now_ts: Optional[float] = None,
+    radius_meters: float = SCORING_RADIUS_M,
+    params: Optional[Dict[str, float]] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Score many points for all 24 LOCAL query hours in one pass
+
+    Distance and recency weights are computed once per pair and summed per
+    incident hour-of-day; the 24 query hours are then obtained with one
+    product against the 24x24 hour-similarity matrix. Cost is
+    O(pairs + points * 24 * 25) instead of 24 full scoring passes.
+
+    Returns:
+        Same keys as score_points, each of shape (P, 24) indexed by query hour
+    """
+    p = params or scoring_params()
+    point_lat = np.atleast_1d(np.asarray(point_lat, dtype=np.float64))
+    point_lng = np.atleast_1d(np.asarray(point_lng, dtype=np.float64))
+    n_points = point_lat.shape[0]
+    now_ts = datetime.now(timezone.utc).timestamp() if now_ts is None else float(now_ts)
+
+    t = _pair_terms(point_lat, point_lng, columns, pair_point, pair_incident, now_ts, radius_meters, p)
+    valid = t["valid_ts"]
+    pp = t["pp"][valid]
+    # Incident hour bins 0..23, plus bin 24 for "unknown hour" (matches every query hour)
+    hbin = np.where(t["inc_hour"] >= 0, t["inc_hour"], 24)[valid]
+    flat = pp * 25 + hbin
+    size = n_points * 25
+
+    def _hist(values: np.ndarray) -> np.ndarray:
+        return np.bincount(flat, weights=values, minlength=size).reshape(n_points, 25)
+
+    rec = t["recency_w"][valid]
+    dw = t["distance_w"][valid]
+    e_h = _hist(rec)
+    rn_h = _hist(dw * rec)
+    rd_h = _hist(dw)
+    ws_h = _hist(t["severity"][valid] * dw * rec)
+
+    sim = np.hstack([hour_similarity_matrix(p), np.ones((24, 1))])  # (24 query, 25 bins)
+    effective = e_h @ sim.T
+    rec_numer = rn_h @ sim.T
+    rec_denom = rd_h @ sim.T
+    w_sev = ws_h @ sim.T
+
+    hours = np.tile(np.arange(24), n_points)
+    out = combine_factors(
+        query_hour=hours,
+        raw_count=np.repeat(t["raw_count"], 24),
+        effective=effective.reshape(-1),
+        weighted_severity=w_sev.reshape(-1),
+        recency_numer=rec_numer.reshape(-1),
+        recency_denom=rec_denom.reshape(-1),
+        total_weight=rec_numer.reshape(-1),
+        pattern=np.repeat(t["pattern"], 24, axis=0),
+        params=p,
+    )
+    return {k: v.reshape(n_points, 24) for k, v in out.items()}
+
+
+def _pair_terms(
+    point_lat: np.ndarray,
+    point_lng: np.ndarray,
+    columns: Dict[str, np.ndarray],
+    pair_point: Optional[np.ndarray],
+    pair_incident: Optional[np.ndarray],
+    now_ts: float,
+    radius_meters: float,
+    p: Dict[str, float],
+) -> Dict[str, np.ndarray]:
+    """Hour-independent per-pair terms plus per-point raw and pattern counts"""
+    n_points = point_lat.shape[0]
+    if pair_point is None or pair_incident is None:
+        n_inc = columns["lat"].shape[0]
+        if n_points == 1:
+            pair_point = np.zeros(n_inc, dtype=np.int64)
+            pair_incident = np.arange(n_inc)
+        else:
+            pair_point, pair_incident = radius_pairs(
+                point_lat, point_lng, columns["lat"], columns["lng"], radius_meters
+            )
+
+    dist = haversine_np(
+        point_lat[pair_point], point_lng[pair_point],
+        columns["lat"][pair_incident], columns["lng"][pair_incident],
+    )
+    keep = dist <= radius_meters
+    pp = pair_point[keep]
+    pi = pair_incident[keep]
+    dist = dist[keep]
+
+    ts = columns["ts"][pi]
+    valid_ts = ~np.isnan(ts)
+    days_ago = (now_ts - np.where(valid_ts, ts, now_ts)) / 86400.0
+    inc_hour = columns["hour"][pi].astype(np.int64)
+
+    # Historical time-window pattern counts (4 windows per point)
+    win = HOUR_TO_WINDOW[np.where(inc_hour >= 0, inc_hour, 5)]
+    has_win = win >= 0
+    pattern = np.zeros((n_points, len(PATTERN_WINDOWS)), dtype=np.int64)
+    np.add.at(pattern, (pp[has_win], win[has_win].astype(np.int64)), 1)
+
+    return {
+        "pp": pp,
+        "distance_w": np.exp(-dist / DISTANCE_SCALE_M),
+        "recency_w": np.where(valid_ts, np.exp(-days_ago / p["decay_days"]), 0.0),
+        "valid_ts": valid_ts,
+        "inc_hour": inc_hour,
+        "severity": columns["severity"][pi],
+        "raw_count": np.bincount(pp, minlength=n_points),
+        "pattern": pattern,
+    }
+
+
+def combine_factors(
+    query_hour: np.ndarray,
+    raw_count: np.ndarray,
+    effective: np.ndarray,
+    weighted_severity: np.ndarray,
+    recency_numer: np.ndarray,
+    recency_denom: np.ndarray,
+    total_weight: np.ndarray,
+    pattern: np.ndarray,
+    params: Dict[str, float],
+) -> Dict[str, np.ndarray]:
+    """Turn per-point weighted sums into the final factors and risk score"""
+    p = params
+    ctf = TIME_OF_DAY_FACTOR[query_hour]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        density = np.where(
+            effective > 0, np.log(effective + 1.0) / math.log(p["max_expected"] + 1.0), 0.0
+        )
+        density = np.clip(density, 0.0, 1.0)
+        recency = np.where(recency_denom > 0, recency_numer / recency_denom, 0.0)
+        severity = np.where(total_weight > 0, weighted_severity / total_weight, 0.0) / 5.0
+
+        total_pattern = pattern.sum(axis=1)
+        dominant = np.argmax(pattern, axis=1)
+        strength = np.where(
+            total_pattern > 0,
+            pattern[np.arange(pattern.shape[0]), dominant] / np.maximum(total_pattern, 1),
+            0.0,
+        )
+    matches = HOUR_TO_WINDOW[query_hour] == dominant
+    location_tp = np.where(
+        matches & (strength > 0.5),
+        0.9 + strength * 0.1,
+        np.where(
+            matches & (strength > 0.3),
+            0.7 + strength * 0.2,
+            np.where(matches, 0.5 + strength * 0.2, ctf * 0.6),
+        ),
+    )
+    time_pattern = np.where(total_pattern > 0, location_tp * 0.7 + ctf * 0.3, ctf)
+
+    risk = (
+        p["w_density"] * density
+        + p["w_recency"] * recency
+        + p["w_severity"] * severity
+        + p["w_time"] * time_pattern
+    ) * 5.0
+    risk = np.clip(risk, 0.0, 5.0)
+
+    # Points without any incident in radius fall back to time-only base risk
+    empty = raw_count == 0
+    risk = np.where(empty, ctf * 1.5, risk)
+    time_pattern = np.where(empty, ctf, time_pattern)
+
+    return {
+        "risk_score": risk,
+        "incident_density": density,
+        "recency": recency,
+        "severity": severity,
+        "time_pattern": time_pattern,
+        "current_time_factor": ctf,
+        "raw_incident_count": raw_count,
+        "effective_incident_count": effective,
+    }
+
+
+def risk_level_for_score(risk_score: float, raw_incident_count: int) -> str:
+    """Risk level label (time-only base risk uses a two-level scale)"""
+    if raw_incident_count == 0:
+        return "safe" if risk_score < 2.0 else "medium"
+    if risk_score <= 1.0:
+        return "very_safe"
+    elif risk_score <= 2.0:
+        return "safe"
+    elif risk_score <= 3.0:
+        return "medium"
+    elif risk_score <= 4.0:
+        return "high"
+    return "very_high"
+
+
+def risk_level_codes(risk_scores: np.ndarray, raw_incident_counts: np.ndarray) -> np.ndarray:
+    """Vectorized risk_level_for_score: indices into RISK_LEVELS (uint8)"""
+    risk_scores = np.asarray(risk_scores, dtype=np.float64)
+    codes = np.searchsorted(np.array([1.0, 2.0, 3.0, 4.0]), risk_scores, side="left")
+    no_incidents = np.asarray(raw_incident_counts) == 0
+    codes = np.where(no_incidents, np.where(risk_scores < 2.0, 1, 2), codes)
+    return codes.astype(np.uint8)
+
+
+def result_dict(scores: Dict[str, np.ndarray], i: int, calculated_at: Optional[str] = None) -> Dict:
+    """
+    Build the public result dict for point i (same shape as
+    risk_scoring._calculate_risk_score_from_incidents)
+    """
+    raw = int(scores["raw_incident_count"][i])
+    risk = float(scores["risk_score"][i])
+    ctf = float(scores["current_time_factor"][i])
+    if raw == 0:
+        return {
+            "risk_score": round(risk, 2),
+            "risk_level": risk_level_for_score(risk, 0),
+            "factors": {
+                "incident_density": 0.0,
+                "recency": 0.0,
+                "severity": 0.0,
+                "time_pattern": round(ctf, 3),
+                "current_time_factor": round(ctf, 3),
+                "raw_incident_count": 0,
+                "effective_incident_count": 0.0,
+            },
+        }
+
+    out = {
+        "risk_score": round(risk, 2),
+        "risk_level": risk_level_for_score(risk, raw),
+        "factors": {
+            "incident_density": round(float(scores["incident_density"][i]), 3),
+            "recency": round(float(scores["recency"][i]), 3),
+            "severity": round(float(scores["severity"][i]), 3),
+            "time_pattern": round(float(scores["time_pattern"][i]), 3),
+            "current_time_factor": round(ctf, 3),
+            "raw_incident_count": raw,
+            "effective_incident_count": round(float(scores["effective_incident_count"][i]), 3),
+        },
+    }
+    if calculated_at is not None:
+        out["calculated_at"] = calculated_at
+    return out
+
+
+def result_dicts(scores: Dict[str, np.ndarray], calculated_at: Optional[str] = None) -> List[Dict]:
+    """Build result dicts for every scored point"""
+    return [result_dict(scores, i, calculated_at) for i in range(scores["risk_score"].shape[0])]
@@ -0,0 +1,406 @@
+"""
+Precomputed Risk Raster - O(1) point risk lookups
+Fixed metric grid x 24 LOCAL hours holding the risk score and factor breakdown
+
+A background thread builds the raster from all incidents inside the configured
+bounds and rebuilds it periodically (recency decay keeps moving). Incident
+writes only mark the tiles within the scoring radius of the changed incident
+as dirty; the worker re-scores just those tiles.
+
+Point queries inside the bounds are answered by bilinear interpolation between
+the four surrounding grid nodes. Points outside the bounds (or before the
+first build completes) return None so callers fall back to exact scoring.
+"""
+
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.ml import risk_kernel
+from app.ml.risk_kernel import SCORING_RADIUS_M
+from app.utils.geospatial import METERS_PER_DEG_LAT, degree_window, meters_to_lng_degrees
+
+logger = logging.getLogger(__name__)
+
+# Interpolated float channels (last axis of the raster "values" array)
+FIELDS = (
+    "risk_score",
+    "incident_density",
+    "recency",
+    "severity",
+    "time_pattern",
+    "effective_incident_count",
+)
+
+# Current raster (swapped atomically on full rebuild, rebuilt tiles copied in under _lock)
+_state: Optional[Dict] = None
+_dirty_tiles: Set[Tuple[int, int]] = set()
+_full_rebuild_requested = False
+_lock = threading.Lock()
+_wake = threading.Event()
+_stop = threading.Event()
+_worker: Optional[threading.Thread] = None
+
+
+# ==================== Grid geometry ====================
+
+def _new_grid() -> Dict:
+    """Grid geometry from settings (nodes every risk_raster_cell_meters)"""
+    lat_min = float(settings.risk_raster_lat_min)
+    lat_max = float(settings.risk_raster_lat_max)
+    lng_min = float(settings.risk_raster_lng_min)
+    lng_max = float(settings.risk_raster_lng_max)
+    cell_m = max(10.0, float(settings.risk_raster_cell_meters))
+
+    dlat = cell_m / METERS_PER_DEG_LAT
+    dlng = meters_to_lng_degrees(cell_m, (lat_min + lat_max) / 2.0)
+    ny = int(math.ceil((lat_max - lat_min) / dlat)) + 1
+    nx = int(math.ceil((lng_max - lng_min) / dlng)) + 1
+
+    return {
+        "lat0": lat_min,
+        "lng0": lng_min,
+        "dlat": dlat,
+        "dlng": dlng,
+        "ny": ny,
+        "nx": nx,
+        "tile": max(2, int(settings.risk_raster_tile_nodes)),
+    }
+
+
+def _tiles_near(grid: Dict, lat: float, lng: float, radius_m: float) -> Set[Tuple[int, int]]:
+    """Tile ids whose nodes may lie within radius_m of (lat, lng)"""
+    wlat, wlng = degree_window(radius_m, lat)
+    ry = wlat / grid["dlat"]
+    rx = wlng / grid["dlng"]
+    fy = (lat - grid["lat0"]) / grid["dlat"]
+    fx = (lng - grid["lng0"]) / grid["dlng"]
+    i_lo = max(0, int(math.floor(fy - ry)))
+    i_hi = min(grid["ny"] - 1, int(math.ceil(fy + ry)))
+    j_lo = max(0, int(math.floor(fx - rx)))
+    j_hi = min(grid["nx"] - 1, int(math.ceil(fx + rx)))
+    if i_lo > i_hi or j_lo > j_hi:
+        return set()
+    t = grid["tile"]
+    return {
+        (ti, tj)
+        for ti in range(i_lo // t, i_hi // t + 1)
+        for tj in range(j_lo // t, j_hi // t + 1)
+    }
+
+
+def _tile_bounds(grid: Dict, ti: int, tj: int) -> Tuple[slice, slice]:
+    t = grid["tile"]
+    return (
+        slice(ti * t, min(grid["ny"], (ti + 1) * t)),
+        slice(tj * t, min(grid["nx"], (tj + 1) * t)),
+    )
+
+
+def _all_tiles(grid: Dict) -> Set[Tuple[int, int]]:
+    t = grid["tile"]
+    return {
+        (ti, tj)
+        for ti in range(int(math.ceil(grid["ny"] / t)))
+        for tj in range(int(math.ceil(grid["nx"] / t)))
+    }
+
+
+# ==================== Building ====================
+
+def _fetch_columns(lat_min: float, lat_max: float, lng_min: float, lng_max: float) -> Dict[str, np.ndarray]:
+    """Incident columns inside a bounding box"""
+    from app.db.storage import get_incident_columns
+    return get_incident_columns(lat_min=lat_min, lat_max=lat_max, lng_min=lng_min, lng_max=lng_max)
+
+
+def _score_tile(
+    grid: Dict, base: np.ndarray, ti: int, tj: int, columns: Dict[str, np.ndarray], now_ts: float, params: Dict
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Channel values (24, h, w, C) and raw incident counts (h, w) of one tile"""
+    sy, sx = _tile_bounds(grid, ti, tj)
+    node_lat = grid["lat0"] + np.arange(sy.start, sy.stop) * grid["dlat"]
+    node_lng = grid["lng0"] + np.arange(sx.start, sx.stop) * grid["dlng"]
+    shape = (len(node_lat), len(node_lng))
+    values = np.empty((24, *shape, len(FIELDS)), dtype=np.float32)
+    raw = np.zeros(shape, dtype=np.int32)
+
+    # Incidents that can reach any node of this tile
+    blat, blng = degree_window(SCORING_RADIUS_M, float(node_lat[-1]))
+    near = (
+        (columns["lat"] >= node_lat[0] - blat)
+        & (columns["lat"] <= node_lat[-1] + blat)
+        & (columns["lng"] >= node_lng[0] - blng)
+        & (columns["lng"] <= node_lng[-1] + blng)
+    )
+    if not near.any():
+        values[:] = base[:, None, None, :]
+        return values, raw
+
+    tile_cols = risk_kernel.take_columns(columns, near)
+    lat_grid, lng_grid = np.meshgrid(node_lat, node_lng, indexing="ij")
+    scores = risk_kernel.score_points_all_hours(
+        lat_grid.ravel(),
+        lng_grid.ravel(),
+        tile_cols,
+        now_ts=now_ts,
+        radius_meters=SCORING_RADIUS_M,
+        params=params,
+    )
+    for c, field in enumerate(FIELDS):
+        # (P, 24) -> (24, h, w)
+        values[..., c] = scores[field].T.reshape(24, *shape)
+    raw[:] = scores["raw_incident_count"][:, 0].reshape(shape)
+    return values, raw
+
+
+def _score_tiles(
+    state: Dict, tiles: Set[Tuple[int, int]], columns: Dict[str, np.ndarray], now_ts: float
+) -> Iterator[Tuple[Tuple[int, int], np.ndarray, np.ndarray]]:
+    """Re-score the nodes of the given tiles into new arrays (state is not modified)"""
+    params = risk_kernel.scoring_params()
+    for ti, tj in sorted(tiles):
+        yield (ti, tj), *_score_tile(state["grid"], state["base"], ti, tj, columns, now_ts, params)
+
+
+def _install_tiles(state: Dict, scored: Iterable[Tuple[Tuple[int, int], np.ndarray, np.ndarray]]) -> None:
+    """Copy scored tiles into the raster arrays"""
+    for (ti, tj), tile_values, tile_raw in scored:
+        sy, sx = _tile_bounds(state["grid"], ti, tj)
+        state["values"][:, sy, sx, :] = tile_values
+        state["raw_incident_count"][sy, sx] = tile_raw
+
+
+def _base_values() -> np.ndarray:
+    """Per-hour channel values for nodes without incidents (time-only base risk)"""
+    scores = risk_kernel.score_points_all_hours(
+        np.array([0.0]), np.array([0.0]), risk_kernel.empty_columns()
+    )
+    return np.stack([scores[f][0] for f in FIELDS], axis=-1).astype(np.float32)  # (24, C)
+
+
+def build_raster() -> Dict:
+    """
+    Build the full raster from scratch and swap it in
+
+    Returns:
+        Raster summary (see get_raster_status)
+    """
+    global _state
+    started = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    grid = _new_grid()
+
+    base = _base_values()
+    values = np.empty((24, grid["ny"], grid["nx"], len(FIELDS)), dtype=np.float32)
+    values[:] = base[:, None, None, :]
+    state = {
+        "grid": grid,
+        "values": values,
+        "raw_incident_count": np.zeros((grid["ny"], grid["nx"]), dtype=np.int32),
+        "base": base,
+        "built_at": now,
+    }
+    # Writes landing from here on are re-scored on top of this build
+    with _lock:
+        _dirty_tiles.clear()
+
+    lat_max = grid["lat0"] + (grid["ny"] - 1) * grid["dlat"]
+    lng_max = grid["lng0"] + (grid["nx"] - 1) * grid["dlng"]
+    blat, blng = degree_window(SCORING_RADIUS_M, lat_max)
+    columns = _fetch_columns(grid["lat0"] - blat, lat_max + blat, grid["lng0"] - blng, lng_max + blng)
+    _install_tiles(state, _score_tiles(state, _all_tiles(grid), columns, now.timestamp()))
+
+    with _lock:
+        state["version"] = (_state["version"] + 1) if _state else 1
+        _state = state
+
+    from app.ml import risk_cache
+    risk_cache.clear()
+
+    logger.info(
+        f"Risk raster built: {grid['ny']}x{grid['nx']} nodes x 24 hours from "
+        f"{columns['lat'].shape[0]} incidents in {time.perf_counter() - started:.1f}s"
+    )
+    return get_raster_status()
+
+
+def rebuild_dirty_tiles() -> int:
+    """
+    Re-score tiles marked dirty by incident writes
+
+    Returns:
+        Number of tiles rebuilt
+    """
+    with _lock:
+        state = _state
+        tiles = set(_dirty_tiles)
+        _dirty_tiles.clear()
+    if state is None or not tiles:
+        return 0
+
+    grid = state["grid"]
+    rows = [_tile_bounds(grid, ti, tj) for ti, tj in tiles]
+    lat_lo = grid["lat0"] + min(sy.start for sy, _ in rows) * grid["dlat"]
+    lat_hi = grid["lat0"] + (max(sy.stop for sy, _ in rows) - 1) * grid["dlat"]
+    lng_lo = grid["lng0"] + min(sx.start for _, sx in rows) * grid["dlng"]
+    lng_hi = grid["lng0"] + (max(sx.stop for _, sx in rows) - 1) * grid["dlng"]
+    blat, blng = degree_window(SCORING_RADIUS_M, lat_hi)
+    columns = _fetch_columns(lat_lo - blat, lat_hi + blat, lng_lo - blng, lng_hi + blng)
+
+    # Lookups read the live arrays: score into new tiles, then copy them in
+    scored = list(_score_tiles(state, tiles, columns, datetime.now(timezone.utc).timestamp()))
+    with _lock:
+        if _state is not state:
+            return 0  # replaced by a full build meanwhile
+        _install_tiles(state, scored)
+        state["version"] += 1
+
+    # Cached point scores in the rebuilt area were served from the old tiles
+    from app.ml import risk_cache
+    risk_cache.invalidate_bounds(lat_lo, lat_hi, lng_lo, lng_hi)
+    logger.info(f"Risk raster: rebuilt {len(tiles)} dirty tiles")
+    return len(tiles)
+
+
+def mark_dirty(lat: float, lng: float) -> None:
+    """Mark the tiles within the scoring radius of (lat, lng) for rebuild"""
+    state = _state
+    if state is None:
+        return
+    tiles = _tiles_near(state["grid"], lat, lng, SCORING_RADIUS_M)
+    if tiles:
+        with _lock:
+            _dirty_tiles.update(tiles)
+        _wake.set()
+
+
+def _on_incident_change(event: str, incident: Dict) -> None:
+    """Storage change listener"""
+    global _full_rebuild_requested
+    if event == "cleared":
+        _full_rebuild_requested = True
+        _wake.set()
+        return
+    mark_dirty(float(incident["latitude"]), float(incident["longitude"]))
+
+
+# ==================== Lookup ====================
+
+def lookup_risk(lat: float, lng: float, local_hour: int) -> Optional[Dict]:
+    """
+    Interpolated risk for a point from the raster
+
+    Args:
+        lat: Latitude
+        lng: Longitude
+        local_hour: LOCAL hour (0-23)
+
+    Returns:
+        Risk dictionary (same shape as calculate_risk_score), or None when the
+        raster is not built yet or the point lies outside its bounds
+    """
+    state = _state
+    if state is None:
+        return None
+    grid = state["grid"]
+    fy = (lat - grid["lat0"]) / grid["dlat"]
+    fx = (lng - grid["lng0"]) / grid["dlng"]
+    if not (0.0 <= fy <= grid["ny"] - 1 and 0.0 <= fx <= grid["nx"] - 1):
+        return None
+
+    i = min(int(fy), grid["ny"] - 2)
+    j = min(int(fx), grid["nx"] - 2)
+    ty = fy - i
+    tx = fx - j
+    w = np.array([[(1 - ty) * (1 - tx), (1 - ty) * tx], [ty * (1 - tx), ty * tx]])
+    block = state["values"][int(local_hour) % 24, i:i + 2, j:j + 2, :]
+    v = np.tensordot(w, block, axes=([0, 1], [0, 1]))
+    raw = int(state["raw_incident_count"][i + int(round(ty)), j + int(round(tx))])
+
+    risk = float(v[0])
+    ctf = float(risk_kernel.TIME_OF_DAY_FACTOR[int(local_hour) % 24])
+    return {
+        "risk_score": round(risk, 2),
+        "risk_level": risk_kernel.risk_level_for_score(risk, raw),
+        "factors": {
+            "incident_density": round(float(v[1]), 3),
+            "recency": round(float(v[2]), 3),
+            "severity": round(float(v[3]), 3),
+            "time_pattern": round(float(v[4]), 3),
+            "current_time_factor": round(ctf, 3),
+            "raw_incident_count": raw,
+            "effective_incident_count": round(float(v[5]), 3),
+        },
+        "calculated_at": state["built_at"].isoformat(),
+    }
+
+
+def get_raster_status() -> Dict:
+    """Raster build status (for health/diagnostics)"""
+    state = _state
+    if state is None:
+        return {"ready": False}
+    grid = state["grid"]
+    return {
+        "ready": True,
+        "nodes": grid["ny"] * grid["nx"],
+        "shape": [24, grid["ny"], grid["nx"]],
+        "cell_meters": float(settings.risk_raster_cell_meters),
+        "built_at": state["built_at"].isoformat(),
+        "version": state["version"],
+        "dirty_tiles": len(_dirty_tiles),
+    }
+
+
+# ==================== Background worker ====================
+
+def _run_worker() -> None:
+    global _full_rebuild_requested
+    refresh_s = max(60, int(settings.risk_raster_refresh_seconds))
+    while not _stop.is_set():
+        try:
+            state = _state
+            stale = state is None or (
+                (datetime.now(timezone.utc) - state["built_at"]).total_seconds() >= refresh_s
+            )
+            if stale or _full_rebuild_requested:
+                _full_rebuild_requested = False
+                build_raster()
+            else:
+                rebuild_dirty_tiles()
+            age_s = (datetime.now(timezone.utc) - _state["built_at"]).total_seconds()
+            wait_s = max(1.0, refresh_s - age_s)
+        except Exception as e:
+            logger.error(f"Risk raster build failed: {e}", exc_info=True)
+            wait_s = 60
+        _wake.wait(timeout=wait_s)
+        _wake.clear()
+
+
+def start_background_builder() -> None:
+    """Start the raster worker thread (idempotent)"""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    from app.db.storage import register_change_listener
+    register_change_listener(_on_incident_change)
+    _stop.clear()
+    _worker = threading.Thread(target=_run_worker, name="risk-raster", daemon=True)
+    _worker.start()
+
+
+def stop_background_builder() -> None:
+    """Stop the raster worker thread"""
+    global _worker
+    _stop.set()
+    _wake.set()
+    if _worker is not None:
+        _worker.join(timeout=5)
+        _worker = None
@@ -5,10 +5,11 @@ Calculates risk scores (0-5) for locations based on incident data
 
 import math
 from datetime import datetime, timedelta, timezone
-from typing import Dict, Optional, List, Any
+from typing import Dict, Optional, List, Any, Tuple
+import numpy as np
 from app.config import settings
-from app.db.storage import get_incidents
-from app.utils.geospatial import calculate_distance_haversine
+from app.ml import risk_kernel
+from app.utils import metrics
 
 
 def calculate_recency_weight(days_ago: float) -> float:
@@ -120,6 +121,40 @@ def _incident_hour_local(incident: Dict[str, Any]) -> Optional[int]:
     return int(ts_dt.hour)
 
 
+def _query_now(query_timestamp: Optional[datetime]) -> datetime:
+    """Reference time for scoring (naive timestamps are treated as UTC)."""
+    if query_timestamp is None:
+        return datetime.now(timezone.utc)
+    if query_timestamp.tzinfo is None:
+        return query_timestamp.replace(tzinfo=timezone.utc)
+    return query_timestamp
+
+
+def _calculate_risk_score_from_columns(
+    lat: float,
+    lng: float,
+    columns: Dict[str, np.ndarray],
+    query_timestamp: Optional[datetime] = None,
+    local_hour: Optional[int] = None,
+    radius_meters: float = 1000.0,
+) -> Dict:
+    """
+    Vectorized risk scoring for one point over incident columns
+    (see app.ml.risk_kernel.incidents_to_columns).
+    """
+    now = _query_now(query_timestamp)
+    query_local_hour = local_hour if local_hour is not None else now.hour
+    scores = risk_kernel.score_points(
+        np.array([lat]),
+        np.array([lng]),
+        np.array([query_local_hour]),
+        columns,
+        now_ts=now.timestamp(),
+        radius_meters=radius_meters,
+    )
+    return risk_kernel.result_dict(scores, 0, calculated_at=now.isoformat())
+
+
 def _calculate_risk_score_from_incidents(
     lat: float,
     lng: float,
@@ -131,239 +166,136 @@ def _calculate_risk_score_from_incidents(
     """
     Core risk scoring logic that operates on a provided incident list.
     This avoids repeated DB queries when callers already fetched incidents.
+
+    Delegates to the vectorized kernel in app.ml.risk_kernel; results match
+    the per-incident reference in test_vectorized_scoring.py.
     """
-    now = query_timestamp if query_timestamp else datetime.now(timezone.utc)
-    query_local_hour = local_hour if local_hour is not None else now.hour
-    current_time_factor = calculate_time_of_day_factor(query_local_hour)
-
-    if not incidents:
-        base_risk = current_time_factor * 1.5
-        return {
-            "risk_score": round(base_risk, 2),
-            "risk_level": "safe" if base_risk < 2.0 else "medium",
-            "factors": {
-                "incident_density": 0.0,
-                "recency": 0.0,
-                "severity": 0.0,
-                "time_pattern": round(current_time_factor, 3),
-                "current_time_factor": round(current_time_factor, 3),
-                "raw_incident_count": 0,
-                "effective_incident_count": 0.0,
-            },
-        }
-
-    weighted_severity = 0.0
-    # Distance+time weighted average recency (kept in [0,1])
-    weighted_recency_numer = 0.0
-    weighted_recency_denom = 0.0
-    total_weight = 0.0
-    effective_incident_count = 0.0
-
-    # Pre-filter to within radius_meters (matches original PostGIS query semantics)
-    nearby_incidents: List[Dict[str, Any]] = []
-    for inc in incidents:
-        try:
-            d_m = calculate_distance_haversine(lat, lng, inc["latitude"], inc["longitude"])
-            if d_m <= radius_meters:
-                nearby_incidents.append(inc)
-        except Exception:
-            continue
-
-    if not nearby_incidents:
-        # If nothing is within radius, fall back to time-only base risk
-        base_risk = current_time_factor * 1.5
-        return {
-            "risk_score": round(base_risk, 2),
-            "risk_level": "safe" if base_risk < 2.0 else "medium",
-            "factors": {
-                "incident_density": 0.0,
-                "recency": 0.0,
-                "severity": 0.0,
-                "time_pattern": round(current_time_factor, 3),
-                "current_time_factor": round(current_time_factor, 3),
-                "raw_incident_count": 0,
-                "effective_incident_count": 0.0,
-            },
-        }
-
-    for incident in nearby_incidents:
-        distance_meters = calculate_distance_haversine(
-            lat, lng, incident["latitude"], incident["longitude"]
-        )
-        distance_weight = math.exp(-distance_meters / 111.0)
-
-        # Timestamp parsing / normalization (timezone-aware)
-        incident_timestamp = incident["timestamp"]
-        if isinstance(incident_timestamp, datetime):
-            if incident_timestamp.tzinfo is None:
-                incident_timestamp = incident_timestamp.replace(tzinfo=timezone.utc)
-        elif isinstance(incident_timestamp, str):
-            incident_timestamp = datetime.fromisoformat(
-                incident_timestamp.replace("Z", "+00:00")
-            )
-        else:
-            continue
-
-        days_ago = (now - incident_timestamp).total_seconds() / 86400
-        recency_weight = calculate_recency_weight(days_ago)
-
-        # Time-of-day similarity: incidents that occurred around the current local time-of-day
-        # contribute more than incidents that happened at very different hours.
-        inc_hour_local = _incident_hour_local(incident)
-        if inc_hour_local is None:
-            inc_hour_local = query_local_hour
-        time_weight = _time_of_day_similarity_weight(query_local_hour, inc_hour_local)
-
-        weight = distance_weight * recency_weight * time_weight
-        effective_incident_count += recency_weight * time_weight
-
-        weighted_severity += incident["severity"] * weight
-        weighted_recency_numer += recency_weight * distance_weight * time_weight
-        weighted_recency_denom += distance_weight * time_weight
-        total_weight += weight
-
-    # Density (recency-aware effective count) with calibrated max
-    max_expected = max(1.0, float(getattr(settings, "max_expected_effective_incidents", 10.0)))
-    incident_density = (
-        math.log(effective_incident_count + 1) / math.log(max_expected + 1)
-        if effective_incident_count > 0
-        else 0.0
-    )
-    incident_density = max(0.0, min(1.0, incident_density))
+    # Cheap coordinate-only pre-filter so only nearby rows pay for full
+    # timestamp/hour decoding into columns.
+    try:
+        inc_lat = np.fromiter((inc["latitude"] for inc in incidents), dtype=np.float64, count=len(incidents))
+        inc_lng = np.fromiter((inc["longitude"] for inc in incidents), dtype=np.float64, count=len(incidents))
+        near = np.flatnonzero(risk_kernel.haversine_np(lat, lng, inc_lat, inc_lng) <= radius_meters)
+        incidents = [incidents[i] for i in near]
+    except Exception:
+        pass  # malformed rows: let incidents_to_columns drop them one by one
 
-    avg_recency = (
-        (weighted_recency_numer / weighted_recency_denom) if weighted_recency_denom > 0 else 0.0
+    return _calculate_risk_score_from_columns(
+        lat=lat,
+        lng=lng,
+        columns=risk_kernel.incidents_to_columns(incidents),
+        query_timestamp=query_timestamp,
+        local_hour=local_hour,
+        radius_meters=radius_meters,
     )
-    avg_severity = weighted_severity / total_weight if total_weight > 0 else 0.0
-    avg_severity = avg_severity / 5.0
-
-    # Time window matching (historical pattern near this location)
-    night_window = [21, 22, 23, 0, 1, 2, 3, 4]
-    evening_window = [18, 19, 20]
-    afternoon_window = [12, 13, 14, 15, 16, 17]
-    morning_window = [6, 7, 8, 9, 10, 11]
-
-    night_incidents = 0
-    evening_incidents = 0
-    afternoon_incidents = 0
-    morning_incidents = 0
-
-    for incident in nearby_incidents:
-        incident_hour = _incident_hour_local(incident)
-        if incident_hour is None:
-            continue
-
-        if incident_hour in night_window:
-            night_incidents += 1
-        elif incident_hour in evening_window:
-            evening_incidents += 1
-        elif incident_hour in afternoon_window:
-            afternoon_incidents += 1
-        elif incident_hour in morning_window:
-            morning_incidents += 1
-
-    pattern_counts = {
-        "night": night_incidents,
-        "evening": evening_incidents,
-        "afternoon": afternoon_incidents,
-        "morning": morning_incidents,
-    }
-    total_incidents_by_time = sum(pattern_counts.values())
-
-    if total_incidents_by_time > 0:
-        night_ratio = night_incidents / total_incidents_by_time
-        evening_ratio = evening_incidents / total_incidents_by_time
-        afternoon_ratio = afternoon_incidents / total_incidents_by_time
-        morning_ratio = morning_incidents / total_incidents_by_time
-
-        dominant_pattern = max(pattern_counts, key=pattern_counts.get)
-
-        current_hour_matches_pattern = False
-        match_strength = 0.0
-
-        if query_local_hour in night_window and dominant_pattern == "night":
-            current_hour_matches_pattern = True
-            match_strength = night_ratio
-        elif query_local_hour in evening_window and dominant_pattern == "evening":
-            current_hour_matches_pattern = True
-            match_strength = evening_ratio
-        elif query_local_hour in afternoon_window and dominant_pattern == "afternoon":
-            current_hour_matches_pattern = True
-            match_strength = afternoon_ratio
-        elif query_local_hour in morning_window and dominant_pattern == "morning":
-            current_hour_matches_pattern = True
-            match_strength = morning_ratio
-
-        location_time_pattern = current_time_factor
-        if current_hour_matches_pattern and match_strength > 0.5:
-            location_time_pattern = 0.9 + (match_strength * 0.1)
-        elif current_hour_matches_pattern and match_strength > 0.3:
-            location_time_pattern = 0.7 + (match_strength * 0.2)
-        elif current_hour_matches_pattern:
-            location_time_pattern = 0.5 + (match_strength * 0.2)
-        else:
-            location_time_pattern = current_time_factor * 0.6
-
-        time_pattern = (location_time_pattern * 0.7) + (current_time_factor * 0.3)
-    else:
-        time_pattern = current_time_factor
-
-    risk_score = (
-        settings.weight_incident_density * incident_density
-        + settings.weight_recency * avg_recency
-        + settings.weight_severity * avg_severity
-        + settings.weight_time_pattern * time_pattern
-    ) * 5.0
-    risk_score = max(0.0, min(5.0, risk_score))
-
-    if risk_score <= 1.0:
-        risk_level = "very_safe"
-    elif risk_score <= 2.0:
-        risk_level = "safe"
-    elif risk_score <= 3.0:
-        risk_level = "medium"
-    elif risk_score <= 4.0:
-        risk_level = "high"
-    else:
-        risk_level = "very_high"
-
-    return {
-        "risk_score": round(risk_score, 2),
-        "risk_level": risk_level,
-        "factors": {
-            "incident_density": round(incident_density, 3),
-            "recency": round(avg_recency, 3),
-            "severity": round(avg_severity, 3),
-            "time_pattern": round(time_pattern, 3),
-            "current_time_factor": round(current_time_factor, 3),
-            "raw_incident_count": len(nearby_incidents),
-            "effective_incident_count": round(effective_incident_count, 3),
-        },
-        "calculated_at": now.isoformat(),
-    }
-
-
-def calculate_risk_score(lat: float, lng: float, query_timestamp: Optional[datetime] = None, local_hour: Optional[int] = None) -> Dict:
+
+
+@metrics.instrumented("risk_scoring.calculate_risk_score", count_rows=False)
+def calculate_risk_score(
+    lat: float,
+    lng: float,
+    query_timestamp: Optional[datetime] = None,
+    local_hour: Optional[int] = None,
+    exact: bool = False,
+) -> Dict:
     """
     Calculate risk score for a specific location
     NOW SUPPORTS TIME-BASED RISK CALCULATION
     
+    Current-time queries are served from the per-cell risk cache
+    (app.ml.risk_cache), backed by the precomputed risk raster
+    (app.ml.risk_raster) or, outside its bounds, the decayed per-cell
+    aggregates (app.ml.aggregates). Historical queries, or any call with
+    exact=True, are scored from raw incidents.
+    
     Args:
         lat: Latitude
         lng: Longitude
         query_timestamp: Current time for time-based risk (default: now)
+        local_hour: LOCAL hour (0-23) for time-based risk (default: hour of query time)
+        exact: Skip the precomputed paths and score from raw incidents
         
     Returns:
         Dictionary with risk_score, risk_level, factors, etc.
     """
-    from app.db.storage import get_incidents_in_radius
-    incidents = get_incidents_in_radius(lat, lng, 1000)
-    return _calculate_risk_score_from_incidents(
+    if not exact and query_timestamp is None and settings.risk_cache_enabled:
+        from app.ml import risk_cache
+        hour = local_hour if local_hour is not None else datetime.now(timezone.utc).hour
+        return risk_cache.get_or_compute(
+            lat,
+            lng,
+            hour,
+            lambda c_lat, c_lng: _calculate_risk_score_uncached(c_lat, c_lng, None, hour, False),
+        )
+    return _calculate_risk_score_uncached(lat, lng, query_timestamp, local_hour, exact)
+
+
+def _calculate_risk_score_uncached(
+    lat: float,
+    lng: float,
+    query_timestamp: Optional[datetime],
+    local_hour: Optional[int],
+    exact: bool,
+) -> Dict:
+    """calculate_risk_score without the point cache"""
+    if not exact and query_timestamp is None:
+        hour = local_hour if local_hour is not None else datetime.now(timezone.utc).hour
+        if settings.risk_raster_enabled:
+            from app.ml.risk_raster import lookup_risk
+            risk_data = lookup_risk(lat, lng, hour)
+            if risk_data is not None:
+                return risk_data
+
+        from app.ml import aggregates
+        if aggregates.is_ready():
+            return aggregates.risk_for_point(lat, lng, hour)
+
+    from app.db.storage import get_incident_columns_in_radius
+    columns = get_incident_columns_in_radius(lat, lng, 1000)
+    return _calculate_risk_score_from_columns(
         lat=lat,
         lng=lng,
-        incidents=incidents,
+        columns=columns,
         query_timestamp=query_timestamp,
         local_hour=local_hour,
         radius_meters=1000.0,
     )
 
+
+@metrics.instrumented("risk_scoring.calculate_risk_scores", count_rows=False)
+def calculate_risk_scores(
+    points: List[Tuple[float, float, Optional[int]]],
+    query_timestamp: Optional[datetime] = None,
+) -> List[Dict]:
+    """
+    Calculate risk scores for many locations at once
+
+    All neighborhoods are fetched with one storage query and every point is
+    scored in a single vectorized pass.
+
+    Args:
+        points: List of (lat, lng, local_hour) tuples; local_hour may be None
+        query_timestamp: Current time for time-based risk (default: now)
+
+    Returns:
+        List of risk dictionaries (same shape as calculate_risk_score), in input order
+    """
+    if not points:
+        return []
+
+    from app.db.storage import get_incident_columns_near_points
+    columns = get_incident_columns_near_points([(p[0], p[1]) for p in points], 1000)
+
+    now = _query_now(query_timestamp)
+    with metrics.timed("risk_scoring.kernel") as stage:
+        scores = risk_kernel.score_points(
+            np.array([p[0] for p in points], dtype=np.float64),
+            np.array([p[1] for p in points], dtype=np.float64),
+            np.array([p[2] if p[2] is not None else now.hour for p in points], dtype=np.int64),
+            columns,
+            now_ts=now.timestamp(),
+            radius_meters=1000.0,
+        )
+        stage.rows = len(columns["lat"])
+        stage.cells = len(points)
+    return risk_kernel.result_dicts(scores, calculated_at=now.isoformat())
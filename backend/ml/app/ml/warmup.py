@@ -0,0 +1,344 @@
+"""
+Warm-up - precompute hot viewports after startup
+
+A fresh process pays the cold-start cost (snapshot pages, KD-tree, land
+mask, lazy imports, empty caches) on its first requests. A background
+thread started at startup instead walks a hot set of viewports and local
+hours and, for each one:
+
+- generates the /ml/heatmap response (waits for the pyramid first, so the
+  views are served from it),
+- renders the XYZ tiles covering the view at warmup_tile_zoom into the tile
+  cache (app.ml.heatmap_tiles),
+- scores the risk-cache cells within warmup_risk_radius of the center
+  (app.ml.risk_cache).
+
+The hot set is warmup_viewports plus, with warmup_from_history, the most
+requested /ml/heatmap views of previous runs: requests are counted per
+~500m center and saved to warmup_history_path on shutdown.
+
+GET /ml/ready reports progress and answers 503 until the hot set is warm,
+so load balancers only route traffic to warm instances.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.ml import risk_kernel
+from app.utils.geospatial import degree_window
+
+logger = logging.getLogger(__name__)
+
+# Request history: centers snapped to HISTORY_CELL_DEGREES (~500m)
+HISTORY_CELL_DEGREES = 0.005
+_MAX_HISTORY_KEYS = 2000
+# Counts loaded from a previous run are halved so old hot spots fade out
+_HISTORY_DECAY = 0.5
+
+# Viewport: (lat, lng, radius_m, grid_size_m)
+Viewport = Tuple[float, float, int, int]
+
+_history: Counter = Counter()
+_progress: Dict = {"state": "pending"}
+_lock = threading.Lock()
+_stop = threading.Event()
+_worker: Optional[threading.Thread] = None
+
+
+# ==================== Hot set ====================
+
+def parse_viewports(text: str) -> List[Viewport]:
+    """
+    Parse warmup_viewports ("lat,lng[,radius[,grid_size]]" separated by ";")
+
+    Malformed entries are logged and skipped.
+    """
+    viewports = []
+    for entry in (text or "").split(";"):
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            parts = [float(p) for p in entry.split(",")]
+            if len(parts) < 2 or len(parts) > 4:
+                raise ValueError("expected lat,lng[,radius[,grid_size]]")
+            radius = int(parts[2]) if len(parts) > 2 else int(settings.default_radius)
+            grid = int(parts[3]) if len(parts) > 3 else int(settings.default_grid_size)
+            viewports.append((parts[0], parts[1], radius, grid))
+        except ValueError as e:
+            logger.warning(f"Ignoring warm-up viewport {entry!r}: {e}")
+    return viewports
+
+
+def parse_hours(text: str) -> List[int]:
+    """Parse warmup_hours (comma-separated LOCAL hours; empty = current and next hour)"""
+    hours = []
+    for part in (text or "").split(","):
+        part = part.strip()
+        if part:
+            try:
+                hours.append(int(part) % 24)
+            except ValueError:
+                logger.warning(f"Ignoring warm-up hour {part!r}")
+    if not hours:
+        # Same fallback as the routes when no local hour is given
+        now_hour = datetime.now().hour
+        hours = [now_hour, (now_hour + 1) % 24]
+    return list(dict.fromkeys(hours))
+
+
+def record_request(lat: float, lng: float, radius_meters: int, grid_size_meters: int) -> None:
+    """Count a /ml/heatmap request towards the warm-up history"""
+    if not settings.warmup_from_history:
+        return
+    key = (
+        round(round(lat / HISTORY_CELL_DEGREES) * HISTORY_CELL_DEGREES, 6),
+        round(round(lng / HISTORY_CELL_DEGREES) * HISTORY_CELL_DEGREES, 6),
+        int(radius_meters),
+        int(grid_size_meters),
+    )
+    with _lock:
+        _history[key] += 1
+        if len(_history) > _MAX_HISTORY_KEYS:
+            kept = _history.most_common(_MAX_HISTORY_KEYS // 2)
+            _history.clear()
+            _history.update(dict(kept))
+
+
+def load_history() -> int:
+    """
+    Load request counts saved by a previous run
+
+    Returns:
+        Number of viewports loaded
+    """
+    path = settings.warmup_history_path
+    if not path or not os.path.exists(path):
+        return 0
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        loaded = Counter()
+        for entry in entries:
+            key = (float(entry["lat"]), float(entry["lng"]), int(entry["radius"]), int(entry["grid_size"]))
+            loaded[key] = float(entry["count"]) * _HISTORY_DECAY
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Failed to load warm-up history from {path}: {e}")
+        return 0
+    with _lock:
+        _history.update(loaded)
+    return len(loaded)
+
+
+def save_history() -> int:
+    """
+    Save the most requested viewports for the next run
+
+    Returns:
+        Number of viewports saved
+    """
+    path = settings.warmup_history_path
+    if not path or not settings.warmup_from_history:
+        return 0
+    with _lock:
+        top = _history.most_common(max(1, _MAX_HISTORY_KEYS // 10))
+    entries = [
+        {"lat": lat, "lng": lng, "radius": radius, "grid_size": grid, "count": count}
+        for (lat, lng, radius, grid), count in top
+    ]
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Failed to save warm-up history to {path}: {e}")
+        return 0
+    return len(entries)
+
+
+def hot_viewports() -> List[Viewport]:
+    """Configured viewports followed by the most requested ones (deduplicated)"""
+    viewports = parse_viewports(settings.warmup_viewports)
+    if settings.warmup_from_history:
+        with _lock:
+            top = _history.most_common(max(0, int(settings.warmup_history_top)))
+        viewports.extend(key for key, _ in top)
+    return list(dict.fromkeys(viewports))
+
+
+# ==================== Warm-up tasks ====================
+
+def _warm_heatmap(viewport: Viewport, hour: int) -> None:
+    from app.ml.heatmap import generate_heatmap
+
+    lat, lng, radius, grid = viewport
+    generate_heatmap(lat, lng, radius, grid, None, hour)
+
+
+def _warm_tiles(viewport: Viewport, hour: int) -> int:
+    from app.ml import heatmap_tiles
+
+    z = int(settings.warmup_tile_zoom)
+    if z <= 0 or z < settings.heatmap_tile_min_zoom:
+        return 0
+    z = min(z, heatmap_tiles.MAX_ZOOM)
+    lat, lng, radius, grid = viewport
+    dlat, dlng = degree_window(radius, lat)
+    x0, y0 = heatmap_tiles.tile_xy(lat + dlat, lng - dlng, z)
+    x1, y1 = heatmap_tiles.tile_xy(lat - dlat, lng + dlng, z)
+    n = 2 ** z
+    rendered = 0
+    for x in range(max(0, int(x0)), min(n - 1, int(x1)) + 1):
+        for y in range(max(0, int(y0)), min(n - 1, int(y1)) + 1):
+            heatmap_tiles.get_tile(z, x, y, hour, None)
+            rendered += 1
+    return rendered
+
+
+def _warm_risk_cache(viewport: Viewport, hour: int) -> int:
+    from app.ml import risk_cache
+    from app.ml.risk_scoring import calculate_risk_score
+
+    radius = float(settings.warmup_risk_radius)
+    if not settings.risk_cache_enabled or radius <= 0:
+        return 0
+    lat, lng, _, _ = viewport
+    dlat, dlng = degree_window(radius, lat)
+    i0, j0 = risk_cache.quantize(lat - dlat, lng - dlng)
+    i1, j1 = risk_cache.quantize(lat + dlat, lng + dlng)
+    scored = 0
+    for i in range(i0, i1 + 1):
+        for j in range(j0, j1 + 1):
+            c_lat, c_lng = risk_cache.cell_center((i, j))
+            if risk_kernel.haversine_np(lat, lng, c_lat, c_lng) <= radius:
+                calculate_risk_score(c_lat, c_lng, local_hour=hour)
+                scored += 1
+    return scored
+
+
+def _update(**fields) -> None:
+    with _lock:
+        _progress.update(fields)
+
+
+def _wait_for_pyramid() -> None:
+    from app.ml import heatmap_pyramid
+
+    if not settings.heatmap_pyramid_enabled:
+        return
+    deadline = time.monotonic() + max(0, int(settings.warmup_pyramid_wait_seconds))
+    while not heatmap_pyramid.is_ready() and time.monotonic() < deadline and not _stop.is_set():
+        _stop.wait(0.5)
+    if not heatmap_pyramid.is_ready():
+        logger.warning("Warm-up continuing without the heatmap pyramid (not built yet)")
+
+
+def run_warmup() -> Dict:
+    """
+    Warm the caches for every hot viewport and hour (blocking)
+
+    Returns:
+        Progress dictionary (see get_status)
+    """
+    viewports = hot_viewports()
+    hours = parse_hours(settings.warmup_hours)
+    started = time.perf_counter()
+    _update(
+        state="waiting",
+        viewports=len(viewports),
+        hours=hours,
+        tasks_total=len(viewports) * len(hours),
+        tasks_done=0,
+        tiles=0,
+        risk_cells=0,
+        errors=0,
+        started_at=datetime.now(timezone.utc).isoformat(),
+        finished_at=None,
+    )
+    _wait_for_pyramid()
+    _update(state="running")
+
+    done = tiles = risk_cells = errors = 0
+    for viewport in viewports:
+        for hour in hours:
+            if _stop.is_set():
+                _update(state="stopped")
+                return get_status()
+            try:
+                _warm_heatmap(viewport, hour)
+                tiles += _warm_tiles(viewport, hour)
+                risk_cells += _warm_risk_cache(viewport, hour)
+            except Exception as e:
+                errors += 1
+                logger.error(f"Warm-up failed for viewport {viewport} hour {hour}: {e}")
+            done += 1
+            _update(tasks_done=done, tiles=tiles, risk_cells=risk_cells, errors=errors)
+
+    elapsed = time.perf_counter() - started
+    _update(
+        state="ready",
+        finished_at=datetime.now(timezone.utc).isoformat(),
+        elapsed_seconds=round(elapsed, 3),
+    )
+    logger.info(
+        f"Warm-up done: {len(viewports)} viewports x {len(hours)} hours, {tiles} tiles, "
+        f"{risk_cells} risk cells, {errors} errors in {elapsed:.1f}s"
+    )
+    return get_status()
+
+
+def _run_worker() -> None:
+    try:
+        run_warmup()
+    except Exception as e:
+        # Never keep the instance out of rotation because warm-up broke
+        logger.error(f"Warm-up failed: {e}", exc_info=True)
+        _update(state="ready", error=str(e), finished_at=datetime.now(timezone.utc).isoformat())
+
+
+# ==================== Lifecycle ====================
+
+def start() -> None:
+    """Load the request history and start the warm-up thread (idempotent)"""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    if settings.warmup_from_history:
+        load_history()
+    if not settings.warmup_enabled:
+        _update(state="disabled")
+        return
+    _stop.clear()
+    _worker = threading.Thread(target=_run_worker, name="warmup", daemon=True)
+    _worker.start()
+
+
+def stop() -> None:
+    """Stop the warm-up thread and save the request history"""
+    global _worker
+    _stop.set()
+    if _worker is not None:
+        _worker.join(timeout=5)
+        _worker = None
+    save_history()
+
+
+def is_ready() -> bool:
+    with _lock:
+        return _progress.get("state") in ("ready", "disabled")
+
+
+def get_status() -> Dict:
+    with _lock:
+        status = dict(_progress)
+    status["ready"] = status.get("state") in ("ready", "disabled")
+    return status
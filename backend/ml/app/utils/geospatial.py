@@ -1,34 +1,86 @@
 """
 Geospatial utility functions
+
+Meter <-> degree conversions use a local equirectangular approximation:
+one degree of latitude is METERS_PER_DEG_LAT everywhere, one degree of
+longitude is METERS_PER_DEG_LAT * cos(lat). Accurate to well under 1% over
+the few kilometers the heatmap and scoring windows span.
 """
 
 import math
+from typing import Tuple
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEG_LAT = EARTH_RADIUS_M * math.pi / 180.0
+# Floor for cos(lat) so longitude spans stay finite near the poles
+MIN_COS_LAT = 0.01
 
 
 def meters_to_degrees(meters: float) -> float:
     """
-    Convert meters to degrees (approximate)
+    Convert a north-south distance in meters to degrees of latitude
     
     Args:
         meters: Distance in meters
         
     Returns:
-        Distance in degrees
+        Distance in degrees of latitude (use meters_to_lng_degrees for
+        east-west distances)
     """
-    return meters / 111000.0
+    return meters / METERS_PER_DEG_LAT
 
 
 def degrees_to_meters(degrees: float) -> float:
     """
-    Convert degrees to meters (approximate)
+    Convert degrees of latitude to meters
     
     Args:
-        degrees: Distance in degrees
+        degrees: Distance in degrees of latitude
         
     Returns:
         Distance in meters
     """
-    return degrees * 111000.0
+    return degrees * METERS_PER_DEG_LAT
+
+
+def meters_to_lng_degrees(meters: float, lat: float) -> float:
+    """
+    Convert an east-west distance in meters to degrees of longitude at a latitude
+    
+    Args:
+        meters: Distance in meters
+        lat: Latitude of the distance (degrees)
+        
+    Returns:
+        Distance in degrees of longitude
+    """
+    return meters / (METERS_PER_DEG_LAT * max(MIN_COS_LAT, math.cos(math.radians(lat))))
+
+
+def degree_window(meters: float, lat: float) -> Tuple[float, float]:
+    """
+    Half-widths (dlat, dlng) in degrees of a square window of +-meters around lat
+    
+    The longitude half-width uses the latitude edge closest to a pole, so the
+    window always contains the circle of radius meters.
+    """
+    dlat = meters_to_degrees(meters)
+    return dlat, meters_to_lng_degrees(meters, min(90.0, abs(lat) + dlat))
+
+
+def to_local_meters(lat, lng, lat0: float, lng0: float):
+    """
+    Equirectangular projection around (lat0, lng0)
+    
+    Works on floats or NumPy arrays.
+    
+    Returns:
+        (x east, y north) in meters
+    """
+    return (
+        (lng - lng0) * METERS_PER_DEG_LAT * math.cos(math.radians(lat0)),
+        (lat - lat0) * METERS_PER_DEG_LAT,
+    )
 
 
 def calculate_distance_haversine(
@@ -44,7 +96,7 @@ def calculate_distance_haversine(
     Returns:
         Distance in meters
     """
-    R = 6371000  # Earth radius in meters
+    R = EARTH_RADIUS_M
     
     dlat = math.radians(lat2 - lat1)
     dlng = math.radians(lng2 - lng1)
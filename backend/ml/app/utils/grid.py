@@ -0,0 +1,108 @@
+"""
+Global grid - stable cell addressing shared by heatmaps, caches and aggregates
+
+Cells are anchored at (0, 0) and sized in meters in one fixed
+equirectangular projection: one grid step is cell_meters north-south and
+cell_meters east-west at the reference latitude (grid_reference_lat,
+default the middle of the risk raster bounds), so cells are square in the
+served area. Cell (i, j) covers
+[i * dlat, (i + 1) * dlat) x [j * dlng, (j + 1) * dlng), independent of any
+request, so overlapping views share cells and their cached results.
+
+Heatmap cells come in levels: level 0 is heatmap_pyramid_base_cell_meters
+and every level doubles the cell size, so the parent of (i, j) at level k
+is (i >> 1, j >> 1) at level k + 1. A heatmap cell ID is "level:i:j"
+whether it comes from the pyramid or from on-demand scoring.
+"""
+
+import math
+from typing import Tuple, Union
+
+import numpy as np
+
+from app.config import settings
+from app.utils.geospatial import METERS_PER_DEG_LAT
+
+# Smallest cell size accepted (guards against zero / negative settings)
+MIN_CELL_METERS = 10.0
+
+
+def reference_latitude() -> float:
+    """Latitude (degrees) at which grid cells are square"""
+    if settings.grid_reference_lat is not None:
+        return float(settings.grid_reference_lat)
+    return (settings.risk_raster_lat_min + settings.risk_raster_lat_max) / 2.0
+
+
+def cell_degrees(cell_meters: float) -> Tuple[float, float]:
+    """(lat, lng) step in degrees for cells of cell_meters"""
+    cell_m = max(MIN_CELL_METERS, float(cell_meters))
+    return cell_m / METERS_PER_DEG_LAT, cell_m / (METERS_PER_DEG_LAT * math.cos(math.radians(reference_latitude())))
+
+
+def cell_size_meters(cell_meters: float, lat: float) -> Tuple[float, float]:
+    """(north-south, east-west) extent in meters of a cell at a latitude"""
+    cell_m = max(MIN_CELL_METERS, float(cell_meters))
+    scale = math.cos(math.radians(lat)) / math.cos(math.radians(reference_latitude()))
+    return cell_m, cell_m * scale
+
+
+def cell_index(lat: float, lng: float, cell_meters: float) -> Tuple[int, int]:
+    """Cell (i, j) containing (lat, lng)"""
+    dlat, dlng = cell_degrees(cell_meters)
+    return int(math.floor(lat / dlat)), int(math.floor(lng / dlng))
+
+
+def cell_indices(
+    lat: Union[np.ndarray, float], lng: Union[np.ndarray, float], cell_meters: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Vectorized cell_index"""
+    dlat, dlng = cell_degrees(cell_meters)
+    return (
+        np.floor(np.asarray(lat, dtype=np.float64) / dlat).astype(np.int64),
+        np.floor(np.asarray(lng, dtype=np.float64) / dlng).astype(np.int64),
+    )
+
+
+def cell_center(i: int, j: int, cell_meters: float) -> Tuple[float, float]:
+    dlat, dlng = cell_degrees(cell_meters)
+    return (i + 0.5) * dlat, (j + 0.5) * dlng
+
+
+# ==================== Heatmap levels ====================
+
+def base_cell_meters() -> float:
+    return max(MIN_CELL_METERS, float(settings.heatmap_pyramid_base_cell_meters))
+
+
+def num_levels() -> int:
+    return max(1, int(settings.heatmap_pyramid_levels))
+
+
+def level_cell_meters(level: int) -> float:
+    return base_cell_meters() * (2 ** level)
+
+
+def level_cell_degrees(level: int) -> Tuple[float, float]:
+    """(lat, lng) cell size in degrees at a level"""
+    return cell_degrees(level_cell_meters(level))
+
+
+def level_for_size(cell_meters: float) -> int:
+    """Finest level whose cells are at least cell_meters (capped at the coarsest level)"""
+    for level in range(num_levels()):
+        if level_cell_meters(level) >= cell_meters:
+            return level
+    return num_levels() - 1
+
+
+def view_level(radius_meters: float, grid_size_meters: float, max_cells: int) -> int:
+    """Finest level with cells >= grid_size_meters and at most ~max_cells in a view"""
+    return level_for_size(
+        max(float(grid_size_meters), 2.0 * float(radius_meters) / math.sqrt(max(1, max_cells)))
+    )
+
+
+def cell_id(level: int, i: int, j: int) -> str:
+    """Stable heatmap cell ID ("level:i:j")"""
+    return f"{level}:{i}:{j}"
@@ -0,0 +1,202 @@
+"""
+Lightweight in-process metrics (Prometheus text exposition)
+
+Per-stage latency histograms plus row / cell counters for the heatmap,
+risk scoring, route analysis, clustering and storage paths. Recording is
+a dict lookup, a bisect and a few additions under a lock, so it is cheap
+enough to leave on; set METRICS_ENABLED=false to make every call a no-op.
+
+Usage:
+    with metrics.timed("heatmap.fetch") as stage:
+        rows = get_incidents_in_radius(...)
+        stage.rows = len(rows)
+
+    @metrics.instrumented("storage.get_incidents")
+    def get_incidents(...): ...
+
+Exposed by GET /ml/metrics (render_prometheus).
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple
+
+from app.config import settings
+
+# Histogram bucket upper bounds (seconds)
+BUCKETS: Tuple[float, ...] = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+_HELP = {
+    "ml_stage_duration_seconds": ("histogram", "Latency of instrumented pipeline stages"),
+    "ml_stage_rows_total": ("counter", "Incident rows read or scored by a stage"),
+    "ml_stage_cells_total": ("counter", "Grid cells produced or scored by a stage"),
+    "ml_http_request_duration_seconds": ("histogram", "HTTP request latency including response serialization"),
+    "ml_risk_cache": ("gauge", "Risk score cache counters and size (see /ml/health)"),
+}
+
+# (metric, labels) -> [bucket counts..., +Inf count], sum
+_histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Dict] = {}
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_gauges: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    return bool(getattr(settings, "metrics_enabled", True))
+
+
+def _labels(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(metric: str, seconds: float, **labels: str) -> None:
+    """Record one latency observation"""
+    if not is_enabled():
+        return
+    key = (metric, _labels(labels))
+    idx = bisect_left(BUCKETS, seconds)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = {"buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0}
+        h["buckets"][idx] += 1
+        h["sum"] += seconds
+
+
+def inc(metric: str, value: float = 1.0, **labels: str) -> None:
+    """Increment a counter"""
+    if not is_enabled() or not value:
+        return
+    key = (metric, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def set_gauge(metric: str, value: float, **labels: str) -> None:
+    """Set a gauge to an absolute value"""
+    if not is_enabled():
+        return
+    with _lock:
+        _gauges[(metric, _labels(labels))] = float(value)
+
+
+def observe_stage(stage: str, seconds: float, rows: Optional[int] = None, cells: Optional[int] = None) -> None:
+    """Record a stage duration and optional row / cell counts"""
+    observe("ml_stage_duration_seconds", seconds, stage=stage)
+    if rows:
+        inc("ml_stage_rows_total", rows, stage=stage)
+    if cells:
+        inc("ml_stage_cells_total", cells, stage=stage)
+
+
+class timed:
+    """
+    Context manager timing one stage; set .rows / .cells inside the block
+
+    Exceptions propagate; the duration is still recorded.
+    """
+
+    __slots__ = ("stage", "rows", "cells", "_start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.rows: Optional[int] = None
+        self.cells: Optional[int] = None
+        self._start = 0.0
+
+    def __enter__(self) -> "timed":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        observe_stage(self.stage, time.perf_counter() - self._start, self.rows, self.cells)
+        return False
+
+
+def _result_rows(result) -> Optional[int]:
+    """Row count of a storage result (list of rows or kernel columns)"""
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict) and "lat" in result:
+        return len(result["lat"])
+    return None
+
+
+def instrumented(stage: str, count_rows: bool = True) -> Callable:
+    """Decorator form of timed(); counts returned rows for storage-style results"""
+
+    def decorator(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not is_enabled():
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            result = None
+            try:
+                result = fn(*args, **kwargs)
+                return result
+            finally:
+                rows = _result_rows(result) if count_rows else None
+                observe_stage(stage, time.perf_counter() - start, rows=rows)
+
+        return wrapper
+
+    return decorator
+
+
+def reset() -> None:
+    """Drop all recorded values"""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _gauges.clear()
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+def render_prometheus() -> str:
+    """All metrics in Prometheus text exposition format (version 0.0.4)"""
+    with _lock:
+        histograms = {k: {"buckets": list(v["buckets"]), "sum": v["sum"]} for k, v in _histograms.items()}
+        counters = dict(_counters)
+        counters.update(_gauges)
+
+    lines = []
+    names = sorted({k[0] for k in histograms} | {k[0] for k in counters})
+    for name in names:
+        kind, help_text = _HELP.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (metric, labels), h in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, n in zip(BUCKETS, h["buckets"]):
+                cumulative += n
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', repr(bound)),))} {cumulative}")
+            cumulative += h["buckets"][-1]
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {h['sum']!r}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,5 @@
+-- Persisted clusters: version stamp of the clustering run that wrote each zone
+ALTER TABLE unsafe_zones
+  ADD COLUMN IF NOT EXISTS version BIGINT DEFAULT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_zones_version ON unsafe_zones(version);
@@ -0,0 +1,34 @@
+"""
+Applies migration 004_unsafe_zones_version.sql (unsafe_zones.version, index on version).
+"""
+
+import psycopg2
+
+from app.config import settings
+
+
+def main() -> None:
+    conn = psycopg2.connect(
+        host=settings.db_host,
+        port=settings.db_port,
+        database=settings.db_name,
+        user=settings.db_user,
+        password=settings.db_password,
+        sslmode="require" if settings.db_ssl else "prefer",
+    )
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "ALTER TABLE unsafe_zones ADD COLUMN IF NOT EXISTS version BIGINT DEFAULT NULL"
+                )
+                cur.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_zones_version ON unsafe_zones(version)"
+                )
+        print("[OK] Migration 004 applied (unsafe_zones.version, idx_zones_version)")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Test script for the incremental decayed aggregates
+Checks aggregate scores against exact scoring, incremental adds and removals
+against a rebuild, incidents without timestamps, renormalization and the
+background rebuild of stale aggregates (no database needed, the incidents
+table is an in-memory list)
+"""
+
+import sys
+import os
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.config import settings
+from app.data.chennai_mock_data import generate_chennai_incidents
+from app.db import snapshot, storage
+from app.ml import aggregates, risk_kernel
+from app.ml.risk_scoring import calculate_risk_score
+from test_vectorized_scoring import _as_rows, _mock_store
+
+
+@contextmanager
+def _aggregated(table):
+    """Aggregates built over the table (reset afterwards)"""
+    with _mock_store(table):
+        try:
+            aggregates.rebuild_aggregates()
+            yield
+        finally:
+            with aggregates._lock:
+                aggregates._ready = False
+                aggregates._cells.clear()
+                aggregates._members.clear()
+
+
+def _random_points(rng, count):
+    return [(rng.uniform(12.95, 13.15), rng.uniform(80.15, 80.30), rng.randrange(24)) for _ in range(count)]
+
+
+def test_aggregates_match_exact_scoring():
+    """Cell-centroid approximation stays close to exact scoring"""
+    table = _as_rows(generate_chennai_incidents(count=3000, start_date_days_ago=180))
+    rng = random.Random(17)
+    now = datetime.now(timezone.utc)
+    with _aggregated(table):
+        errors = []
+        for lat, lng, hour in _random_points(rng, 300):
+            approx = aggregates.risk_for_point(lat, lng, hour, now)
+            exact = calculate_risk_score(lat, lng, query_timestamp=now, local_hour=hour, exact=True)
+            errors.append(abs(approx["risk_score"] - exact["risk_score"]))
+    assert np.mean(errors) < 0.05, np.mean(errors)
+    print(f"[OK] Aggregate scores match exact scoring (mean error {np.mean(errors):.3f}, "
+          f"max {np.max(errors):.3f})")
+
+
+def test_incremental_adds_match_rebuild():
+    """Listener updates (adds and removals) equal a rebuild over the same incidents"""
+    table = _as_rows(generate_chennai_incidents(count=2000, start_date_days_ago=180))
+    extra = _as_rows(generate_chennai_incidents(count=200, start_date_days_ago=30))
+    for k, incident in enumerate(extra):
+        incident["id"] = f"added-{k}"
+    rng = random.Random(19)
+    points = _random_points(rng, 100)
+    now_ts = datetime.now(timezone.utc).timestamp()
+    with _aggregated(table):
+        storage.register_change_listener(aggregates._on_incident_change)
+        try:
+            for incident in extra:
+                table.append(incident)
+                storage._notify_change("added", incident)
+            # Deleted by another process, announced by the snapshot reload
+            del table[:100]
+            snapshot.load_snapshot()
+            incremental = [aggregates.score_point(lat, lng, h, now_ts)["risk_score"][0] for lat, lng, h in points]
+            aggregates.rebuild_aggregates()
+            rebuilt = [aggregates.score_point(lat, lng, h, now_ts)["risk_score"][0] for lat, lng, h in points]
+        finally:
+            storage._change_listeners.remove(aggregates._on_incident_change)
+    assert np.allclose(incremental, rebuilt, atol=1e-6)
+    print(f"[OK] {len(extra)} incremental adds and 100 removals match a rebuild")
+
+
+def test_stale_aggregates_are_rebuilt():
+    """Writes this process was not notified of show up after aggregates_max_age_seconds"""
+    table = _as_rows(generate_chennai_incidents(count=1000, start_date_days_ago=90))
+    saved = settings.aggregates_max_age_seconds
+    with _aggregated(table):
+        try:
+            settings.aggregates_max_age_seconds = 1
+            # Written by another worker process: table only, no notification
+            table.append(dict(table[0], id="other-process", timestamp=datetime.now(timezone.utc)))
+            snapshot.load_snapshot()
+            assert aggregates.get_status()["incidents"] == len(table) - 1
+
+            aggregates._built_at -= 2
+            aggregates.score_point(13.08, 80.27, 12)
+            deadline = time.time() + 10
+            while aggregates._rebuilding and time.time() < deadline:
+                time.sleep(0.05)
+            assert aggregates.get_status()["incidents"] == len(table)
+        finally:
+            settings.aggregates_max_age_seconds = saved
+    print("[OK] Stale aggregates are rebuilt in the background")
+
+
+def test_undated_incidents_are_counted():
+    """Incidents without a timestamp count (raw count, pattern) exactly as in the kernel"""
+    table = _as_rows(generate_chennai_incidents(count=1000, start_date_days_ago=90))
+    undated = [dict(r, id=f"undated-{k}", timestamp=None) for k, r in enumerate(table[:200])]
+    now_ts = datetime.now(timezone.utc).timestamp()
+    with _aggregated(table):
+        with aggregates._lock:
+            for incident in undated:
+                aggregates._apply_added(incident)
+        # Radius covering every incident, so cell centroids do not matter
+        approx = aggregates.score_point(13.05, 80.22, 21, now_ts, radius_meters=100_000)
+    exact = risk_kernel.score_points(
+        [13.05], [80.22], [21], risk_kernel.incidents_to_columns(table + undated),
+        now_ts=now_ts, radius_meters=100_000,
+    )
+    assert approx["raw_incident_count"][0] == exact["raw_incident_count"][0] == len(table) + len(undated)
+    # Distance-free factors (recency and severity use cell centroids)
+    for key in ("time_pattern", "effective_incident_count"):
+        assert abs(approx[key][0] - exact[key][0]) <= 1e-6 * max(1.0, abs(exact[key][0])), key
+    print(f"[OK] {len(undated)} undated incidents counted like the kernel")
+
+
+def test_renormalization_keeps_scores():
+    """Moving t0 forward (query far past it) leaves scores unchanged"""
+    table = _as_rows(generate_chennai_incidents(count=1000, start_date_days_ago=90))
+    now_ts = datetime.now(timezone.utc).timestamp()
+    with _aggregated(table):
+        before = aggregates.score_point(13.08, 80.27, 21, now_ts)
+        t0 = aggregates._t0
+        aggregates.score_point(13.08, 80.27, 21, t0 + (aggregates._MAX_EXPONENT + 1) * aggregates._tau_s)
+        assert aggregates._t0 > t0
+        after = aggregates.score_point(13.08, 80.27, 21, now_ts)
+    for key, value in before.items():
+        assert np.allclose(after[key], value, rtol=1e-9), key
+    print("[OK] Renormalization keeps aggregate scores")
+
+
+if __name__ == "__main__":
+    test_aggregates_match_exact_scoring()
+    test_incremental_adds_match_rebuild()
+    test_stale_aggregates_are_rebuilt()
+    test_undated_incidents_are_counted()
+    test_renormalization_keeps_scores()
@@ -0,0 +1,226 @@
+"""
+Test script for haversine DBSCAN clustering
+Checks the labels against a projected-meters reference, checks incremental
+inserts against a full refit and that zone IDs do not depend on DBSCAN label
+numbers (no database needed); run as a script it also
+benchmarks the fit against the previous degree-space path
+"""
+
+import sys
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app'))
+
+from sklearn.cluster import DBSCAN
+
+from app.ml import clustering
+from app.ml.clustering import dbscan_labels
+from app.utils.geospatial import METERS_PER_DEG_LAT, to_local_meters
+
+# Hotspots (lat, lng, spread in meters)
+HOTSPOTS = [
+    (13.0827, 80.2707, 400.0),  # Central Station
+    (13.0475, 80.2825, 600.0),  # Marina Beach
+    (13.0710, 80.1980, 500.0),  # Koyambedu
+    (13.0067, 80.2206, 800.0),  # Adyar
+]
+
+
+def _synthetic_incidents(count, seed=7):
+    """Hotspot clusters plus uniform background over Chennai"""
+    rng = np.random.default_rng(seed)
+    n_hot = int(count * 0.6)
+    spot = rng.integers(0, len(HOTSPOTS), n_hot)
+    centers = np.array(HOTSPOTS)[spot]
+    lat = centers[:, 0] + rng.normal(0.0, 1.0, n_hot) * centers[:, 2] / METERS_PER_DEG_LAT
+    lng = centers[:, 1] + rng.normal(0.0, 1.0, n_hot) * centers[:, 2] / (
+        METERS_PER_DEG_LAT * np.cos(np.radians(centers[:, 0]))
+    )
+    n_bg = count - n_hot
+    lat = np.concatenate([lat, rng.uniform(12.85, 13.25, n_bg)])
+    lng = np.concatenate([lng, rng.uniform(80.10, 80.32, n_bg)])
+    return lat, lng
+
+
+def _synthetic_columns(count, seed=7):
+    """Incident columns (see risk_kernel.incidents_to_columns) for the synthetic incidents"""
+    lat, lng = _synthetic_incidents(count, seed)
+    rng = np.random.default_rng(seed + 1)
+    return {
+        "lat": lat,
+        "lng": lng,
+        "ts": time.time() - rng.uniform(0, 200 * 86400, count),
+        "hour": rng.integers(0, 24, count).astype(np.int8),
+        "severity": rng.integers(1, 6, count).astype(np.float64),
+    }
+
+
+def _same_partition(a, b):
+    """Labels describe the same clusters (up to renumbering)"""
+    if not np.array_equal(a == -1, b == -1):
+        return False
+    pairs = set(zip(a.tolist(), b.tolist()))
+    return len(pairs) == len(set(a.tolist())) == len(set(b.tolist()))
+
+
+def test_haversine_matches_projected_meters():
+    """Haversine DBSCAN finds the same clusters as DBSCAN on locally projected meters"""
+    lat, lng = _synthetic_incidents(5000)
+    labels = dbscan_labels(lat, lng, eps_m=100.0, min_samples=3)
+
+    x, y = to_local_meters(lat, lng, float(np.mean(lat)), float(np.mean(lng)))
+    reference = DBSCAN(eps=100.0, min_samples=3).fit_predict(np.column_stack((x, y)))
+
+    # Projection error over ~45km is far below the spacing that could flip a pair
+    agree = np.mean((labels == -1) == (reference == -1))
+    assert agree > 0.999, agree
+    print(f"[OK] Haversine labels agree with projected-meter labels on {agree:.4%} of incidents "
+          f"({len(set(labels.tolist())) - 1} clusters, same partition: {_same_partition(labels, reference)})")
+
+
+def test_incremental_matches_full_fit(base=20_000, added=2_000):
+    """Clusters maintained by incremental inserts equal a full refit over all incidents"""
+    lat, lng = _synthetic_incidents(base + added)
+    columns = {"lat": lat[:base], "lng": lng[:base], "ts": np.full(base, np.nan),
+               "hour": np.full(base, -1), "severity": np.zeros(base)}
+    model = clustering._new_model(columns, version=0)
+
+    t0 = time.perf_counter()
+    changed = 0
+    for k in range(base, base + added):
+        changed += len(clustering._insert(model, {"lat": float(lat[k]), "lng": float(lng[k])}))
+    insert_ms = (time.perf_counter() - t0) / added * 1000
+
+    n = model["n"]
+    labels, core = model["labels"][:n], model["core"][:n]
+    reference = clustering._dbscan(
+        np.radians(np.column_stack((lat, lng))), clustering.eps_meters(), model["min_samples"]
+    )
+    ref_core = np.zeros(n, dtype=bool)
+    ref_core[reference.core_sample_indices_] = True
+
+    # Core points and noise are unique; border points may join any adjacent cluster
+    assert np.array_equal(core, ref_core)
+    assert np.array_equal(labels == -1, reference.labels_ == -1)
+    assert _same_partition(labels[core], reference.labels_[core])
+    assert sum(len(m) for m in model["members"].values()) == int(np.sum(labels != -1))
+    print(f"[OK] {added} incremental inserts match a full refit ({len(model['members'])} clusters, "
+          f"{insert_ms:.2f}ms per insert, {changed} cluster changes)")
+
+
+def test_cluster_scores_match_point_scoring(count=20_000):
+    """Vectorized cluster scoring equals scoring each center on its own"""
+    from app.ml.risk_scoring import _calculate_risk_score_from_columns
+
+    columns = _synthetic_columns(count)
+    model = clustering._new_model(columns, version=0)
+    members = list(model["members"].values())[:200]
+    center_lat = np.array([np.mean(columns["lat"][m]) for m in members])
+    center_lng = np.array([np.mean(columns["lng"][m]) for m in members])
+
+    scores = clustering._score_centers(model, model["n"], center_lat, center_lng)
+    hour = datetime.now(timezone.utc).hour
+    for k in range(len(members)):
+        expected = _calculate_risk_score_from_columns(
+            lat=float(center_lat[k]), lng=float(center_lng[k]), columns=columns,
+            query_timestamp=None, local_hour=hour, radius_meters=1000.0,
+        )["risk_score"]
+        assert abs(scores[k] - expected) <= 0.011, (k, scores[k], expected)
+    print(f"[OK] {len(members)} cluster scores match per-center scoring")
+
+
+def _zone_ids(columns):
+    """Zone IDs of a fitted and summarized model (store disabled)"""
+    from app.config import settings
+
+    store = settings.cluster_store_enabled
+    settings.cluster_store_enabled = False
+    try:
+        model = clustering._new_model(columns, version=0)
+        clustering._refresh(model, replace=True)
+    finally:
+        settings.cluster_store_enabled = store
+    return {summary["id"] for summary in model["clusters"].values()}
+
+
+def test_zone_ids_are_stable(count=5000):
+    """Zone IDs come from cluster content, so another process (other label order) agrees"""
+    columns = _synthetic_columns(count)
+    ids = _zone_ids(columns)
+    order = np.random.default_rng(3).permutation(count)
+    shuffled = _zone_ids({key: value[order] for key, value in columns.items()})
+    assert ids and ids == shuffled, len(ids ^ shuffled)
+    assert all(i.startswith("zone_") for i in ids)
+    print(f"[OK] {len(ids)} zone IDs identical across fits with different label numbering")
+
+
+def test_reader_serves_persisted_zones():
+    """A process that lost the writer election reloads persisted zones and never fits"""
+    from app.db import storage
+
+    zone = {"id": "zone_0123456789abcdef", "center": {"lat": 13.08, "lng": 80.27},
+            "radius": 120.0, "risk_score": 3.2, "incident_count": 9}
+    patched = {
+        "try_acquire_zone_writer_lock": lambda: False,
+        "load_unsafe_zones": lambda: (42, [zone]),
+        "get_incident_columns_at_version": lambda: (_ for _ in ()).throw(AssertionError("reader fitted")),
+    }
+    saved = {name: getattr(storage, name) for name in patched}
+    for name, fn in patched.items():
+        setattr(storage, name, fn)
+    clustering._role = "reader"
+    try:
+        assert clustering.get_clusters() == [zone]
+        clustering._on_incident_change("added", {"id": "1", "latitude": 13.08, "longitude": 80.27})
+        assert clustering.get_clusters(force_recalculate=True) == [zone]
+        assert clustering._model is None
+    finally:
+        for name, fn in saved.items():
+            setattr(storage, name, fn)
+        clustering._role = None
+        clustering._persisted = None
+    print("[OK] reader served the persisted zones without fitting")
+
+
+def clustering_benchmark(count=100_000):
+    """Fit time of the previous path (euclidean on degrees) vs haversine ball tree"""
+    lat, lng = _synthetic_incidents(count)
+    eps_m = 0.001 * METERS_PER_DEG_LAT
+
+    t0 = time.perf_counter()
+    old = DBSCAN(eps=0.001, min_samples=3, metric='euclidean').fit_predict(np.column_stack((lat, lng)))
+    old_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    new = dbscan_labels(lat, lng, eps_m=eps_m, min_samples=3)
+    new_s = time.perf_counter() - t0
+
+    print(f"{count} incidents, eps={eps_m:.0f}m")
+    print(f"Euclidean on degrees: {old_s:.2f}s, {len(set(old.tolist())) - 1} clusters, {np.sum(old == -1)} noise")
+    print(f"Haversine ball tree:  {new_s:.2f}s, {len(set(new.tolist())) - 1} clusters, {np.sum(new == -1)} noise")
+
+    # Fit with incremental state, then score every cluster in one pass
+    columns = _synthetic_columns(count)
+    t0 = time.perf_counter()
+    model = clustering._new_model(columns, version=0)
+    fit_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    centers = [(np.mean(columns["lat"][m]), np.mean(columns["lng"][m])) for m in model["members"].values()]
+    clustering._score_centers(
+        model, model["n"], np.array([c[0] for c in centers]), np.array([c[1] for c in centers])
+    )
+    score_s = time.perf_counter() - t0
+    print(f"Model fit: {fit_s:.2f}s, scoring {len(centers)} clusters: {score_s:.2f}s")
+
+
+if __name__ == "__main__":
+    test_haversine_matches_projected_meters()
+    test_incremental_matches_full_fit()
+    test_cluster_scores_match_point_scoring()
+    test_zone_ids_are_stable()
+    test_reader_serves_persisted_zones()
+    clustering_benchmark()
@@ -0,0 +1,49 @@
+"""
+Test script for the shared heatmap cell cache
+Two overlapping current-time /ml/heatmap requests: the second one is served
+from the cells scored by the first (no database needed, incidents come from
+an in-memory snapshot)
+"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app'))
+
+from fastapi.testclient import TestClient
+
+from app.data.chennai_mock_data import generate_chennai_incidents
+from app.main import app
+from app.utils import metrics
+from test_vectorized_scoring import _as_rows, _mock_store
+
+
+def _cache_count(result):
+    return metrics._counters.get(("ml_heatmap_cell_cache_total", (("result", result),)), 0)
+
+
+def test_overlapping_heatmaps_hit_cell_cache():
+    """The routes pass the current time as timestamp; cells are still shared"""
+    rows = _as_rows(generate_chennai_incidents(count=2000, start_date_days_ago=90))
+    with _mock_store(rows):
+        _request_overlapping_views()
+
+
+def _request_overlapping_views():
+    # No startup events without a context manager: pyramid not built
+    client = TestClient(app)
+    params = {"lat": 13.0827, "lng": 80.2707, "radius": 1500, "grid_size": 100, "local_hour": 21}
+    first = client.get("/ml/heatmap", params=params)
+    assert first.status_code == 200, first.text
+    hits = _cache_count("hit")
+
+    # Shifted ~200m: most cells of the second view were scored by the first
+    second = client.get("/ml/heatmap", params={**params, "lat": 13.0845})
+    assert second.status_code == 200, second.text
+    assert _cache_count("hit") > hits, (hits, _cache_count("hit"))
+    print(f"[OK] Overlapping heatmaps: {_cache_count('hit') - hits} cells from the cell cache, "
+          f"{_cache_count('miss')} scored")
+
+
+if __name__ == "__main__":
+    test_overlapping_heatmaps_hit_cell_cache()
@@ -0,0 +1,162 @@
+"""
+Test script for incremental heatmap deltas
+Applies /heatmap/delta results to an earlier heatmap and compares them with
+a fresh one; checks log truncation and tokens from other processes (no
+database needed, the incidents table is an in-memory list)
+"""
+
+import sys
+import os
+import math
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.config import settings
+from app.data.chennai_mock_data import generate_chennai_incidents
+from app.db import storage
+from app.ml import heatmap_delta, heatmap_pyramid
+from app.ml.heatmap import MAX_HEATMAP_CELLS, generate_heatmap
+from app.ml.risk_kernel import haversine_np
+from app.utils.geospatial import METERS_PER_DEG_LAT
+from test_vectorized_scoring import _as_rows, _mock_store
+
+VIEW = {"center_lat": 13.0827, "center_lng": 80.2707, "radius_meters": 3000, "grid_size_meters": 200}
+HOUR = 21
+
+
+@contextmanager
+def _pyramid(table):
+    """Pyramid and delta log over the table, kept current by write notifications"""
+    with _mock_store(table):
+        heatmap_pyramid.build_pyramid()
+        heatmap_delta.start()
+        storage.register_change_listener(heatmap_pyramid._on_incident_change)
+        try:
+            yield
+        finally:
+            storage._change_listeners.remove(heatmap_pyramid._on_incident_change)
+            storage._change_listeners.remove(heatmap_delta._on_incident_change)
+            with heatmap_pyramid._lock:
+                heatmap_pyramid._levels = None
+                heatmap_pyramid._dirty_points.clear()
+            with heatmap_delta._lock:
+                heatmap_delta._log.clear()
+                heatmap_delta._floor_version = None
+
+
+def _heatmap():
+    # Applied by the background worker in the service
+    heatmap_pyramid.refresh_dirty()
+    return generate_heatmap(**VIEW, local_hour=HOUR)
+
+
+def _add(table, template, lat, lng, suffix):
+    incident = dict(template, id=f"added-{suffix}", latitude=lat, longitude=lng,
+                    timestamp=datetime.now(timezone.utc))
+    table.append(incident)
+    storage._notify_change("added", incident)
+
+
+def _delta(since):
+    return heatmap_delta.get_delta(
+        since, VIEW["center_lat"], VIEW["center_lng"], VIEW["radius_meters"], VIEW["grid_size_meters"], HOUR
+    )
+
+
+def _patched(cells, delta):
+    """Client-side application of a delta"""
+    by_id = {c["id"]: c for c in cells}
+    for cell in delta["added"] + delta["changed"]:
+        by_id[cell["id"]] = cell
+    for cell_id in delta["removed"]:
+        by_id.pop(cell_id, None)
+    return by_id
+
+
+def _assert_same_cells(patched, fresh):
+    fresh = {c["id"]: c for c in fresh}
+    assert set(patched) == set(fresh), (set(patched) ^ set(fresh))
+    for cell_id, cell in fresh.items():
+        assert patched[cell_id]["incident_count"] == cell["incident_count"], cell_id
+        assert abs(patched[cell_id]["risk_score"] - cell["risk_score"]) <= 0.011, cell_id
+
+
+def _edge_cell(level):
+    """Points of one view cell square east of the center: just inside and outside the view"""
+    dlat, dlng = heatmap_pyramid.level_cell_degrees(level)
+    lat = VIEW["center_lat"]
+    m_per_deg_lng = METERS_PER_DEG_LAT * math.cos(math.radians(lat))
+    for outside_m in range(60, 400, 20):
+        lng_out = VIEW["center_lng"] + (VIEW["radius_meters"] + outside_m) / m_per_deg_lng
+        lng_in = math.floor(lng_out / dlng) * dlng + 1e-6
+        if haversine_np(lat, VIEW["center_lng"], lat, lng_in) < VIEW["radius_meters"] - 20:
+            return (lat, lng_in), (lat, lng_out)
+    raise AssertionError("no edge cell")
+
+
+def test_delta_matches_fresh_heatmap():
+    """Earlier heatmap + delta equals a fresh heatmap (added, changed and removed cells)"""
+    table = _as_rows(generate_chennai_incidents(count=3000, start_date_days_ago=90))
+    with _pyramid(table):
+        # A cell on the edge of the view (centroid inside)
+        level = heatmap_pyramid.choose_level(VIEW["radius_meters"], VIEW["grid_size_meters"], MAX_HEATMAP_CELLS)
+        inside, outside = _edge_cell(level)
+        _add(table, table[0], *inside, "edge")
+        before = _heatmap()
+        assert before["version"] is not None and before["level"] == level
+        edge = next(c for c in before["cells"] if c["id"] == heatmap_pyramid.cell_id(
+            level, *(int(math.floor(v / d)) for v, d in zip(inside, heatmap_pyramid.level_cell_degrees(level)))))
+
+        # New cells in an empty corner of the view, more incidents in busy ones
+        offset = 0.8 * VIEW["radius_meters"] / METERS_PER_DEG_LAT / math.sqrt(2)
+        _add(table, table[0], VIEW["center_lat"] - offset, VIEW["center_lng"] - offset, "corner")
+        for k, cell in enumerate(before["cells"][:5]):
+            _add(table, table[0], cell["lat"], cell["lng"], f"busy-{k}")
+
+        # Incidents just outside the view pull the edge cell's centroid out of it
+        for k in range(10 * edge["incident_count"]):
+            _add(table, table[0], *outside, f"outside-{k}")
+
+        delta = _delta(before["version"])
+        assert not delta["full_refresh"], delta
+        assert delta["added"] and delta["changed"] and edge["id"] in delta["removed"], delta["removed"]
+        after = _heatmap()
+        assert delta["version"] == after["version"]
+        _assert_same_cells(_patched(before["cells"], delta), after["cells"])
+
+        # Nothing written since: empty delta
+        empty = _delta(after["version"])
+        assert not empty["full_refresh"] and not (empty["added"] or empty["changed"] or empty["removed"])
+    print(f"[OK] Heatmap + delta equals a fresh heatmap ({len(delta['added'])} added, "
+          f"{len(delta['changed'])} changed, {len(delta['removed'])} removed)")
+
+
+def test_delta_full_refresh():
+    """Truncated log, unknown versions and tokens of other processes need a full refresh"""
+    table = _as_rows(generate_chennai_incidents(count=1000, start_date_days_ago=90))
+    saved = settings.heatmap_delta_log_size
+    with _pyramid(table):
+        try:
+            settings.heatmap_delta_log_size = 5
+            before = _heatmap()
+            for k in range(10):
+                _add(table, table[0], VIEW["center_lat"], VIEW["center_lng"], k)
+            assert _delta(before["version"])["reason"] == "log_truncated"
+            current = _heatmap()["version"]
+            assert not _delta(current)["full_refresh"]
+
+            epoch, _, version = current.partition(".")
+            assert _delta(f"{epoch}.{int(version) + 1}")["reason"] == "unknown_version"
+            # Same number, issued by another worker process
+            assert _delta(f"other.{version}")["reason"] == "other_process"
+            assert _delta(version)["reason"] == "other_process"
+        finally:
+            settings.heatmap_delta_log_size = saved
+    print("[OK] Delta answers full_refresh for truncated logs and foreign versions")
+
+
+if __name__ == "__main__":
+    test_delta_matches_fresh_heatmap()
+    test_delta_full_refresh()
@@ -0,0 +1,88 @@
+"""
+Test script for the binary heatmap encodings
+Round-trips heatmap columns through the packed encoding and checks rejected
+payloads (no database needed)
+"""
+
+import sys
+import os
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.ml import heatmap_encoding, risk_kernel
+
+
+def _heatmap(n, seed=23):
+    """heatmap_columns()-shaped result with random cells"""
+    rng = np.random.default_rng(seed)
+    last = time.time() - rng.uniform(0, 200 * 86400, n)
+    last[rng.random(n) < 0.1] = np.nan  # unknown
+    return {
+        "center": {"lat": 13.0827, "lng": 80.2707},
+        "radius": 5000,
+        "grid_size": 100,
+        "local_hour": 21,
+        "columns": {
+            "lat": rng.uniform(13.03, 13.13, n),
+            "lng": rng.uniform(80.22, 80.32, n),
+            "risk_score": np.round(rng.uniform(0, 5, n), 2),
+            "risk_level": rng.integers(0, len(risk_kernel.RISK_LEVELS), n).astype(np.uint8),
+            "incident_count": rng.integers(0, 500, n),
+            "last_incident": last,
+        },
+    }
+
+
+def test_packed_round_trip():
+    """decode_packed(encode_packed(x)) returns x at the encoded precision"""
+    for n in (0, 1, 2500):
+        heatmap = _heatmap(n)
+        payload = heatmap_encoding.encode_packed(heatmap)
+        assert len(payload) == heatmap_encoding.HEADER.size + n * (4 * 5 + 1)
+        decoded = heatmap_encoding.decode_packed(payload)
+
+        assert decoded["center"] == heatmap["center"]
+        assert decoded["radius"] == heatmap["radius"] and decoded["grid_size"] == heatmap["grid_size"]
+        assert decoded["local_hour"] == heatmap["local_hour"]
+        cols, got = heatmap["columns"], decoded["columns"]
+        # float32 keeps ~1m at these coordinates
+        assert np.allclose(got["lat"], cols["lat"], atol=1e-5)
+        assert np.allclose(got["lng"], cols["lng"], atol=1e-5)
+        assert np.allclose(got["risk_score"], cols["risk_score"], atol=1e-6)
+        assert np.array_equal(got["risk_level"], cols["risk_level"])
+        assert np.array_equal(got["incident_count"], cols["incident_count"])
+        known = np.isfinite(cols["last_incident"])
+        assert np.array_equal(got["last_incident"][known], cols["last_incident"][known].astype(np.uint32))
+        assert not got["last_incident"][~known].any()
+    print("[OK] Packed heatmap encoding round-trips")
+
+
+def test_packed_rejects_bad_payloads():
+    """Truncated payloads and unknown magic / versions raise ValueError"""
+    payload = heatmap_encoding.encode_packed(_heatmap(10))
+    for bad in (payload[:10], payload[:-1], b"XXXX" + payload[4:], payload[:4] + bytes([99]) + payload[5:]):
+        try:
+            heatmap_encoding.decode_packed(bad)
+        except ValueError:
+            continue
+        raise AssertionError("bad payload accepted")
+    print("[OK] Bad packed payloads are rejected")
+
+
+def test_negotiate():
+    """Accept header picks the binary encoding, JSON otherwise"""
+    assert heatmap_encoding.negotiate(None) is None
+    assert heatmap_encoding.negotiate("application/json") is None
+    assert heatmap_encoding.negotiate("application/json, application/x-heatmap-columns;q=0.9") == \
+        heatmap_encoding.PACKED_MEDIA_TYPE
+    assert heatmap_encoding.negotiate("application/msgpack") == heatmap_encoding.MSGPACK_MEDIA_TYPE
+    print("[OK] Accept header negotiation")
+
+
+if __name__ == "__main__":
+    test_packed_round_trip()
+    test_packed_rejects_bad_payloads()
+    test_negotiate()
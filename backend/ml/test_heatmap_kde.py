@@ -0,0 +1,80 @@
+"""
+Test script for the KDE heatmap mode
+Compares FFT-convolution scores with exact kernel scoring on a small grid
+and checks the cell payload and clusters match the incident-cell path
+(no database needed)
+"""
+
+import sys
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.data.chennai_mock_data import generate_chennai_incidents
+from app.ml import clustering, risk_kernel
+from app.ml.heatmap_kde import generate_kde_heatmap
+from app.ml.risk_kernel import SCORING_RADIUS_M
+from test_vectorized_scoring import _as_rows, _mock_store
+
+CENTER = (13.0827, 80.2707)
+HOUR = 21
+
+
+def test_kde_matches_exact():
+    """KDE cell scores stay close to exact scoring at the cell centers"""
+    rows = _as_rows(generate_chennai_incidents(count=3000, start_date_days_ago=180))
+    now = datetime.now(timezone.utc)
+    with _mock_store(rows):
+        heatmap = generate_kde_heatmap(CENTER[0], CENTER[1], 1500, 150, now, HOUR)
+
+    cells = heatmap["cells"]
+    assert heatmap["mode"] == "kde" and cells
+    lat = np.array([c["lat"] for c in cells])
+    lng = np.array([c["lng"] for c in cells])
+    exact = risk_kernel.score_points(
+        lat, lng, np.full(lat.shape[0], HOUR), risk_kernel.incidents_to_columns(rows),
+        now_ts=now.timestamp(), radius_meters=SCORING_RADIUS_M,
+    )
+    error = np.abs(np.array([c["risk_score"] for c in cells]) - exact["risk_score"])
+    # Incidents are snapped to the raster: a few cells near the 1km edge of an
+    # incident gain or lose it, everything else agrees closely
+    assert error.mean() <= 0.05, error.mean()
+    assert np.percentile(error, 90) <= 0.15, np.percentile(error, 90)
+    print(f"[OK] {len(cells)} KDE cells vs exact: mean error {error.mean():.3f}, max {error.max():.2f}")
+
+
+def test_kde_cells_and_clusters():
+    """incident_count/last_incident come from the raw incidents; include_clusters is honored"""
+    rows = _as_rows(generate_chennai_incidents(count=3000, start_date_days_ago=180))
+    zone = {"id": "zone-1", "center": {"lat": CENTER[0], "lng": CENTER[1]}, "radius": 250.0,
+            "risk_score": 3.5, "incident_count": 12}
+    get_clusters = clustering.get_clusters_in_radius
+    clustering.get_clusters_in_radius = lambda lat, lng, radius: [dict(zone, extra="dropped")]
+    try:
+        with _mock_store(rows):
+            plain = generate_kde_heatmap(CENTER[0], CENTER[1], 1500, 150, None, HOUR)
+            with_clusters = generate_kde_heatmap(CENTER[0], CENTER[1], 1500, 150, None, HOUR, include_clusters=True)
+    finally:
+        clustering.get_clusters_in_radius = get_clusters
+
+    assert plain["clusters"] == []
+    assert with_clusters["clusters"] == [zone]
+
+    raw_timestamps = {r["timestamp"] for r in rows}
+    busy = [c for c in plain["cells"] if c["incident_count"]]
+    assert busy
+    for cell in plain["cells"]:
+        if cell["incident_count"]:
+            # The incident's own timestamp, kept as-is like heatmap.cell_dict
+            assert cell["last_incident"] in raw_timestamps
+        else:
+            assert cell["last_incident"] is None
+    print(f"[OK] {len(busy)} incident cells report raw last_incident; clusters included on request")
+
+
+if __name__ == "__main__":
+    test_kde_matches_exact()
+    test_kde_cells_and_clusters()
@@ -0,0 +1,138 @@
+"""
+Test script for the in-process incident snapshot
+Checks radius and bounding-box queries against the database path after
+incident writes, writes landing during a reload and writes made by other
+processes (no database needed, the incidents table is an in-memory list)
+"""
+
+import sys
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.data.chennai_mock_data import generate_chennai_incidents
+from app.db import snapshot, storage
+from app.ml.risk_kernel import haversine_np
+from test_vectorized_scoring import _as_rows, _mock_store, _select
+
+
+def _write(table, event, incident):
+    """Apply a write to the table and notify the store (as storage.add_incident does)"""
+    if event == "added":
+        table.append(dict(incident))
+    else:
+        row = next(r for r in table if r["id"] == incident["id"])
+        row["verified"] = incident["verified"]
+        row["moderation_reason"] = incident.get("moderation_reason")
+    storage._notify_change(event, incident)
+
+
+def _ids(rows):
+    return [r["id"] for r in rows]
+
+
+def _random_writes(table, rng, count):
+    now = datetime.now(timezone.utc)
+    for k in range(count):
+        incident = dict(table[rng.randrange(len(table))], id=f"added-{k}")
+        incident["latitude"] += rng.uniform(-0.01, 0.01)
+        incident["longitude"] += rng.uniform(-0.01, 0.01)
+        incident["timestamp"] = now - timedelta(minutes=k)
+        _write(table, "added", incident)
+        target = table[rng.randrange(len(table))]
+        _write(table, "verification", {"id": target["id"], "verified": not target["verified"],
+                                       "moderation_reason": "review"})
+
+
+def test_queries_match_database_after_writes():
+    """Snapshot radius / bbox results equal the table after adds and verifications"""
+    table = _as_rows(generate_chennai_incidents(count=3000, start_date_days_ago=180))
+    rng = random.Random(11)
+    with _mock_store(table):
+        # Past the merge threshold, so both the index and the append buffer are hit
+        _random_writes(table, rng, 400)
+        assert snapshot.get_count() == len(table)
+
+        now = datetime.now(timezone.utc)
+        for _ in range(30):
+            lat, lng = rng.uniform(12.95, 13.15), rng.uniform(80.15, 80.30)
+            radius = rng.choice([300.0, 1000.0, 3000.0])
+            got = storage.get_incidents_in_radius(lat, lng, radius)
+            lats = np.array([r["latitude"] for r in table])
+            lngs = np.array([r["longitude"] for r in table])
+            inside = haversine_np(lat, lng, lats, lngs) <= radius
+            assert sorted(_ids(got)) == sorted(r["id"] for r, hit in zip(table, inside) if hit)
+
+            bounds = dict(lat_min=lat - 0.02, lat_max=lat + 0.02, lng_min=lng - 0.02, lng_max=lng + 0.02,
+                          start_time=now - timedelta(days=rng.uniform(1, 60)), end_time=now)
+            got = storage.get_incidents(**bounds)
+            expected = _select(table, **bounds)
+            assert _ids(got) == _ids(expected)
+            by_id = {r["id"]: r for r in got}
+            assert all(by_id[r["id"]]["verified"] == r["verified"] for r in expected)
+    print("[OK] Snapshot radius and bbox queries match the table after 800 writes")
+
+
+def test_writes_during_reload_are_kept():
+    """Writes applied while a reload queries the database survive the swap"""
+    table = _as_rows(generate_chennai_incidents(count=1000, start_date_days_ago=90))
+    late = dict(table[0], id="late", timestamp=datetime.now(timezone.utc))
+    with _mock_store(table):
+        query_incidents = storage._query_incidents
+
+        def slow_query(*args, **kwargs):
+            rows = query_incidents(*args, **kwargs)
+            # Committed after the reload's SELECT ran
+            _write(table, "added", late)
+            _write(table, "verification", {"id": table[1]["id"], "verified": not table[1]["verified"]})
+            return rows
+
+        storage._query_incidents = slow_query
+        try:
+            snapshot.load_snapshot()
+        finally:
+            storage._query_incidents = query_incidents
+
+        assert snapshot.get_count() == len(table)
+        got = {r["id"]: r for r in storage.get_incidents()}
+        assert "late" in got
+        assert got[table[1]["id"]]["verified"] == table[1]["verified"]
+    print("[OK] Writes during a snapshot reload are replayed onto the new snapshot")
+
+
+def test_reload_announces_other_process_writes():
+    """A reload notifies the rows other processes added, re-verified or deleted"""
+    table = _as_rows(generate_chennai_incidents(count=1000, start_date_days_ago=90))
+    seen = []
+    listener = lambda event, incident: seen.append((event, incident["id"]))
+    storage.register_change_listener(listener)
+    try:
+        with _mock_store(table):
+            # Written straight to the table: no notification in this process
+            table.append(dict(table[0], id="elsewhere", timestamp=datetime.now(timezone.utc)))
+            table[1]["verified"] = not table[1]["verified"]
+            deleted = table.pop(2)
+            # Written by this process: already applied, not announced again
+            _write(table, "added", dict(table[3], id="local", timestamp=datetime.now(timezone.utc)))
+            seen.clear()
+
+            version = storage.get_data_version()
+            snapshot.load_snapshot()
+            assert sorted(seen) == sorted([
+                ("added", "elsewhere"), ("verification", table[1]["id"]), ("removed", deleted["id"]),
+            ]), seen
+            assert storage.get_data_version() == version + 3
+            assert snapshot.get_count() == len(table)
+    finally:
+        storage._change_listeners.remove(listener)
+    print("[OK] Snapshot reload announces writes made by other processes")
+
+
+if __name__ == "__main__":
+    test_queries_match_database_after_writes()
+    test_writes_during_reload_are_kept()
+    test_reload_announces_other_process_writes()
@@ -0,0 +1,59 @@
+"""
+Test script for process-pool heatmap scoring
+Checks that the tiled shared-memory path returns exactly the serial scores
+(no database needed)
+"""
+
+import sys
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.config import settings
+from app.data.chennai_mock_data import generate_chennai_incidents
+from app.ml import parallel_scoring, risk_kernel
+from app.ml.risk_kernel import SCORING_RADIUS_M
+from test_vectorized_scoring import _as_rows
+
+
+def test_parallel_matches_serial(workers=2):
+    """score_points_parallel equals risk_kernel.score_points in cell order"""
+    incidents = _as_rows(generate_chennai_incidents(count=5000, start_date_days_ago=180))
+    columns = risk_kernel.incidents_to_columns(incidents)
+    rng = np.random.default_rng(29)
+    # Dense center plus sparse outskirts, so tiles differ in size
+    cell_lat = np.concatenate([rng.uniform(13.05, 13.10, 3000), rng.uniform(12.90, 13.25, 1000)])
+    cell_lng = np.concatenate([rng.uniform(80.24, 80.29, 3000), rng.uniform(80.10, 80.32, 1000)])
+    now_ts = datetime.now(timezone.utc).timestamp()
+    hour = 21
+
+    saved = settings.heatmap_parallel_workers
+    settings.heatmap_parallel_workers = workers
+    try:
+        t0 = time.perf_counter()
+        parallel = parallel_scoring.score_points_parallel(cell_lat, cell_lng, hour, columns, now_ts)
+        parallel_s = time.perf_counter() - t0
+    finally:
+        parallel_scoring.shutdown()
+        settings.heatmap_parallel_workers = saved
+
+    t0 = time.perf_counter()
+    serial = risk_kernel.score_points(
+        cell_lat, cell_lng, np.full(cell_lat.shape[0], hour), columns,
+        now_ts=now_ts, radius_meters=SCORING_RADIUS_M,
+    )
+    serial_s = time.perf_counter() - t0
+
+    assert set(parallel) == set(serial)
+    for key, values in serial.items():
+        assert np.allclose(parallel[key], values, rtol=1e-12, atol=1e-12), key
+    print(f"[OK] {len(cell_lat)} cells on {workers} workers match serial scoring "
+          f"(parallel {parallel_s:.2f}s incl. pool start, serial {serial_s:.2f}s)")
+
+
+if __name__ == "__main__":
+    test_parallel_matches_serial()
@@ -0,0 +1,67 @@
+"""
+Test script for the spatially quantized risk-score cache
+Checks targeted invalidation against a brute-force distance check and that a
+score computed across an invalidation is not cached (no database needed)
+"""
+
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.config import settings
+from app.ml import risk_cache, risk_kernel
+from app.ml.risk_kernel import SCORING_RADIUS_M
+
+
+def _fill(points):
+    for lat, lng in points:
+        risk_cache.get_or_compute(lat, lng, 21, lambda c_lat, c_lng: {"risk_score": 1.0})
+
+
+def test_invalidate_near_matches_brute_force():
+    """invalidate_near evicts exactly the cells whose center is in range"""
+    risk_cache.clear()
+    rng = np.random.default_rng(7)
+    points = np.column_stack((rng.uniform(13.03, 13.13, 3000), rng.uniform(80.22, 80.32, 3000)))
+    _fill(points)
+    cells = sorted({risk_cache.quantize(lat, lng) for lat, lng in points})
+    centers = np.array([risk_cache.cell_center(c) for c in cells])
+
+    lat, lng = 13.0827, 80.2707
+    limit = SCORING_RADIUS_M + settings.risk_cache_cell_meters * np.sqrt(2.0) / 2.0
+    hit = risk_kernel.haversine_np(lat, lng, centers[:, 0], centers[:, 1]) <= limit
+    expected = {c for c, h in zip(cells, hit) if h}
+    assert expected
+    evicted = risk_cache.invalidate_near(lat, lng)
+    assert evicted == len(expected), (evicted, len(expected))
+
+    remaining = {key[0] for key in risk_cache._get_cache().keys()}
+    assert remaining == set(cells) - expected
+    assert set(risk_cache._by_cell) == remaining
+    print(f"[OK] invalidate_near evicted {evicted} of {len(cells)} cells (brute force agrees)")
+
+
+def test_invalidation_during_compute_is_not_cached():
+    """A miss whose compute overlaps an invalidation does not store its stale score"""
+    risk_cache.clear()
+    lat, lng = 13.0827, 80.2707
+
+    def compute(c_lat, c_lng):
+        risk_cache.invalidate_near(lat, lng)  # an incident write lands mid-compute
+        return {"risk_score": 1.0}
+
+    risk_cache.get_or_compute(lat, lng, 21, compute)
+    assert len(risk_cache._get_cache()) == 0
+
+    risk_cache.get_or_compute(lat, lng, 21, lambda c_lat, c_lng: {"risk_score": 2.0})
+    assert risk_cache.get_or_compute(lat, lng, 21, compute)["risk_score"] == 2.0
+    risk_cache.clear()
+    print("[OK] score computed across an invalidation was not cached")
+
+
+if __name__ == "__main__":
+    test_invalidate_near_matches_brute_force()
+    test_invalidation_during_compute_is_not_cached()
@@ -0,0 +1,111 @@
+"""
+Test script for the precomputed risk raster
+Checks interpolated lookups against exact scoring and dirty-tile rebuilds
+against a full build (no database needed, incidents come from an in-memory
+snapshot)
+"""
+
+import sys
+import os
+import random
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.config import settings
+from app.data.chennai_mock_data import generate_chennai_incidents
+from app.db import storage
+from app.ml import risk_raster
+from app.ml.risk_scoring import calculate_risk_score
+from test_vectorized_scoring import _as_rows, _mock_store
+
+# Central Chennai, 200m nodes
+BOUNDS = {"lat_min": 13.03, "lat_max": 13.11, "lng_min": 80.22, "lng_max": 80.30, "cell_meters": 200.0}
+
+
+def _with_bounds(fn):
+    saved = {key: getattr(settings, f"risk_raster_{key}") for key in BOUNDS}
+    for key, value in BOUNDS.items():
+        setattr(settings, f"risk_raster_{key}", value)
+    try:
+        rows = _as_rows(generate_chennai_incidents(count=3000, start_date_days_ago=180))
+        with _mock_store(rows):
+            fn(rows)
+    finally:
+        for key, value in saved.items():
+            setattr(settings, f"risk_raster_{key}", value)
+        risk_raster._state = None
+        risk_raster._dirty_tiles.clear()
+
+
+def _check_lookup_matches_exact(rows):
+    risk_raster.build_raster()
+    grid = risk_raster._state["grid"]
+    now = datetime.now(timezone.utc)
+    rng = random.Random(3)
+
+    # Grid nodes hold the exact score
+    for _ in range(50):
+        i, j, hour = rng.randrange(grid["ny"]), rng.randrange(grid["nx"]), rng.randrange(24)
+        lat = grid["lat0"] + i * grid["dlat"]
+        lng = grid["lng0"] + j * grid["dlng"]
+        node = risk_raster.lookup_risk(lat, lng, hour)
+        exact = calculate_risk_score(lat, lng, query_timestamp=now, local_hour=hour, exact=True)
+        assert abs(node["risk_score"] - exact["risk_score"]) <= 0.011, (lat, lng, hour, node, exact)
+
+    # Between nodes the interpolation error stays small
+    errors = []
+    for _ in range(300):
+        lat = rng.uniform(BOUNDS["lat_min"], BOUNDS["lat_max"])
+        lng = rng.uniform(BOUNDS["lng_min"], BOUNDS["lng_max"])
+        hour = rng.randrange(24)
+        interpolated = risk_raster.lookup_risk(lat, lng, hour)["risk_score"]
+        exact = calculate_risk_score(lat, lng, query_timestamp=now, local_hour=hour, exact=True)["risk_score"]
+        errors.append(abs(interpolated - exact))
+    assert np.mean(errors) < 0.2, np.mean(errors)
+    assert risk_raster.lookup_risk(10.0, 78.0, 12) is None
+    print(f"[OK] Raster lookups match exact scoring (nodes exact, mean error {np.mean(errors):.2f} "
+          f"max {np.max(errors):.2f} between nodes)")
+
+
+def _check_dirty_tiles_match_full_build(rows):
+    risk_raster.build_raster()
+    version = risk_raster._state["version"]
+    rng = random.Random(5)
+    for k in range(20):
+        incident = dict(rows[rng.randrange(len(rows))], id=f"added-{k}")
+        incident["latitude"] = rng.uniform(BOUNDS["lat_min"], BOUNDS["lat_max"])
+        incident["longitude"] = rng.uniform(BOUNDS["lng_min"], BOUNDS["lng_max"])
+        incident["timestamp"] = datetime.now(timezone.utc)
+        storage._notify_change("added", incident)
+        risk_raster.mark_dirty(incident["latitude"], incident["longitude"])
+
+    dirty = len(risk_raster._dirty_tiles)
+    rebuilt = risk_raster.rebuild_dirty_tiles()
+    assert rebuilt == dirty > 0 and not risk_raster._dirty_tiles
+    assert risk_raster._state["version"] == version + 1
+    values = risk_raster._state["values"].copy()
+    raw = risk_raster._state["raw_incident_count"].copy()
+
+    risk_raster.build_raster()
+    # Only recency decay between the two builds differs
+    assert np.array_equal(raw, risk_raster._state["raw_incident_count"])
+    assert np.allclose(values, risk_raster._state["values"], atol=1e-3)
+    print(f"[OK] {rebuilt} rebuilt dirty tiles match a full build")
+
+
+def test_raster_lookup_matches_exact():
+    """Interpolated raster lookups against exact scoring"""
+    _with_bounds(_check_lookup_matches_exact)
+
+
+def test_dirty_tiles_match_full_build():
+    """Incremental tile rebuild after writes equals a full rebuild"""
+    _with_bounds(_check_dirty_tiles_match_full_build)
+
+
+if __name__ == "__main__":
+    test_raster_lookup_matches_exact()
+    test_dirty_tiles_match_full_build()
@@ -0,0 +1,381 @@
+"""
+Test script to verify the vectorized risk kernel
+Compares it against the per-incident reference implementation (no database
+needed); run as a script it also reports the per-call time of both
+"""
+
+import sys
+import os
+import math
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.config import settings
+from app.data.chennai_mock_data import generate_chennai_incidents
+from app.ml import risk_kernel
+from app.ml.risk_scoring import (
+    _calculate_risk_score_from_columns,
+    _calculate_risk_score_from_incidents,
+    _incident_hour_local,
+    _time_of_day_similarity_weight,
+    calculate_recency_weight,
+    calculate_time_of_day_factor,
+)
+from app.utils.geospatial import calculate_distance_haversine
+
+# Rounded outputs may differ by one unit in the last place at rounding boundaries
+SCORE_TOLERANCE = 0.011
+FACTOR_TOLERANCE = 0.0011
+
+
+def _scalar_risk_score(lat, lng, incidents, query_timestamp=None, local_hour=None, radius_meters=1000.0):
+    """Per-incident loop implementation of the risk model (reference for the vectorized kernel)"""
+    now = query_timestamp if query_timestamp else datetime.now(timezone.utc)
+    query_local_hour = local_hour if local_hour is not None else now.hour
+    current_time_factor = calculate_time_of_day_factor(query_local_hour)
+
+    if not incidents:
+        base_risk = current_time_factor * 1.5
+        return {
+            "risk_score": round(base_risk, 2),
+            "risk_level": "safe" if base_risk < 2.0 else "medium",
+            "factors": {
+                "incident_density": 0.0,
+                "recency": 0.0,
+                "severity": 0.0,
+                "time_pattern": round(current_time_factor, 3),
+                "current_time_factor": round(current_time_factor, 3),
+                "raw_incident_count": 0,
+                "effective_incident_count": 0.0,
+            },
+        }
+
+    weighted_severity = 0.0
+    # Distance+time weighted average recency (kept in [0,1])
+    weighted_recency_numer = 0.0
+    weighted_recency_denom = 0.0
+    total_weight = 0.0
+    effective_incident_count = 0.0
+
+    # Pre-filter to within radius_meters (matches original PostGIS query semantics)
+    nearby_incidents = []
+    for inc in incidents:
+        try:
+            d_m = calculate_distance_haversine(lat, lng, inc["latitude"], inc["longitude"])
+            if d_m <= radius_meters:
+                nearby_incidents.append(inc)
+        except Exception:
+            continue
+
+    if not nearby_incidents:
+        # If nothing is within radius, fall back to time-only base risk
+        base_risk = current_time_factor * 1.5
+        return {
+            "risk_score": round(base_risk, 2),
+            "risk_level": "safe" if base_risk < 2.0 else "medium",
+            "factors": {
+                "incident_density": 0.0,
+                "recency": 0.0,
+                "severity": 0.0,
+                "time_pattern": round(current_time_factor, 3),
+                "current_time_factor": round(current_time_factor, 3),
+                "raw_incident_count": 0,
+                "effective_incident_count": 0.0,
+            },
+        }
+
+    for incident in nearby_incidents:
+        distance_meters = calculate_distance_haversine(
+            lat, lng, incident["latitude"], incident["longitude"]
+        )
+        distance_weight = math.exp(-distance_meters / 111.0)
+
+        # Timestamp parsing / normalization (timezone-aware)
+        incident_timestamp = incident["timestamp"]
+        if isinstance(incident_timestamp, datetime):
+            if incident_timestamp.tzinfo is None:
+                incident_timestamp = incident_timestamp.replace(tzinfo=timezone.utc)
+        elif isinstance(incident_timestamp, str):
+            incident_timestamp = datetime.fromisoformat(
+                incident_timestamp.replace("Z", "+00:00")
+            )
+        else:
+            continue
+
+        days_ago = (now - incident_timestamp).total_seconds() / 86400
+        recency_weight = calculate_recency_weight(days_ago)
+
+        # Time-of-day similarity: incidents that occurred around the current local time-of-day
+        # contribute more than incidents that happened at very different hours.
+        inc_hour_local = _incident_hour_local(incident)
+        if inc_hour_local is None:
+            inc_hour_local = query_local_hour
+        time_weight = _time_of_day_similarity_weight(query_local_hour, inc_hour_local)
+
+        weight = distance_weight * recency_weight * time_weight
+        effective_incident_count += recency_weight * time_weight
+
+        weighted_severity += incident["severity"] * weight
+        weighted_recency_numer += recency_weight * distance_weight * time_weight
+        weighted_recency_denom += distance_weight * time_weight
+        total_weight += weight
+
+    # Density (recency-aware effective count) with calibrated max
+    max_expected = max(1.0, float(getattr(settings, "max_expected_effective_incidents", 10.0)))
+    incident_density = (
+        math.log(effective_incident_count + 1) / math.log(max_expected + 1)
+        if effective_incident_count > 0
+        else 0.0
+    )
+    incident_density = max(0.0, min(1.0, incident_density))
+
+    avg_recency = (
+        (weighted_recency_numer / weighted_recency_denom) if weighted_recency_denom > 0 else 0.0
+    )
+    avg_severity = weighted_severity / total_weight if total_weight > 0 else 0.0
+    avg_severity = avg_severity / 5.0
+
+    # Time window matching (historical pattern near this location)
+    night_window = [21, 22, 23, 0, 1, 2, 3, 4]
+    evening_window = [18, 19, 20]
+    afternoon_window = [12, 13, 14, 15, 16, 17]
+    morning_window = [6, 7, 8, 9, 10, 11]
+
+    night_incidents = 0
+    evening_incidents = 0
+    afternoon_incidents = 0
+    morning_incidents = 0
+
+    for incident in nearby_incidents:
+        incident_hour = _incident_hour_local(incident)
+        if incident_hour is None:
+            continue
+
+        if incident_hour in night_window:
+            night_incidents += 1
+        elif incident_hour in evening_window:
+            evening_incidents += 1
+        elif incident_hour in afternoon_window:
+            afternoon_incidents += 1
+        elif incident_hour in morning_window:
+            morning_incidents += 1
+
+    pattern_counts = {
+        "night": night_incidents,
+        "evening": evening_incidents,
+        "afternoon": afternoon_incidents,
+        "morning": morning_incidents,
+    }
+    total_incidents_by_time = sum(pattern_counts.values())
+
+    if total_incidents_by_time > 0:
+        night_ratio = night_incidents / total_incidents_by_time
+        evening_ratio = evening_incidents / total_incidents_by_time
+        afternoon_ratio = afternoon_incidents / total_incidents_by_time
+        morning_ratio = morning_incidents / total_incidents_by_time
+
+        dominant_pattern = max(pattern_counts, key=pattern_counts.get)
+
+        current_hour_matches_pattern = False
+        match_strength = 0.0
+
+        if query_local_hour in night_window and dominant_pattern == "night":
+            current_hour_matches_pattern = True
+            match_strength = night_ratio
+        elif query_local_hour in evening_window and dominant_pattern == "evening":
+            current_hour_matches_pattern = True
+            match_strength = evening_ratio
+        elif query_local_hour in afternoon_window and dominant_pattern == "afternoon":
+            current_hour_matches_pattern = True
+            match_strength = afternoon_ratio
+        elif query_local_hour in morning_window and dominant_pattern == "morning":
+            current_hour_matches_pattern = True
+            match_strength = morning_ratio
+
+        location_time_pattern = current_time_factor
+        if current_hour_matches_pattern and match_strength > 0.5:
+            location_time_pattern = 0.9 + (match_strength * 0.1)
+        elif current_hour_matches_pattern and match_strength > 0.3:
+            location_time_pattern = 0.7 + (match_strength * 0.2)
+        elif current_hour_matches_pattern:
+            location_time_pattern = 0.5 + (match_strength * 0.2)
+        else:
+            location_time_pattern = current_time_factor * 0.6
+
+        time_pattern = (location_time_pattern * 0.7) + (current_time_factor * 0.3)
+    else:
+        time_pattern = current_time_factor
+
+    risk_score = (
+        settings.weight_incident_density * incident_density
+        + settings.weight_recency * avg_recency
+        + settings.weight_severity * avg_severity
+        + settings.weight_time_pattern * time_pattern
+    ) * 5.0
+    risk_score = max(0.0, min(5.0, risk_score))
+
+    if risk_score <= 1.0:
+        risk_level = "very_safe"
+    elif risk_score <= 2.0:
+        risk_level = "safe"
+    elif risk_score <= 3.0:
+        risk_level = "medium"
+    elif risk_score <= 4.0:
+        risk_level = "high"
+    else:
+        risk_level = "very_high"
+
+    return {
+        "risk_score": round(risk_score, 2),
+        "risk_level": risk_level,
+        "factors": {
+            "incident_density": round(incident_density, 3),
+            "recency": round(avg_recency, 3),
+            "severity": round(avg_severity, 3),
+            "time_pattern": round(time_pattern, 3),
+            "current_time_factor": round(current_time_factor, 3),
+            "raw_incident_count": len(nearby_incidents),
+            "effective_incident_count": round(effective_incident_count, 3),
+        },
+        "calculated_at": now.isoformat(),
+    }
+
+
+def _as_rows(incidents):
+    """Convert generated IncidentRequests into storage-style dicts"""
+    rows = []
+    for inc in incidents:
+        tz = inc.timezone_offset_minutes
+        local_hour = (inc.timestamp + timedelta(minutes=tz)).hour if tz is not None else inc.timestamp.hour
+        rows.append({
+            "id": inc.id,
+            "latitude": inc.latitude,
+            "longitude": inc.longitude,
+            "timestamp": inc.timestamp,
+            "timezone_offset_minutes": tz,
+            "incident_local_hour": local_hour,
+            "type": inc.type,
+            "severity": inc.severity,
+            "category": inc.category,
+            "verified": inc.verified,
+            "moderation_reason": None,
+            "user_id": inc.user_id,
+        })
+    return rows
+
+
+def _select(rows, lat_min=None, lat_max=None, lng_min=None, lng_max=None, start_time=None, end_time=None):
+    """storage._query_incidents over a list of rows (same filters and order)"""
+    selected = [
+        dict(r) for r in rows
+        if (lat_min is None or r["latitude"] >= lat_min) and (lat_max is None or r["latitude"] <= lat_max)
+        and (lng_min is None or r["longitude"] >= lng_min) and (lng_max is None or r["longitude"] <= lng_max)
+        and (start_time is None or r["timestamp"] >= start_time) and (end_time is None or r["timestamp"] <= end_time)
+    ]
+    return sorted(selected, key=lambda r: r["timestamp"], reverse=True)
+
+
+@contextmanager
+def _mock_store(rows):
+    """Serve rows (the incidents table, may be appended to) through the in-process snapshot"""
+    from app.db import snapshot, storage
+
+    query_incidents = storage._query_incidents
+    storage._query_incidents = lambda *args, **kwargs: _select(rows, *args, **kwargs)
+    try:
+        snapshot.load_snapshot()
+        yield
+    finally:
+        storage._query_incidents = query_incidents
+        snapshot._state = None
+
+
+def _assert_same(a, b):
+    assert a["risk_level"] == b["risk_level"] or abs(a["risk_score"] - b["risk_score"]) <= SCORE_TOLERANCE, (a, b)
+    assert abs(a["risk_score"] - b["risk_score"]) <= SCORE_TOLERANCE, (a, b)
+    for key, value in b["factors"].items():
+        assert abs(a["factors"][key] - value) <= FACTOR_TOLERANCE, (key, a, b)
+
+
+def test_vectorized_matches_reference():
+    """Vectorized kernel gives the same results as the scalar loop"""
+    incidents = _as_rows(generate_chennai_incidents(count=3000, start_date_days_ago=180))
+    now = datetime.now(timezone.utc)
+
+    test_locations = [
+        (13.0827, 80.2707),  # Central Station
+        (13.0475, 80.2825),  # Marina Beach
+        (13.0710, 80.1980),  # Koyambedu
+        (13.0067, 80.2206),  # Adyar
+        (12.9500, 80.2000),  # Low density
+        (10.0000, 78.0000),  # Far away (no incidents)
+    ]
+
+    for lat, lng in test_locations:
+        for hour in (2, 5, 9, 14, 19, 23):
+            fast = _calculate_risk_score_from_incidents(lat, lng, incidents, now, hour)
+            ref = _scalar_risk_score(lat, lng, incidents, now, hour)
+            _assert_same(fast, ref)
+
+    # Empty incident list keeps the time-only base risk shape
+    assert _calculate_risk_score_from_incidents(13.08, 80.27, [], now, 22) == \
+        _scalar_risk_score(13.08, 80.27, [], now, 22)
+
+    print("[OK] Vectorized scoring matches reference implementation")
+
+
+def test_multi_point_matches_single_point():
+    """One multi-point pass (KD-tree pairs) gives the same result as per-point calls"""
+    incidents = _as_rows(generate_chennai_incidents(count=3000, start_date_days_ago=180))
+    columns = risk_kernel.incidents_to_columns(incidents)
+    now = datetime.now(timezone.utc)
+
+    lats = [13.0827, 13.0475, 13.0710, 13.0067, 12.9500, 10.0000]
+    lngs = [80.2707, 80.2825, 80.1980, 80.2206, 80.2000, 78.0000]
+    hours = [22, 5, 9, 14, 19, 2]
+
+    scores = risk_kernel.score_points(lats, lngs, hours, columns, now_ts=now.timestamp())
+    batch = risk_kernel.result_dicts(scores, calculated_at=now.isoformat())
+    for i in range(len(lats)):
+        single = _calculate_risk_score_from_columns(lats[i], lngs[i], columns, now, hours[i])
+        _assert_same(batch[i], single)
+
+    print("[OK] Multi-point scoring matches single-point scoring")
+
+
+def vectorized_benchmark():
+    """Report per-call CPU for both implementations"""
+    incidents = _as_rows(generate_chennai_incidents(count=5000, start_date_days_ago=180))
+    now = datetime.now(timezone.utc)
+    lat, lng = 13.0827, 80.2707
+
+    runs = 20
+    _calculate_risk_score_from_incidents(lat, lng, incidents, now, 22)  # warm-up
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        _scalar_risk_score(lat, lng, incidents, now, 22)
+    scalar_ms = (time.perf_counter() - t0) * 1000 / runs
+
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        _calculate_risk_score_from_incidents(lat, lng, incidents, now, 22)
+    vector_ms = (time.perf_counter() - t0) * 1000 / runs
+
+    columns = risk_kernel.incidents_to_columns(incidents)
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        _calculate_risk_score_from_columns(lat, lng, columns, now, 22)
+    columns_ms = (time.perf_counter() - t0) * 1000 / runs
+
+    print(f"Scalar: {scalar_ms:.2f} ms/call")
+    print(f"Vectorized (dict input): {vector_ms:.2f} ms/call ({scalar_ms / max(vector_ms, 1e-6):.1f}x)")
+    print(f"Vectorized (column input): {columns_ms:.2f} ms/call ({scalar_ms / max(columns_ms, 1e-6):.1f}x)")
+
+
+if __name__ == "__main__":
+    test_vectorized_matches_reference()
+    test_multi_point_matches_single_point()
+    vectorized_benchmark()